@@ -0,0 +1,102 @@
+"""
+Compares the task length minimization with finite difference gradients, with analytic gradients and with the route solver.
+
+Each engine optimizes the test tasks from their takeoff, then replays the warm-started optimizations of Task.validate on every step-th fix of the test flights.
+
+    PYTHONPATH=. python benchmarks/optimizer.py [--flights N] [--step S]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from pygclib.core.flight import Flight
+from pygclib.core.task import Task
+from pygclib.constants import OPTIMIZER_PRECISION
+from pygclib.geography import c_route
+from pygclib.geography.optimizer import _tasklen, _tasklen_gradient, _waypoint_arrays
+from pygclib.tests import TEST_DATA
+from scipy.optimize import minimize
+
+TASKS = ['pwca_brazil_2019_7.xctsk', 'raw_task.json']
+TRACKS = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+
+ENGINES = {
+    'finite differences': {
+        'fun': _tasklen,
+        'jac': None
+    },
+    'analytic gradient': {
+        'fun': _tasklen_gradient,
+        'jac': True
+    },
+    'route solver': None,
+}
+
+
+class Counter():
+
+    def __init__(self):
+        self.calls = 0
+        self.nfev = 0
+        self.nit = 0
+        self.elapsed = 0
+        self.distance = 0
+
+    def optimize(self, engine, position, waypoints, x0):
+        lats, lons, radii = _waypoint_arrays(waypoints)
+        start = time.perf_counter()
+        if engine is None:
+            headings = x0[len(x0) - len(waypoints):].copy()
+            c_route(position.lat, position.lon, lats, lons, radii, headings, x0.any())
+        else:
+            result = minimize(engine['fun'], x0, args=(position.lat, position.lon, lats, lons, radii), jac=engine['jac'], tol=OPTIMIZER_PRECISION)
+            headings = result.x
+            self.nfev += result.nfev
+            self.nit += result.nit
+        self.elapsed += time.perf_counter() - start
+        self.calls += 1
+        self.distance += _tasklen(headings, position.lat, position.lon, lats, lons, radii)
+        return headings
+
+    def __str__(self):
+        return f'{self.calls:6d} calls {self.nfev:8d} evaluations {self.nit:7d} iterations {self.elapsed:8.2f}s {1e6 * self.elapsed / self.calls:8.0f}us/call   sum of distances {self.distance:.0f}m'
+
+
+def replay(engine, task, flight, step, counter):
+    """Optimizes from every step-th fix of flight, validating turnpoints like Task.validate does."""
+    remaining_turnpoints = task.turnpoints.copy()
+    x0 = None
+    for timestamp, point in list(flight.points.items())[::step]:
+        if not remaining_turnpoints:
+            break
+        x0 = counter.optimize(engine, point, remaining_turnpoints, np.zeros(len(remaining_turnpoints)) if x0 is None else x0)
+        if timestamp >= task.start and len(remaining_turnpoints) > 1 and point.close_enough(remaining_turnpoints[0]):
+            del remaining_turnpoints[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flights', type=int, default=3, help='Number of test flights to replay')
+    parser.add_argument('--step', type=int, default=10, help='Replay one fix out of step')
+    args = parser.parse_args()
+
+    tracks = sorted(os.listdir(TRACKS))[:args.flights]
+    flights = [Flight(os.path.join(TRACKS, track)) for track in tracks]
+
+    for task_file in TASKS:
+        task = Task(os.path.join(TEST_DATA, 'tasks', task_file))
+        print(f'{task_file} optimized from takeoff')
+        for name, engine in ENGINES.items():
+            counter = Counter()
+            counter.optimize(engine, task.takeoff, task.turnpoints, np.zeros(len(task.turnpoints)))
+            print(f'    {name:20s} {counter}')
+
+    task = Task(os.path.join(TEST_DATA, 'tasks', TASKS[0]))
+    print(f'{TASKS[0]} validation of {len(flights)} flights, one fix out of {args.step}')
+    for name, engine in ENGINES.items():
+        counter = Counter()
+        for flight in flights:
+            replay(engine, task, flight, args.step, counter)
+        print(f'    {name:20s} {counter}')
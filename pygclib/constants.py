@@ -1,5 +1,6 @@
-import re
 import datetime
+import os
+import re
 
 DEBUG = False
 
@@ -11,6 +12,42 @@ TOLERANCE = 0.001
 # threshold of distance minimizer validation in meters
 OPTIMIZER_PRECISION = 5
 
+# task distance minimizer, one of OPTIMIZER_ENGINES
+# field is the default instead of bfgs, which stops up to about 120 m above the shortest route : the task distance of pwca_brazil_2019_7 went from 94357 m with the baseline bfgs to 94265 m
+OPTIMIZER_ENGINE = os.environ.get('PYGCLIB_OPTIMIZER', 'field')
+OPTIMIZER_ENGINES = ['field', 'route', 'bfgs']
+
+# maximum error of the goal distances computed during validation in meters, every goal distance is optimized if 0
+VALIDATION_TOLERANCE = float(os.environ.get('PYGCLIB_TOLERANCE', 0))
+
+# number of worker processes or threads of a race, the number of CPUs if 0, and the kind of workers, one of EXECUTOR_BACKENDS
+JOBS = int(os.environ.get('PYGCLIB_JOBS', 0))
+EXECUTOR_BACKEND = os.environ.get('PYGCLIB_EXECUTOR', 'process')
+EXECUTOR_BACKENDS = ['process', 'thread', 'serial']
+
+# transfer flights to the worker processes through shared memory blocks instead of pickling them
+SHARED_MEMORY = os.environ.get('PYGCLIB_SHARED_MEMORY', '0') == '1'
+
+# headings sampled around each cylinder by the goal distance field, and on the coarse grid of its minimization
+FIELD_SAMPLES = 360
+FIELD_SEARCH_SAMPLES = 72
+
+# geodesy mode of distance computations, one of GEODESY_MODES, projected being an equirectangular plane scaled at the latitude of the task centroid
+GEODESY = os.environ.get('PYGCLIB_GEODESY', 'exact')
+GEODESY_MODES = ['exact', 'haversine', 'projected']
+
+# maximum relative distance error of each geodesy mode, between points less than 1° of latitude away from the task centroid
+GEODESY_MAX_ERROR = {'exact': 0, 'haversine': 0.006, 'projected': 0.0002}
+
+### PILOT FEATURES ###
+
+# number of nearest pilots compared to each pilot, and the horizontal distance in meters beyond which pilots are not compared
+NEIGHBOURS = 5
+NEIGHBOURS_RADIUS = 5000
+
+# horizontal distance in meters under which pilots are in the same gaggle, gaggles being chains of such pilots
+GAGGLE_RADIUS = 500
+
 ### IGC FILE CONSTANTS ###
 
 IGC_RECORDS = 'fix_records'
@@ -19,9 +56,25 @@ IGC_TZ_OFFSET = 'time_zone_offset'
 IGC_PILOT_NAME = 'pilot'
 IGC_TIME = 'time'
 IGC_ALTITUDE = 'gps_alt'
+IGC_PRESSURE_ALTITUDE = 'pressure_alt'
 IGC_LAT = 'lat'
 IGC_LON = 'lon'
 
+### PARSED FLIGHTS CACHE ###
+
+FLIGHT_CACHE_DIR = os.environ.get('PYGCLIB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'pygclib', 'flights'))
+
+# size budget of the cache in megabytes, least recently used flights are evicted above it
+FLIGHT_CACHE_SIZE = int(os.environ.get('PYGCLIB_CACHE_SIZE', 1024))
+
+### REPLAY SERVER ###
+
+SERVER_HOST = os.environ.get('PYGCLIB_SERVER_HOST', '127.0.0.1')
+SERVER_PORT = int(os.environ.get('PYGCLIB_SERVER_PORT', 8080))
+
+# size budget of the encoded frame chunks kept in memory in megabytes, least recently used chunks are evicted above it
+SERVER_CACHE_SIZE = int(os.environ.get('PYGCLIB_SERVER_CACHE_SIZE', 256))
+
 ### XCTRACK FILE CONSTANTS ### (https://xctrack.org/Competition_Interfaces.html)
 
 XC_TIME_FORMAT = '%H:%M:%SZ'
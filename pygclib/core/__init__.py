@@ -1,37 +1,43 @@
-import json
 import logging
 import os
 import pickle
+import sys
 
-from pygclib.serialization.json_encoder import ComplexEncoder
+from pygclib.serialization.json_writer import JSONWriter
 
 
 class BaseObject:
 
-    def save(self, output):
+    def save(self, output, compact=False, **options):
         """
         Saves the object instance to each file specified by output.
             * If output is a list, this method calls itself with each element of the list.
-            * If output is a JSON file (.json), a human-readable, serialized version of the object is written.
+            * If output is a JSON file (.json), a human-readable, serialized version of the object is written, or a compact one without whitespace if compact is set.
             * If output is a pickle file (.pkl), a binary version of the object is written, allowing for faster loading times in the subsequent uses.
             * If output is -, the JSON serialization is written to the standard output.
 
-        Classes inheriting from this base object must redefine the serialize method.
+        Classes inheriting from this base object must redefine the serialize method, which is called with the remaining keyword arguments.
+
+        The serialization is written incrementally, so that objects whose serialize method returns :class:`~pygclib.serialization.json_writer.Stream` members
+        never have to fit in memory.
 
         Arguments:
             output (str) : File to which the output is written.
+            compact (bool) : Whether JSON files are written without indentation.
+            options : Keyword arguments of the serialize method, such as the window of the snapshots of a race.
         """
         if isinstance(output, list):
             for out in output:
-                self.save(out)
+                self.save(out, compact=compact, **options)
         elif output.endswith('.pkl'):
             with open(output, 'wb') as f:
                 pickle.dump(self.dump(), f)
         elif output.endswith('.json'):
             with open(output, 'w', encoding='utf8') as f:
-                json.dump(self.serialize(), f, cls=ComplexEncoder, ensure_ascii=False, indent=2)
+                JSONWriter(f, indent=None if compact else 2).write(self.serialize(**options))
         elif output == '-':
-            print(json.dumps(self.serialize(), cls=ComplexEncoder, ensure_ascii=False))
+            JSONWriter(sys.stdout).write(self.serialize(**options))
+            print()
         else:
             raise ValueError(f'Output must be in [*.json, *.pkl, -] but is {output}')
 
@@ -1,6 +1,7 @@
 import logging
 
-from pygclib.geography import destination
+import numpy as np
+from pygclib.geography import destination_many
 from pygclib.geography.converters import parse_altitude
 from pygclib.geography.geo import Arc
 from shapely.geometry import Polygon
@@ -63,20 +64,21 @@ class Airspace:
         if self.polygon:
             bounds = list(self.polygon.bounds)
         if self.arcs:
-            north_points = []
-            south_points = []
-            east_points = []
-            west_points = []
-            for arc in self.arcs:
-                north_points.append(destination(arc, arc.radius, NORTH)[0])
-                south_points.append(destination(arc, arc.radius, SOUTH)[0])
-                east_points.append(destination(arc, arc.radius, EAST)[1])
-                west_points.append(destination(arc, arc.radius, WEST)[1])
+            # one batch call projects every arc center towards the four cardinal points
+            lats = np.repeat([arc.lat for arc in self.arcs], 4)
+            lons = np.repeat([arc.lon for arc in self.arcs], 4)
+            radii = np.repeat([arc.radius for arc in self.arcs], 4)
+            headings = np.tile([NORTH, SOUTH, EAST, WEST], len(self.arcs))
+            cardinal_lats, cardinal_lons = destination_many(lats, lons, radii, headings)
+            north_points = cardinal_lats[0::4]
+            south_points = cardinal_lats[1::4]
+            east_points = cardinal_lons[2::4]
+            west_points = cardinal_lons[3::4]
             if bounds:
-                bounds[0] = min(bounds[0], min(south_points))
-                bounds[1] = min(bounds[1], min(west_points))
-                bounds[2] = max(bounds[2], max(north_points))
-                bounds[3] = max(bounds[0], max(east_points))
+                bounds[0] = min(bounds[0], south_points.min())
+                bounds[1] = min(bounds[1], west_points.min())
+                bounds[2] = max(bounds[2], north_points.max())
+                bounds[3] = max(bounds[0], east_points.max())
             else:
-                bounds = min(south_points), min(west_points), max(north_points), max(east_points)
+                bounds = south_points.min(), west_points.min(), north_points.max(), east_points.max()
         return bounds
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+from pygclib.constants import FLIGHT_CACHE_DIR, FLIGHT_CACHE_SIZE
+from pygclib.core.flight import Flight
+from pygclib.parsers.igcparse import PARSER_VERSION
+
+CACHE_COLUMNS = ['seconds', 'lat', 'lon', 'altitude', 'pressure_altitude']
+# seconds after which a temporary file is considered left by an interrupted write
+TMP_MAX_AGE = 3600
+
+
+class FlightCache():
+    """
+    On-disk cache of parsed flights, indexed by the content of their IGC file.
+
+    Each entry is an uncompressed .npz archive of the fix columns of a Flight, named after a hash of the IGC file bytes and of the parser version.
+    Reading an entry refreshes its modification time, and the least recently used entries are evicted when the cache grows above its size budget.
+
+    Keyword Arguments:
+        directory (str): Directory of the cache entries.
+        max_size (int): Size budget of the cache, in megabytes.
+
+    Attributes:
+        hits (int) : Number of flights read from the cache.
+        misses (int) : Number of flights which were not in the cache.
+    """
+
+    def __init__(self, directory=FLIGHT_CACHE_DIR, max_size=FLIGHT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(content):
+        """Returns the cache key of an IGC file content."""
+        return f'{hashlib.sha256(content).hexdigest()}-v{PARSER_VERSION}'
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key, pilot_id):
+        """Returns the cached Flight of pilot_id, or None if key is not in the cache. Corrupted entries are removed."""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                flight = Flight.from_columns(pilot_id, str(entry['pilot_name']), *(entry[c] for c in CACHE_COLUMNS))
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            logging.warning(f'removing corrupted cache entry {path}')
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return flight
+
+    def put(self, key, flight):
+        """Stores flight under key. Call :meth:`evict` once done storing to enforce the size budget."""
+        buffer = io.BytesIO()
+        np.savez(buffer, pilot_name=flight.pilot_name, **{c: getattr(flight, c) for c in CACHE_COLUMNS})
+
+        # write then rename so that concurrent runs never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        """Removes the temporary files left by interrupted writes, then the least recently used entries until the cache fits in its size budget."""
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith('.tmp') and now - entry.stat().st_mtime > TMP_MAX_AGE:
+                # younger files may still be written by a concurrent run
+                self._remove(entry.path)
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if self._remove(path):
+                total_size -= size
+
+    @staticmethod
+    def _remove(path):
+        """Removes path, returning whether it was still there."""
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            logging.debug(f'{path} was already evicted')
+            return False
+
+    def __str__(self):
+        return f'{self.hits} hits, {self.misses} misses'
@@ -0,0 +1,111 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pygclib.constants import EXECUTOR_BACKEND, EXECUTOR_BACKENDS, JOBS
+
+# number of chunks per worker, so that workers finishing early can take over the remaining chunks
+CHUNKS_PER_JOB = 4
+
+
+class Executor():
+    """
+    Pool of workers running the stages of a race, started on first use and reused by every stage until closed.
+
+    Items are run largest first, so that the longest flights do not finish last. Consecutive small items are grouped in chunks
+    of about the same size, which saves round trips between processes without leaving a worker behind with a long chunk.
+
+    Keyword Arguments:
+        jobs (int): Number of workers, defaults to the number of CPUs if 0.
+        backend (str): One of EXECUTOR_BACKENDS. process runs items in worker processes, thread in worker threads of the current process,
+            serial in the current thread in order, which keeps tracebacks and breakpoints usable.
+        initializer (callable): Called with initargs once in each worker, or once in the current process by the serial backend.
+        initargs (tuple): Arguments of initializer.
+
+    Raises:
+        ValueError: If backend is unknown.
+    """
+
+    def __init__(self, jobs=JOBS, backend=EXECUTOR_BACKEND, initializer=None, initargs=()):
+        if backend not in EXECUTOR_BACKENDS:
+            raise ValueError(f'Executor backend must be in {EXECUTOR_BACKENDS} but is {backend}')
+        self.jobs = jobs if jobs > 0 else multiprocessing.cpu_count()
+        self.backend = backend
+        self._initializer = initializer
+        self._initargs = initargs
+        self._pool = None
+
+    def _start(self):
+        if self.backend == 'process':
+            self._pool = multiprocessing.Pool(self.jobs, initializer=self._initializer, initargs=self._initargs)
+        elif self.backend == 'thread':
+            self._pool = ThreadPoolExecutor(self.jobs, initializer=self._initializer, initargs=self._initargs)
+        else:
+            if self._initializer is not None:
+                self._initializer(*self._initargs)
+            self._pool = True
+
+    def map(self, fn, items, sizes=None):
+        """
+        Yields fn(item) for each item, in completion order.
+
+        Arguments:
+            fn (callable) : A module level function, picklable by the process backend.
+            items (list) : The arguments of fn.
+            sizes (list [int]) : The amount of work of each item, such as its number of fixes. Items are run in the given order if not set.
+        """
+        if self._pool is None:
+            self._start()
+
+        if self.backend == 'serial':
+            for item in items:
+                yield fn(item)
+            return
+
+        chunks = self._chunks(items, sizes)
+        if self.backend == 'process':
+            for results in self._pool.imap_unordered(_run_chunk, [(fn, chunk) for chunk in chunks]):
+                yield from results
+        else:
+            pending = {self._pool.submit(_run_chunk, (fn, chunk)) for chunk in chunks}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+
+    def _chunks(self, items, sizes):
+        """Returns the items sorted by decreasing size, grouped in chunks of about total size / (jobs * CHUNKS_PER_JOB)."""
+        if sizes is None:
+            sizes = [1] * len(items)
+        order = sorted(range(len(items)), key=lambda i: sizes[i], reverse=True)
+        target = sum(sizes) / (self.jobs * CHUNKS_PER_JOB)
+
+        chunks, chunk, chunk_size = [], [], 0
+        for i in order:
+            chunk.append(items[i])
+            chunk_size += sizes[i]
+            if chunk_size >= target:
+                chunks.append(chunk)
+                chunk, chunk_size = [], 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def close(self):
+        """Stops the workers, which are started again if the executor is used afterwards."""
+        if self.backend == 'process' and self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        elif self.backend == 'thread' and self._pool is not None:
+            self._pool.shutdown()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _run_chunk(args):
+    fn, chunk = args
+    return [fn(item) for item in chunk]
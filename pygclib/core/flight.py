@@ -1,71 +1,245 @@
-import logging
 import os
+from collections.abc import ItemsView, Mapping
 from datetime import time
-from functools import lru_cache
 
-from aerofiles import igc
-from pygclib.constants import (IGC_HEADER, IGC_PILOT_NAME, IGC_RECORDS, IGC_TIME, IGC_TZ_OFFSET)
+import numpy as np
+from pygclib.constants import IGC_PILOT_NAME, IGC_TZ_OFFSET
 from pygclib.geography.geo import GeoPoint
-from pygclib.time.timeop import add_offset
+from pygclib.parsers import igcparse
+from pygclib.time.timeop import HALF_DAY, SECONDS_PER_DAY, to_seconds, to_time, unwrap_seconds
 
 
 class Flight():
     """Class representing a Flight
 
+    Fixes are stored column-wise in contiguous NumPy arrays, in the order in which they appear in the IGC file.
+    The :attr:`points` mapping and the indexing operators are thin views building :class:`GeoPoint` instances on demand.
+
+    Attributes:
+        seconds (~numpy.ndarray [int]) : Timestamps of the fixes, in seconds since midnight. See :meth:`timeline` for flights crossing midnight.
+        lat (~numpy.ndarray [float]) : Latitudes of the fixes.
+        lon (~numpy.ndarray [float]) : Longitudes of the fixes.
+        altitude (~numpy.ndarray [int]) : GPS altitudes of the fixes.
+        pressure_altitude (~numpy.ndarray [int]) : Barometric altitudes of the fixes.
+        goal_distance (~numpy.ndarray [float]) : Goal distances of the fixes, NaN until the flight is validated.
+
+    Arguments:
+        igc_file (str) : Path of the IGC file, or its name when content is given.
+        content (bytes) : Raw content of the IGC file, read from igc_file if not given.
     """
 
-    def __init__(self, igc_file):
+    def __init__(self, igc_file, content=None):
 
         self.pilot_id = os.path.splitext(os.path.basename(igc_file))[0]
         self.race_distance = None
         self.race_time = None
 
-        for encoding in ['utf-8', 'iso-8859-1']:
-            try:
-                with open(igc_file, 'r', encoding=encoding) as f:
-                    records = igc.Reader().read(f)
-                    self._build(records)
-                    break
-
-            except UnicodeDecodeError:
-                logging.debug(f'{igc_file} is not {encoding} encoded, trying something else')
-            except ValueError:
-                raise ValueError(f'{igc_file} is empty or is invalid igc')
-
-    def _build(self, records):
-        self.pilot_name = str(records[IGC_HEADER][1].get(IGC_PILOT_NAME, 'Unknown pilot'))
-        self.points = {}
-
-        # if file could not be decoded, it does not have a point attribute
-        if not records[IGC_RECORDS]:
-            raise ValueError(f'File is empty or is invalid igc')
-
-        time_offset = records[IGC_HEADER][1].get(IGC_TZ_OFFSET, 0)
-        for subrecord in records[IGC_RECORDS]:
-            for point in subrecord:
-                adjusted_time = add_offset(point[IGC_TIME], hours=time_offset)
-                self.points[adjusted_time] = GeoPoint(record=point, status='flying')
-
-        first_timestamp = min(self.points)
-        last_timestamp = max(self.points)
-        self._first_point = {'timestamp': first_timestamp, 'point': self.points[first_timestamp]}
-        self._last_point = {'timestamp': last_timestamp, 'point': self.points[last_timestamp]}
+        if content is None:
+            with open(igc_file, 'rb') as f:
+                content = f.read()
+
+        try:
+            header, fixes = igcparse.read(content)
+        except ValueError:
+            raise ValueError(f'{igc_file} is empty or is invalid igc')
+        self._build(header, *fixes)
+
+    @classmethod
+    def from_columns(cls, pilot_id, pilot_name, seconds, lat, lon, altitude, pressure_altitude):
+        """Builds a Flight from already parsed fix columns, with timestamps in seconds since midnight."""
+        columns = _unique_fixes(seconds, lat, lon, altitude, pressure_altitude)
+        return cls.from_arrays(pilot_id, pilot_name, *columns, np.full(len(columns[0]), np.nan))
+
+    def _build(self, header, seconds, lat, lon, altitude, pressure_altitude):
+        self.pilot_name = str(header.get(IGC_PILOT_NAME, 'Unknown pilot'))
+        time_offset = header.get(IGC_TZ_OFFSET, 0)
+        seconds = (seconds + round(3600 * time_offset)) % SECONDS_PER_DAY
+        columns = _unique_fixes(seconds, lat, lon, altitude, pressure_altitude)
+        self._set_columns(*columns, np.full(len(columns[0]), np.nan))
+
+    @classmethod
+    def from_arrays(cls, pilot_id, pilot_name, seconds, lat, lon, altitude, pressure_altitude, goal_distance):
+        """Builds a Flight around the columns of another Flight, without copying them. Arrays may be views of shared memory."""
+        flight = cls.__new__(cls)
+        flight.pilot_id = pilot_id
+        flight.race_distance = None
+        flight.race_time = None
+        flight.pilot_name = pilot_name
+        flight._set_columns(seconds, lat, lon, altitude, pressure_altitude, goal_distance)
+        return flight
+
+    def _set_columns(self, seconds, lat, lon, altitude, pressure_altitude, goal_distance):
+        self.seconds = seconds
+        self.lat = lat
+        self.lon = lon
+        self.altitude = altitude
+        self.pressure_altitude = pressure_altitude
+        self.goal_distance = goal_distance
+
+        # timestamps are not sorted when the flight crosses midnight, in which case the first and last fixes are found on the unwrapped timeline
+        self._order = None if np.all(self.seconds[1:] > self.seconds[:-1]) else np.argsort(self.seconds)
+        timeline = self.timeline() if self._order is not None else self.seconds
+        self._first = int(np.argmin(timeline))
+        self._last = int(np.argmax(timeline))
+
+    def append(self, seconds, lat, lon, altitude, pressure_altitude):
+        """
+        Appends fixes logged after the last fix of the flight, with timestamps in seconds since midnight.
+
+        Fixes which are not after the previous fix are dropped. Columns grow in buffers of doubling capacity,
+        so that appending fixes takes a time proportional to their number. Their goal distances are NaN until they are validated.
+
+        Returns:
+            int : The index of the first appended fix.
+        """
+        first = len(self)
+        # fixes are counted from the last fix, each step being folded within half a day, so that flights keep going across midnight
+        # and fixes sent again from before midnight are not taken for fixes of the next day
+        steps = np.diff(np.concatenate(([self.seconds[self._last]], seconds)).astype(np.int64))
+        offsets = np.cumsum((steps + HALF_DAY) % SECONDS_PER_DAY - HALF_DAY)
+        kept = offsets > np.maximum.accumulate(np.concatenate(([0], offsets)))[:-1]
+        new_columns = (np.asarray(seconds)[kept], np.asarray(lat)[kept], np.asarray(lon)[kept], np.asarray(altitude)[kept], np.asarray(pressure_altitude)[kept], np.full(np.count_nonzero(kept), np.nan))
+        total = first + len(new_columns[0])
+
+        columns = ('seconds', 'lat', 'lon', 'altitude', 'pressure_altitude', 'goal_distance')
+        buffers = getattr(self, '_buffers', None)
+        if buffers is None or len(buffers['seconds']) < total:
+            capacity = max(2 * total, 16)
+            buffers = {}
+            for column in columns:
+                values = getattr(self, column)
+                buffers[column] = np.empty(capacity, dtype=values.dtype)
+                buffers[column][:first] = values
+            self._buffers = buffers
+        for column, values in zip(columns, new_columns):
+            buffers[column][first:total] = values
+            setattr(self, column, buffers[column][:total])
+
+        # fixes after midnight are logged before the previous ones, fixes are then found on the unwrapped timeline
+        if self._order is not None or (total > first and self.seconds[first] <= self.seconds[first - 1]) or np.any(np.diff(self.seconds[first:]) <= 0):
+            self._order = self._merge_order(first)
+        self._last = total - 1
+        return first
+
+    def _merge_order(self, first):
+        """Returns the order of the timestamps, merging the sorted fixes from index first into the order of the previous fixes instead of sorting them all again."""
+        order = np.arange(first) if self._order is None else self._order
+        tail = first + np.argsort(self.seconds[first:], kind='stable')
+        return np.insert(order, np.searchsorted(self.seconds[order], self.seconds[tail]), tail)
+
+    def __getstate__(self):
+        # growing columns are pickled without the unused capacity of their buffers
+        state = self.__dict__.copy()
+        state.pop('_buffers', None)
+        return state
+
+    def __setstate__(self, state):
+        # flights pickled before fixes were stored in columns hold a dict of GeoPoints indexed by time, in the order of the IGC file
+        points = state.pop('points', None)
+        state.pop('_first_point', None)
+        state.pop('_last_point', None)
+        self.__dict__.update(state)
+        if points is not None:
+            self._set_points(points)
+
+    def _set_points(self, points):
+        """Sets the columns of the flight from a dict of GeoPoints indexed by time, whose pressure altitudes were not kept."""
+        seconds = np.fromiter((to_seconds(t) for t in points), dtype=np.int32, count=len(points))
+        lat = np.fromiter((p.lat for p in points.values()), dtype=np.float64, count=len(points))
+        lon = np.fromiter((p.lon for p in points.values()), dtype=np.float64, count=len(points))
+        altitude = np.fromiter((p.altitude for p in points.values()), dtype=np.int32, count=len(points))
+        goal_distance = np.fromiter((np.nan if p.goal_distance is None else p.goal_distance for p in points.values()), dtype=np.float64, count=len(points))
+        self._set_columns(seconds, lat, lon, altitude, np.zeros(len(points), dtype=np.int32), goal_distance)
+
+    def timeline(self, reference=None):
+        """
+        Returns the timestamps of the fixes, increasing across midnight.
+
+        Arguments:
+            reference (int) : A time in seconds since midnight, such as the start of a task. Timestamps are counted from the midnight preceding it.
+        """
+        return unwrap_seconds(self.seconds, reference)
+
+    def _index(self, timestamp):
+        """Returns the index of the fix logged at timestamp, or None if there is no such fix."""
+        second = to_seconds(timestamp)
+        sorted_seconds = self.seconds if self._order is None else self.seconds[self._order]
+        position = np.searchsorted(sorted_seconds, second)
+        if position == len(sorted_seconds) or sorted_seconds[position] != second:
+            return None
+        return int(position if self._order is None else self._order[position])
+
+    def _point(self, index):
+        goal_distance = None if np.isnan(self.goal_distance[index]) else float(self.goal_distance[index])
+        return GeoPoint.from_fix(float(self.lat[index]), float(self.lon[index]), int(self.altitude[index]), goal_distance)
+
+    @property
+    def points(self):
+        return FlightPoints(self)
+
+    @property
+    def _first_point(self):
+        return {'timestamp': to_time(self.seconds[self._first]), 'point': self._point(self._first)}
+
+    @property
+    def _last_point(self):
+        return {'timestamp': to_time(self.seconds[self._last]), 'point': self._point(self._last)}
 
     def __getitem__(self, key):
         if isinstance(key, time):
-            return self.points.get(key, None)
-        elif isinstance(key, int):
-            return self.to_list()[key]
+            index = self._index(key)
+            return None if index is None else self._point(index)
+        elif isinstance(key, (int, np.integer)):
+            return self._point(range(len(self))[key])
         else:
             raise ValueError(f'key must be of type int or time but is {type(key)}')
 
-    # we should probably used @cached_property but it only exists in python >= 3.8
-    @lru_cache()
     def to_list(self):
-        return list(self.points.values())
+        return [self._point(i) for i in range(len(self))]
 
     def __str__(self):
         return self.pilot_name
 
     def __len__(self):
-        return len(self.to_list())
+        return len(self.seconds)
+
+
+class FlightPoints(Mapping):
+    """Read-only mapping of the fixes of a Flight, indexed by :class:`~datetime.time`."""
+
+    def __init__(self, flight):
+        self._flight = flight
+
+    def __getitem__(self, timestamp):
+        index = self._flight._index(timestamp)
+        if index is None:
+            raise KeyError(timestamp)
+        return self._flight._point(index)
+
+    def __iter__(self):
+        return (to_time(s) for s in self._flight.seconds)
+
+    def __len__(self):
+        return len(self._flight)
+
+    def items(self):
+        return FlightItems(self)
+
+
+class FlightItems(ItemsView):
+    """Items of a FlightPoints mapping, iterated in fix order without looking up each timestamp."""
+
+    def __iter__(self):
+        flight = self._mapping._flight
+        for index, second in enumerate(flight.seconds):
+            yield to_time(second), flight._point(index)
+
+
+def _unique_fixes(seconds, lat, lon, altitude, pressure_altitude):
+    """Returns the fix columns with one fix per timestamp : a timestamp logged several times keeps its first position but the values of its last fix."""
+    _, first = np.unique(seconds, return_index=True)
+    _, last = np.unique(seconds[::-1], return_index=True)
+    order = np.argsort(first)
+    first = first[order]
+    last = len(seconds) - 1 - last[order]
+    return seconds[first], lat[last], lon[last], altitude[last], pressure_altitude[last]
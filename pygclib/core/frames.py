@@ -0,0 +1,148 @@
+import numpy as np
+from pygclib.geography.geo import GeoPoint
+from pygclib.time.timeop import seconds_after, to_seconds, to_time, unwrap_seconds
+
+
+class RaceFrames():
+    """
+    Dense view of the flights of a race every step seconds, between the task opening and the task deadline or a narrower window.
+
+    Each attribute is a (pilots x frames) matrix, computed only for the given flights and the frames of the window. A pilot is present at a second if its flight has a fix at this second,
+    or if the second is before its first fix or after its last fix, in which case the first or last fix is repeated.
+    Frames may span midnight, flights crossing midnight being unwrapped.
+
+    Arguments:
+        flights (dict [str, Flight]) : A collection of Flights indexed by pilot ID.
+        start (~datetime.time) : The first second of the frames.
+        stop (~datetime.time) : The second following the last frame.
+        step (int) : The number of seconds between two frames.
+
+    Attributes:
+        pilots (list [str]) : The pilot IDs, in row order.
+        start (int) : The first second of the frames, in seconds since midnight. Columns are counted from it.
+        step (int) : The number of seconds between two frames.
+        present (~numpy.ndarray [bool]) : Whether the pilot is part of the snapshot.
+        lat (~numpy.ndarray [float]) : Latitudes of the pilots.
+        lon (~numpy.ndarray [float]) : Longitudes of the pilots.
+        altitude (~numpy.ndarray [int]) : GPS altitudes of the pilots.
+        goal_distance (~numpy.ndarray [float]) : Goal distances of the pilots, NaN if not validated.
+    """
+
+    def __init__(self, flights, start, stop, step=1):
+        if step < 1:
+            raise ValueError(f'Frames step must be a positive number of seconds but is {step}')
+        self.pilots = list(flights)
+        self.start = to_seconds(start)
+        self.step = step
+        shape = (len(self.pilots), -(-(seconds_after(stop, self.start) - self.start) // step))
+
+        self.present = np.zeros(shape, dtype=bool)
+        self.lat = np.full(shape, np.nan)
+        self.lon = np.full(shape, np.nan)
+        self.altitude = np.zeros(shape, dtype=np.int32)
+        self.goal_distance = np.full(shape, np.nan)
+
+        for row, flight in enumerate(flights.values()):
+            self._set_row(row, flight)
+
+    def update(self, flight, first=0):
+        """
+        Updates the frames of flight from its fix at index first, such as the fixes appended to a live flight and the fixes whose goal distance changed.
+
+        Only the frames from the first fix on are written, the pilot being added to the frames if it is not part of them.
+        """
+        if flight.pilot_id not in self.pilots:
+            self.pilots.append(flight.pilot_id)
+            for name, empty in (('present', False), ('lat', np.nan), ('lon', np.nan), ('altitude', 0), ('goal_distance', np.nan)):
+                frames = getattr(self, name)
+                setattr(self, name, np.concatenate((frames, np.full((1, frames.shape[1]), empty, dtype=frames.dtype))))
+            first = 0
+        self._set_row(self.pilots.index(flight.pilot_id), flight, first)
+
+    def _set_row(self, row, flight, first=0):
+        """Writes the frames of the fixes of flight from index first, which are in chronological order if first is not 0."""
+        n_frames = self.present.shape[1]
+        offsets = unwrap_seconds(flight.seconds[first:], self.start) - self.start
+        if first > 0:
+            # the frames following the previous last fix held it, they are written again from the first fix
+            if offsets[0] <= 0:
+                return self._set_row(row, flight)
+            self._clear(row, slice(min(-(-int(offsets[0]) // self.step), n_frames), n_frames))
+
+        columns, remainders = np.divmod(offsets, self.step)
+        inside = (remainders == 0) & (columns >= 0) & (columns < n_frames)
+        self._fill(row, columns[inside], flight, first + np.flatnonzero(inside))
+
+        # before the first fix and after the last fix, the pilot stays at the closest fix
+        last = int(offsets[flight._last - first]) // self.step
+        if first == 0:
+            first_column = -(-int(offsets[flight._first]) // self.step)
+            self._fill(row, slice(0, min(max(first_column, 0), n_frames)), flight, flight._first)
+        self._fill(row, slice(min(max(last + 1, 0), n_frames), n_frames), flight, flight._last)
+
+    def _clear(self, row, columns):
+        self.present[row, columns] = False
+        self.lat[row, columns] = np.nan
+        self.lon[row, columns] = np.nan
+        self.altitude[row, columns] = 0
+        self.goal_distance[row, columns] = np.nan
+
+    def _fill(self, row, columns, flight, index):
+        self.present[row, columns] = True
+        self.lat[row, columns] = flight.lat[index]
+        self.lon[row, columns] = flight.lon[index]
+        self.altitude[row, columns] = flight.altitude[index]
+        self.goal_distance[row, columns] = flight.goal_distance[index]
+
+    def column(self, timestamp):
+        """Returns the column of timestamp, or None if it is outside of the frames or between two frames."""
+        column, remainder = divmod(self._offset(timestamp), self.step)
+        return column if remainder == 0 and 0 <= column < self.present.shape[1] else None
+
+    def _offset(self, timestamp):
+        """Returns the number of seconds from the first frame to timestamp, within 12 hours."""
+        return int(unwrap_seconds([to_seconds(timestamp)], self.start)[0]) - self.start
+
+    def timestamp(self, column):
+        return to_time(self.start + column * self.step)
+
+    def snapshot(self, column):
+        """Returns the positions of the present pilots at a column, indexed by pilot ID."""
+        snap = {}
+        for row in np.flatnonzero(self.present[:, column]):
+            goal_distance = self.goal_distance[row, column]
+            goal_distance = None if np.isnan(goal_distance) else float(goal_distance)
+            snap[self.pilots[row]] = GeoPoint.from_fix(float(self.lat[row, column]), float(self.lon[row, column]), int(self.altitude[row, column]), goal_distance)
+        return snap
+
+    def records(self, column):
+        """
+        Returns the serialization of :meth:`snapshot`, built from the columns without creating GeoPoints.
+
+        The records are the dicts which GeoPoint.serialize returns for the fixes of the snapshot, so that they are encoded without a fallback.
+        """
+        rows = np.flatnonzero(self.present[:, column])
+        goal_distances = self.goal_distance[rows, column]
+        goal_distances = np.where(np.isnan(goal_distances), None, goal_distances).tolist()
+        return {
+            self.pilots[row]: {
+                'lat': lat,
+                'lon': lon,
+                'altitude': altitude,
+                'status': 'flying',
+                'goal_distance': goal_distance
+            } for row, lat, lon, altitude, goal_distance in zip(rows, self.lat[rows, column].tolist(), self.lon[rows, column].tolist(), self.altitude[rows, column].tolist(), goal_distances)
+        }
+
+    def active_columns(self, start=None, stop=None):
+        """Returns the columns between start and stop in which at least one pilot is present."""
+        first = 0 if start is None else max(-(-self._offset(start) // self.step), 0)
+        last = self.present.shape[1] if stop is None else max(-(-self._offset(stop) // self.step), 0)
+        return first + np.flatnonzero(self.present[:, first:last].any(axis=0))
+
+    def totals(self):
+        """Returns the number of present pilots and the sums of their altitudes and goal distances in each column, as the rows of a (3 x frames) matrix."""
+        return np.stack((self.present.sum(axis=0), np.where(self.present, self.altitude, 0).sum(axis=0), np.where(self.present, self.goal_distance, 0).sum(axis=0))).astype(np.float64)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.present.any(axis=0)))
@@ -1,19 +1,35 @@
+import numpy as np
+from pygclib.constants import GAGGLE_RADIUS, NEIGHBOURS, NEIGHBOURS_RADIUS
+from pygclib.geography import project
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+# number of positions queried at once for their nearest pilots, which bounds the memory of the query
+QUERY_CHUNK = 1 << 18
+
+
 class PilotFeatures():
     """
     PilotFeatures
 
+    Without neighbours, the pilot is compared to every pilot of the snapshot. Features built by :meth:`Gaggles.features`
+    only compare the pilot to its nearest pilots.
+
     Attributes:
         pilot_id (str) : The pilot's ID
         timestamp (~datetime.time) : The timestamp associated with the features.
         position (GeoPoint) : The current position of the pilot.
         group_relation (GroupRelation) : The current position of the pilot.
+        gaggle (int) : The ID of the gaggle of the pilot at this timestamp, -1 if the pilot flies alone, None without neighbours.
     """
 
-    def __init__(self, pilot_id, timestamp, snapshot):
+    def __init__(self, pilot_id, timestamp, snapshot, neighbours=None, gaggle=None):
         self.pilot_id = pilot_id
         self.timestamp = timestamp
         self.position = snapshot[pilot_id]
-        self.group_relation = GroupRelation(pilot_id, snapshot)
+        self.group_relation = GroupRelation(pilot_id, snapshot, neighbours)
+        self.gaggle = gaggle
 
 
 class GroupRelation():
@@ -33,12 +49,13 @@ class GroupRelation():
         delta_distance (list [float]) : The goal distances differences.
     """
 
-    def __init__(self, pilot_id, snapshot):
+    def __init__(self, pilot_id, snapshot, other_pilot_id=None):
         self.other_pilot_id = []
         self.delta_altitude = []
         self.delta_distance = []
 
-        for other_pilot_id, flight in snapshot.items():
+        for other_pilot_id in (snapshot if other_pilot_id is None else other_pilot_id):
+            flight = snapshot[other_pilot_id]
 
             delta_altitude = snapshot[pilot_id].altitude - flight.altitude
             delta_distance = flight.goal_distance - snapshot[pilot_id].goal_distance
@@ -46,3 +63,98 @@ class GroupRelation():
             self.other_pilot_id.append(other_pilot_id)
             self.delta_altitude.append(delta_altitude)
             self.delta_distance.append(delta_distance)
+
+
+class Gaggles():
+    """
+    Nearest pilots and gaggles of each pilot at each frame of a race, found in one pass over the frames.
+
+    Positions are projected with :func:`~pygclib.geography.project` around their mean position, in the geodesy mode of the current context,
+    which stretches distances by less than 0.01% within 100 km of this position, or 0.4% in the projected mode. They are indexed by a single KD-tree in which the frames
+    are stacked along a third axis, further apart than any searched distance so that pilots are only found within their own frame.
+    The tree answers the nearest pilots of every pilot, and the pairs of pilots closer than the gaggle radius,
+    whose connected components are the gaggles. Distances are horizontal.
+
+    Arguments:
+        frames (RaceFrames) : The frames of the race, such as returned by :meth:`Race.query <pygclib.core.race.Race.query>`.
+        k (int) : The maximum number of nearest pilots of each pilot.
+        radius (float) : The distance in meters beyond which pilots are not neighbours.
+        gaggle_radius (float) : The distance in meters under which two pilots are in the same gaggle.
+
+    Attributes:
+        frames (RaceFrames) : The frames of the race.
+        neighbours (~numpy.ndarray [int]) : (pilots x frames x k) rows of the nearest pilots, closest first, -1 if there are fewer than k neighbours.
+        distances (~numpy.ndarray [float]) : (pilots x frames x k) distances to the nearest pilots, NaN if there are fewer than k neighbours.
+        gaggles (~numpy.ndarray [int]) : (pilots x frames) ID of the gaggle of each pilot, -1 if the pilot flies alone or is absent.
+            IDs are numbered from 0 at each frame, and do not follow gaggles from one frame to the next.
+    """
+
+    def __init__(self, frames, k=NEIGHBOURS, radius=NEIGHBOURS_RADIUS, gaggle_radius=GAGGLE_RADIUS):
+        self.frames = frames
+        n_pilots, n_frames = frames.present.shape
+        self.neighbours = np.full((n_pilots, n_frames, k), -1, dtype=np.int32)
+        self.distances = np.full((n_pilots, n_frames, k), np.nan, dtype=np.float32)
+        self.gaggles = np.full((n_pilots, n_frames), -1, dtype=np.int32)
+
+        # positions of the present pilots, ordered by frame
+        columns, rows = np.nonzero(frames.present.T)
+        if len(rows) == 0:
+            return
+        lats, lons = frames.lat[rows, columns], frames.lon[rows, columns]
+        spacing = 4 * max(radius, gaggle_radius, 1)
+        points = np.column_stack((project((lats.mean(), lons.mean()), lats, lons), columns * spacing))
+        tree = cKDTree(points)
+
+        if k > 0:
+            for start in range(0, len(points), QUERY_CHUNK):
+                chunk = slice(start, start + QUERY_CHUNK)
+                distances, indices = tree.query(points[chunk], k=k + 1, distance_upper_bound=radius)
+                # each pilot is its own nearest pilot, unless another pilot is at the same position
+                others = np.argsort(indices == np.arange(start, start + len(indices))[:, None], axis=1, kind='stable')[:, :k]
+                distances = np.take_along_axis(distances, others, axis=1)
+                indices = np.take_along_axis(indices, others, axis=1)
+                found = np.isfinite(distances)
+                self.neighbours[rows[chunk], columns[chunk]] = np.where(found, rows[np.minimum(indices, len(rows) - 1)], -1)
+                self.distances[rows[chunk], columns[chunk]] = np.where(found, distances, np.nan)
+
+        pairs = tree.query_pairs(gaggle_radius, output_type='ndarray')
+        if len(pairs):
+            graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(points), len(points)))
+            _, labels = connected_components(graph, directed=False)
+            grouped = np.bincount(labels)[labels] > 1
+
+            # gaggles are numbered from 0 at each frame, in the order of their labels
+            gaggles, inverse = np.unique(columns[grouped].astype(np.int64) * len(points) + labels[grouped], return_inverse=True)
+            gaggle_columns = gaggles // len(points)
+            numbers = np.arange(len(gaggles)) - np.searchsorted(gaggle_columns, gaggle_columns)
+            self.gaggles[rows[grouped], columns[grouped]] = numbers[inverse]
+
+    def features(self, pilot_id, timestamp):
+        """
+        Returns the PilotFeatures of a pilot at timestamp, comparing it to its nearest pilots, or None if the pilot is absent.
+
+        Raises:
+            ValueError: If timestamp is not one of the frames.
+        """
+        column = self.frames.column(timestamp)
+        if column is None:
+            raise ValueError(f'{timestamp} is not one of the frames')
+        row = self.frames.pilots.index(pilot_id)
+        if not self.frames.present[row, column]:
+            return None
+        snapshot = self.frames.snapshot(column)
+        neighbours = [self.frames.pilots[other] for other in self.neighbours[row, column] if other >= 0]
+        return PilotFeatures(pilot_id, timestamp, snapshot, neighbours, int(self.gaggles[row, column]))
+
+    def records(self, column):
+        """Returns the nearest pilots, their distances and the gaggle of each present pilot at a column, indexed by pilot ID."""
+        pilots = self.frames.pilots
+        records = {}
+        for row in np.flatnonzero(self.frames.present[:, column]):
+            found = self.neighbours[row, column] >= 0
+            records[pilots[row]] = {
+                'neighbours': [pilots[other] for other in self.neighbours[row, column][found]],
+                'distances': self.distances[row, column][found].tolist(),
+                'gaggle': int(self.gaggles[row, column]),
+            }
+        return records
@@ -1,24 +1,32 @@
 import json
 import logging
-import multiprocessing
-#multiprocessing.set_start_method('spawn', True)  #-> DEBUG MULTIPROCESS
 import os
-import shutil
 import sys
+import threading
 import zipfile
+from datetime import time
 from glob import glob
-from collections import defaultdict
+from collections import Counter, defaultdict
 
 import numpy as np
 #import seaborn as sns
+from pygclib.constants import EXECUTOR_BACKEND, GAGGLE_RADIUS, GEODESY, IGC_PILOT_NAME, IGC_TZ_OFFSET, JOBS, NEIGHBOURS, NEIGHBOURS_RADIUS, SHARED_MEMORY, VALIDATION_TOLERANCE
 from pygclib.core import BaseObject
+from pygclib.core.cache import FlightCache
+from pygclib.core.executor import Executor
 from pygclib.serialization.json_encoder import ComplexEncoder
+from pygclib.serialization.json_writer import Stream
+from pygclib.serialization.replay import write_replay
 from pygclib.core.flight import Flight
-from pygclib.core.pilot_features import PilotFeatures
-from pygclib.core.ranking import Ranking
+from pygclib.core.frames import RaceFrames
+from pygclib.core.pilot_features import Gaggles
+from pygclib.core.ranking import Ranking, RankingTimeline
+from pygclib.core.shared import SharedFlights
+from pygclib.core.store import STORE_EXTENSION, read_store, write_store
 from pygclib.core.task import Task
 from pygclib.crawlers.flight_crawler import FlightCrawler
-from pygclib.time.timeop import sub_times
+from pygclib.parsers import igcparse
+from pygclib.time.timeop import SECONDS_PER_DAY, seconds_after, to_seconds, to_time, unwrap_seconds
 from scipy.signal import savgol_filter
 from tqdm import tqdm
 
@@ -32,13 +40,27 @@ class Race(BaseObject):
         >>> r =  Race(tracks='tracks/', task='task.xctsk')
 
     * Passing a path to a previously saved Race, loading the saved instance (much faster than re-validating flights).
+      Races saved to a race store (.race) are memory mapped, each flight being read when it is first accessed.
 
-        >>> r =  Race(path='race.pkl')
+        >>> r =  Race(path='race.race')
+
+    * Passing a task with live set, which creates a Race without flights. Fixes are then appended with :meth:`ingest`,
+      or read from IGC files being written in the tracks directory with :meth:`follow`.
+
+        >>> r =  Race(tracks='live/', task='task.xctsk', live=True)
 
     Keyword Arguments:
         tracks (str): A path to a directory or a zip file containing IGC tracks.
         task (str): A path to the task file or a base64 representation of the task.
         path (str): The path of a previously saved Race instance.
+        cache (bool or str): Whether parsed flights are read from and stored to the on-disk flight cache, or the directory of this cache.
+            Disabled by default, so that tracks are parsed by the current parser unless the caller opts in.
+        geodesy (str): Geodesy mode of the distance computations of the task, ignored when loading a saved Race.
+        tolerance (float): Maximum error of the goal distances in meters, every goal distance is optimized if 0. Race distances are exact either way.
+        shared_memory (bool): Whether flights are sent to and from the worker processes through shared memory blocks instead of being pickled.
+        jobs (int): Number of workers parsing and validating flights, defaults to the number of CPUs if 0.
+        executor (str): Kind of workers, one of EXECUTOR_BACKENDS.
+        live (bool): Whether the race is built from fixes appended while the task is flown, tracks being followed if given.
 
     Attributes:
         n_pilots (int) : The number of pilots in the Race.
@@ -46,30 +68,63 @@ class Race(BaseObject):
         task (Task) : The Task instance of the Race.
     """
 
-    def __init__(self, tracks=None, task=None, validate=True, path=None, progress='gui'):
+    def __init__(self, tracks=None, task=None, validate=True, path=None, progress='gui', cache=False, geodesy=GEODESY, tolerance=VALIDATION_TOLERANCE, shared_memory=SHARED_MEMORY, jobs=JOBS, executor=EXECUTOR_BACKEND, live=False):
         self._validate = validate
+        self._shared_memory = shared_memory
+        self._jobs = jobs
+        self._executor_backend = executor
+        self._executor = None
         self._progress = progress
+        self._cache = (FlightCache(cache) if isinstance(cache, str) else FlightCache()) if cache else None
+
+        try:
+            self._build(tracks, task, path, geodesy, tolerance, live)
+        finally:
+            self.close()
+
+        # loaded races keep their ranking, which would read every flight
+        if getattr(self, 'ranking', None) is None:
+            self.ranking = Ranking(self)
 
-        # load race from pickle if path is given
+    def _build(self, tracks, task, path, geodesy, tolerance, live):
+        # load race from a race store or a pickle if path is given
         if path is not None:
             self.load(path)
             if not self.validated and self._validate:
                 self.validate_flights()
 
+        # or start a live race without flights, fixes being validated as they are ingested
+        elif live:
+            self.task = Task(task, geodesy=geodesy, tolerance=tolerance)
+            self.task.prepare_validation()
+            self.flights = {}
+            self.n_pilots = 0
+            self.validated = True
+            self.ranking = Ranking(self)
+            if tracks is not None:
+                self.follow(tracks)
+
         # or build it from arguments
         else:
-            # by parsing the task file or b64 to create a Task
-            self.task = Task(task)
+            # by parsing the task file or b64 to create a Task, prepared before the workers receive it
+            self.task = Task(task, geodesy=geodesy, tolerance=tolerance)
+            if self._validate:
+                self.task.prepare_validation()
 
             # trying to fetch the tracks if they were not provided by user
             if tracks is None:
                 try:
-                    tracks = FlightCrawler(self.task, progress=self._progress).directory
+                    archive = FlightCrawler(self.task, progress=self._progress).archive
                 except ValueError:
                     raise ValueError('This task format does not support flight crawling yet, provide --flights directory.')
+                try:
+                    self.parse_flights(archive)
+                finally:
+                    os.remove(archive)
 
             # reading the tracks and builiding the Flights objects
-            self.parse_flights(tracks)
+            else:
+                self.parse_flights(tracks)
 
             # validating all Flights if necessary
             if self._validate:
@@ -77,7 +132,71 @@ class Race(BaseObject):
             else:
                 self.validated = False
 
-        self.ranking = Ranking(self)
+    @property
+    def executor(self):
+        """Workers of the race, started on first use and shared by parsing and validation. Each worker receives the task once."""
+        if getattr(self, '_executor', None) is None:
+            self._executor = Executor(getattr(self, '_jobs', JOBS), getattr(self, '_executor_backend', EXECUTOR_BACKEND), initializer=_init_worker, initargs=(self.task,))
+        return self._executor
+
+    def close(self):
+        """Stops the workers of the race, and releases the shared block of its flights."""
+        if getattr(self, '_executor', None) is not None:
+            self._executor.close()
+            self._executor = None
+        self._release_shared_flights()
+
+    def _release_shared_flights(self):
+        shared = getattr(self, '_shared_flights', None)
+        if shared is not None:
+            self._shared_flights = None
+            shared.detach(self.flights)
+            _release_worker_flights(shared.handle)
+            shared.unlink()
+
+    @property
+    def frames(self):
+        """Dense per-second view of the race between task opening and deadline, built on first access."""
+        if getattr(self, '_frames', None) is None:
+            self._frames = RaceFrames(self.flights, self.task.open, self.task.stop)
+        return self._frames
+
+    def _totals(self):
+        """Returns the totals of the frames of the race, read from the race store the race was loaded from if any. See :meth:`RaceFrames.totals`."""
+        totals = getattr(self, '_frame_totals', None)
+        return self.frames.totals() if totals is None else totals
+
+    def query(self, start=None, stop=None, step=1, pilots=None):
+        """
+        Returns the frames of the race every step seconds between start and stop, computed only for these frames and pilots.
+
+        The window is clipped to the task time range. Without arguments, the frames of the whole race are returned.
+
+        Arguments:
+            start (~datetime.time) : The first second of the window, defaults to the task opening.
+            stop (~datetime.time) : The second following the window, defaults to the task deadline.
+            step (int) : The number of seconds between two frames.
+            pilots (list [str]) : The IDs of the pilots of the frames, defaults to every pilot.
+
+        Raises:
+            ValueError: If a pilot is not part of the race.
+        """
+        if start is None and stop is None and step == 1 and pilots is None:
+            return self.frames
+
+        if pilots is None:
+            flights = self.flights
+        else:
+            unknown = [pilot_id for pilot_id in pilots if pilot_id not in self.flights]
+            if unknown:
+                raise ValueError(f'Pilots {unknown} are not part of the race')
+            flights = {pilot_id: self.flights[pilot_id] for pilot_id in pilots}
+
+        opening = to_seconds(self.task.open)
+        deadline = seconds_after(self.task.stop, opening)
+        first = opening if start is None else min(max(int(unwrap_seconds([to_seconds(start)], opening)[0]), opening), deadline)
+        last = deadline if stop is None else min(max(int(unwrap_seconds([to_seconds(stop)], opening)[0]), first), deadline)
+        return RaceFrames(flights, to_time(first), to_time(last), step)
 
     def __getitem__(self, time_point):
         """
@@ -86,6 +205,11 @@ class Race(BaseObject):
         Arguments:
             time_point (~datetime.time) : The second at which the snapshot is taken
         """
+        column = self.frames.column(time_point)
+        if column is not None:
+            return self.frames.snapshot(column)
+
+        # outside of the task time range, snapshots are not precomputed
         snap = {}
         for pilot_id, flight in self.flights.items():
             if flight[time_point] is not None:
@@ -99,73 +223,209 @@ class Race(BaseObject):
 
     def __len__(self):
         """Returns the number of snapshots between the earliest and the latest point from all flights."""
-        return len([_ for _ in self.snapshots()])
+        return len(self.frames)
 
     def parse_flights(self, tracks):
         """Populates flights attribute by parsing each igc file in tracks.
 
+        The parent only lists the igc files : each worker reads the files it parses, opening the members of a zip archive at their offset
+        without extracting them, and looks them up in the flight cache.
+
         Arguments:
             tracks (str) : Path to a directory or a zip file containing the igc files
         """
-        tmp_file = None
+        cache_directory = None if self._cache is None else self._cache.directory
         if zipfile.is_zipfile(tracks):
-            tmp_file = os.path.join('/tmp', os.path.splitext(os.path.basename(tracks))[0])
-            archive = zipfile.ZipFile(tracks)
-            archive.extractall(path='/tmp')
-            tracks = tmp_file
-        if os.path.isdir(tracks):
-            tracks = glob(os.path.join(tracks, '*.igc'))
+            with zipfile.ZipFile(tracks) as archive:
+                members = [m for m in archive.infolist() if not m.is_dir() and m.filename.lower().endswith('.igc')]
+            # members are sent with their offset in the archive, along with their size
+            sources = [(tracks, m, cache_directory) for m in members]
+            names, sizes = [m.filename for m in members], [m.file_size for m in members]
+        elif os.path.isdir(tracks):
+            names = glob(os.path.join(tracks, '*.igc'))
+            sources = [(path, None, cache_directory) for path in names]
+            sizes = [os.path.getsize(path) for path in names]
         else:
             raise ValueError(f'{tracks} is not a directory or a zip file')
 
-        self.n_pilots = len(tracks)
+        self.n_pilots = len(sources)
         if self.n_pilots == 0:
             raise ValueError('Flight directory does not contain any igc files')
+        # zip members are taken from every folder, two tracks with the same file name would share a pilot id
+        pilot_ids = Counter(_pilot_id(name) for name in names)
+        duplicates = sorted(pilot_id for pilot_id, count in pilot_ids.items() if count > 1)
+        if duplicates:
+            raise ValueError(f'{tracks} contains several tracks for pilots {duplicates}')
         self.flights = {}
+        self._frames = None
+        self._frame_totals = None
 
-        with multiprocessing.Pool(multiprocessing.cpu_count()) as p:
-            steps = 1
-            for x in tqdm(p.imap_unordered(Flight, tracks), desc='reading tracks', total=self.n_pilots, disable=self._progress != 'gui'):
-                self.flights[x.pilot_id] = x
-                if self._progress == 'ratio':
-                    print(f'{steps/self.n_pilots:.0%}', file=sys.stderr, flush=True)
-                    steps += 1
+        if self._shared_memory:
+            # workers write the flights they parse straight into the block read by validation, rows being reserved from the size of the IGC files
+            SharedFlights.share_tracker()
+            capacities = {_pilot_id(name): igcparse.max_fixes(size) for name, size in zip(names, sizes)}
+            self._shared_flights = SharedFlights(capacities=capacities)
+            sources = [(*source, self._shared_flights.handle, self._shared_flights.slots[_pilot_id(name)]) for source, name in zip(sources, names)]
+
+        steps = 1
+        flights = self.executor.map(_read_shared_flight if self._shared_memory else _read_flight, sources, sizes=sizes)
+        for x, cached in tqdm(flights, desc='reading tracks', total=self.n_pilots, disable=self._progress != 'gui'):
+            if self._shared_memory:
+                pilot_id, row = x
+                self._shared_flights.rows[pilot_id] = row
+                x = self._shared_flights.flight(pilot_id)
+            self.flights[x.pilot_id] = x
+            if self._cache is not None:
+                self._cache.hits += cached
+                self._cache.misses += not cached
+            if self._progress == 'ratio':
+                print(f'{steps/self.n_pilots:.0%}', file=sys.stderr, flush=True)
+                steps += 1
 
-        if tmp_file is not None:
-            shutil.rmtree(tmp_file)
+        # the thread backend closes the archives of its workers with their threads
+        _close_worker_archive()
+        if self._cache is not None:
+            self._cache.evict()
+            logging.info(f'parsed flights cache : {self._cache}')
 
     def validate_flights(self):
-        """Computes the validation of each flight on the race"""
-        with multiprocessing.Pool(multiprocessing.cpu_count()) as p:
+        """
+        Computes the validation of each flight on the race.
+
+        The task is sent once to each worker, when the workers start. In shared memory mode, flights are not sent either : workers read their fixes
+        from the shared block the flights were parsed into, or a block they are copied to for loaded races, and write goal distances back into it,
+        only tag times being returned. Flights are copied out of the block once validated.
+        """
+        self.task.prepare_validation()
+        shared = getattr(self, '_shared_flights', None)
+        if self._shared_memory and shared is None:
+            SharedFlights.share_tracker()
+            shared = self._shared_flights = SharedFlights(self.flights)
+        try:
             steps = 1
+            sizes = [len(flight) for flight in self.flights.values()]
+            # instance attributes updated in workers are not copied back, results are attached to the flights here
+            if shared is None:
+                results = self.executor.map(_validate_flight, list(self.flights.values()), sizes=sizes)
+            else:
+                results = self.executor.map(_validate_shared_flight, [(shared.handle, pilot_id, row) for pilot_id, row in shared.rows.items()], sizes=sizes)
+            for pilot_id, goal_distances, tag_times in tqdm(results, desc='validating flights', total=self.n_pilots, disable=self._progress != 'gui'):
+                # views of the shared block must not outlive it
+                self._attach_validation(pilot_id, goal_distances if shared is None else shared.goal_distance(pilot_id), tag_times)
 
-            # we can't just map(self.task.validate, self.flights) because instance attributes updated in subprocesses are not copied back on join
-            for pilot_id, goal_distances, tag_times in tqdm(p.imap_unordered(self.task.validate, self.flights.values()), desc='validating flights', total=self.n_pilots, disable=self._progress != 'gui'):
+                if self._progress == 'ratio':
+                    print(f'{steps/self.n_pilots:.0%}', file=sys.stderr, flush=True)
+                    steps += 1
+        finally:
+            self._release_shared_flights()
 
-                # update goal distances of flight points
-                for timestamp, point in self.flights[pilot_id].points.items():
-                    point.goal_distance = goal_distances[timestamp]
+        # goal distances changed, frames and ranking must be rebuilt
+        self._frames = None
+        self._frame_totals = None
+        self.validated = True
+        self.ranking = Ranking(self)
 
-                # compute race time for pilot, read list in reverse because ESS is more likely near the end
-                self.flights[pilot_id].race_distance = len(self.task) - min(goal_distances.values())
-                self.flights[pilot_id]._last_point['point'].goal_distance = min(goal_distances.values())
+    def _attach_validation(self, pilot_id, goal_distances, tag_times):
+        """Updates the flight of pilot_id and the task with the results of its validation."""
+        # goal distances are aligned with the fixes of the flight
+        flight = self.flights[pilot_id]
+        flight.goal_distance[:] = goal_distances
+        best_distance = float(goal_distances.min())
+        flight.race_distance = len(self.task) - best_distance
+        flight.goal_distance[flight._last] = best_distance
+
+        self._set_race_time(flight, tag_times)
+
+        # update tag_times of turnpoints
+        self.task.update_tag_times(tag_times)
+
+    def _set_race_time(self, flight, tag_times):
+        """Computes the race time of flight from the tag time of ESS, if every turnpoint was tagged."""
+        if len(tag_times) == len(self.task.turnpoints):
+            ess = next((i for i, turnpoint in enumerate(self.task.turnpoints) if turnpoint.role == 'ESS'), None)
+            if ess is not None:
+                flight.race_time = to_time(tag_times[ess] - self.task.seconds[1])
+                logging.debug(f'{flight.pilot_id} SS : {flight.race_time}')
+
+    def ingest(self, pilot_id, fixes, pilot_name=None):
+        """
+        Appends fixes to the flight of a pilot in a live race, and validates them.
 
-                # compute race time for pilot, read list in reverse because ESS is more likely near the end
-                if len(tag_times) == len(self.task.turnpoints):
-                    for i, turnpoint in enumerate(self.task.turnpoints[::-1]):
-                        if turnpoint.role == 'ESS':
-                            race_time = sub_times(tag_times[-(i + 1)], self.task.start)
-                            self.flights[pilot_id].race_time = race_time
-                            logging.debug(f'{pilot_id} SS : {race_time}')
+        Only the new fixes are validated, the state of the validation of each flight being kept between calls.
+        The frames and the ranking are updated from the first fix whose goal distance changed, so that ingesting fixes
+        takes a time proportional to their number. Fixes which are not after the last fix of the pilot are dropped.
 
-                # update tag_times of turnpoints
-                self.task.update_tag_times(tag_times)
+        Arguments:
+            pilot_id (str) : The ID of the pilot, whose flight is created with its first fixes.
+            fixes (list [tuple]) : The new fixes, as (timestamp, lat, lon, altitude, pressure_altitude) tuples in chronological order.
+                Timestamps are ~datetime.time or UTC seconds since midnight.
+            pilot_name (str) : The name of the pilot, used when its flight is created.
+        """
+        if len(fixes) == 0:
+            return
+        timestamps, lat, lon, altitude, pressure_altitude = zip(*fixes)
+        seconds = np.array([to_seconds(t) if isinstance(t, time) else t for t in timestamps], dtype=np.int32)
+        self._ingest_columns(pilot_id, pilot_name, seconds, np.array(lat, dtype=np.float64), np.array(lon, dtype=np.float64), np.array(altitude, dtype=np.int32), np.array(pressure_altitude, dtype=np.int32))
 
-                if self._progress == 'ratio':
-                    print(f'{steps/self.n_pilots:.0%}', file=sys.stderr, flush=True)
-                    steps += 1
+    def follow(self, tracks):
+        """
+        Ingests the fixes written to the IGC files of a directory since the previous call, such as files written by live tracking.
 
-        self.validated = True
+        Each file is read from where the previous call stopped, up to its last complete line. Headers are read with the first fixes of a file.
+
+        Arguments:
+            tracks (str) : Path to a directory containing IGC files.
+        """
+        tails = self.__dict__.setdefault('_tails', {})
+        for path in sorted(glob(os.path.join(tracks, '*.igc'))):
+            offset, pilot_name, time_offset = tails.get(path, (0, None, 0))
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                content = f.read()
+            content = content[:content.rfind(b'\n') + 1]
+            try:
+                header, (seconds, lat, lon, altitude, pressure_altitude) = igcparse.read(content)
+            except ValueError:
+                # the file has no new fixes yet, its header is read again with them
+                continue
+
+            if offset == 0:
+                pilot_name = str(header.get(IGC_PILOT_NAME, 'Unknown pilot'))
+                time_offset = header.get(IGC_TZ_OFFSET, 0)
+            tails[path] = (offset + len(content), pilot_name, time_offset)
+            seconds = (seconds + round(3600 * time_offset)) % SECONDS_PER_DAY
+            self._ingest_columns(os.path.splitext(os.path.basename(path))[0], pilot_name, seconds, lat, lon, altitude, pressure_altitude)
+
+    def _ingest_columns(self, pilot_id, pilot_name, seconds, lat, lon, altitude, pressure_altitude):
+        states = self.__dict__.setdefault('_validation_states', {})
+        flight = self.flights.get(pilot_id)
+        if flight is None:
+            flight = Flight.from_columns(pilot_id, pilot_name or 'Unknown pilot', seconds, lat, lon, altitude, pressure_altitude)
+            self.flights[pilot_id] = flight
+            self.n_pilots = len(self.flights)
+            state, last = None, 0
+        else:
+            state, last, last_goal_distance = states[pilot_id]
+            # the last fix held the best goal distance of the flight, it gets its own back
+            flight.goal_distance[last] = last_goal_distance
+            flight.append(seconds, lat, lon, altitude, pressure_altitude)
+
+        state, indices, goal_distances, tag_times = self.task.validate_increment(flight, state)
+        flight.goal_distance[indices] = goal_distances
+        if len(goal_distances):
+            best_distance = min(float(goal_distances.min()), len(self.task) - (flight.race_distance or 0))
+            flight.race_distance = len(self.task) - best_distance
+        states[pilot_id] = (state, flight._last, flight.goal_distance[flight._last])
+        flight.goal_distance[flight._last] = len(self.task) - flight.race_distance
+        self._set_race_time(flight, tag_times)
+        self.task.update_tag_times(state.tag_times)
+
+        # the previous last fix changed along with the fixes whose goal distance changed
+        first = min(int(indices.min()) if len(indices) else last, last)
+        if getattr(self, '_frames', None) is not None:
+            self._frames.update(flight, first)
+        self._frame_totals = None
+        self.ranking.update(self, pilot_id, first)
 
     def __str__(self):
         return f'{self.n_pilots} pilots - {len(self.task)}m task - start at {self.task.start} - deadline at {self.task.stop}'
@@ -182,42 +442,48 @@ class Race(BaseObject):
         * delta_altitude > 0 : original pilot is higher 
         * delta_distance > 0 : original pilot closer to goal 
 
+        Features of every watched pilot are computed at once from the frames of the watched pilots and the totals of the frames
+        of the race, which races loaded from a race store read without the other flights. Features are smoothed
+        with a Savitzky-Golay filter before being downsampled if sparse is greater than 1.
+
         Args:
             pilot_id (list(str)): List of IDs of the pilots being watched, or ['all']
+            output (list(str)): Files to which the features are written [*.json, -]
+            sparse (int): Keeps one feature every sparse seconds
         """
         if len(pilot_id) == 1 and pilot_id[0] == 'all':
             pilot_id = list(self.flights.keys())
         else:
             pilot_id = list(filter(lambda x: x in self.flights, pilot_id))
 
-        series = {p: {'altitude': [], 'distance': []} for p in pilot_id}
-        series = {'timestamps': [], 'pilots': series}
+        # features are computed as (pilots x seconds) matrices over the active seconds, means being taken over the present pilots
+        count, altitude_sum, goal_distance_sum = self._totals()
+        columns = np.flatnonzero(count)
+        mean_altitude = altitude_sum[columns] / count[columns]
+        mean_goal_distance = goal_distance_sum[columns] / count[columns]
 
-        steps = 1
-        total = len(self)
-        for timestamp, snapshot in tqdm(self.snapshots(), total=len(self), disable=self._progress != 'gui'):
-
-            series['timestamps'].append(timestamp)
-            altitudes = np.array([p.altitude for p in snapshot.values()])
-            goal_distances = np.array([p.goal_distance for p in snapshot.values()])
+        # only the frames of the watched pilots are built if the frames of the race are not
+        frames = self.frames if getattr(self, '_frames', None) is not None else self.query(pilots=pilot_id)
+        rows = [frames.pilots.index(pilot) for pilot in pilot_id]
+        present = frames.present[rows][:, columns]
+        features = {'altitude': frames.altitude[rows][:, columns] - mean_altitude, 'distance': mean_goal_distance - frames.goal_distance[rows][:, columns]}
 
-            for pilot in pilot_id:
-                # FIXME why do some pilots are in pilot_id but not in snapshot at this point ?
-                if pilot in snapshot:
-                    delta_altitude = snapshot[pilot].altitude - altitudes.mean()
-                    delta_distance = goal_distances.mean() - snapshot[pilot].goal_distance
-                    series['pilots'][pilot]['altitude'].append(delta_altitude)
-                    series['pilots'][pilot]['distance'].append(delta_distance)
-
-            if self._progress == 'ratio':
-                print(f'{steps/total:.0%}', file=sys.stderr, flush=True)
-                steps += 1
+        # a pilot missing a fix at a second has no feature at this second
+        series = {pilot: {feature: values[row][present[row]] for feature, values in features.items()} for row, pilot in enumerate(pilot_id)}
+        timestamps = [frames.timestamp(column) for column in columns]
 
         if sparse > 1:
-            series['timestamps'] = series['timestamps'][::sparse]
-            for key in series['pilots']:
-                for feature in series['pilots'][key]:
-                    series['pilots'][key][feature] = savgol_filter(series['pilots'][key][feature], 121, 1)[::sparse]
+            timestamps = timestamps[::sparse]
+            # series of the same length are smoothed in one call along the time axis
+            lengths = present.sum(axis=1)
+            for length in np.unique(lengths):
+                pilots = [pilot for pilot, pilot_length in zip(pilot_id, lengths) if pilot_length == length]
+                for feature in features:
+                    smoothed = savgol_filter(np.stack([series[pilot][feature] for pilot in pilots]), 121, 1, axis=1)[:, ::sparse]
+                    for pilot, values in zip(pilots, smoothed):
+                        series[pilot][feature] = values
+
+        series = {'timestamps': timestamps, 'pilots': series}
 
         if isinstance(output, list):
             for out in output:
@@ -228,16 +494,177 @@ class Race(BaseObject):
                         # TODO remove indent when properly serialized
                         json.dump(series, f, cls=ComplexEncoder, ensure_ascii=False, indent=4)
 
-    def snapshots(self, start=None, stop=None):
+    def snapshots(self, start=None, stop=None, step=1, pilots=None):
+        """
+        Generates snapshots of the race every step seconds between start and stop, see :meth:`query`.
         """
-        Generates snapshots of the race at each second between start and stop
+        frames = self.query(start, stop, step, pilots)
+        for column in frames.active_columns():
+            yield frames.timestamp(column), frames.snapshot(column)
+
+    def gaggles(self, start=None, stop=None, step=1, pilots=None, k=NEIGHBOURS, radius=NEIGHBOURS_RADIUS, gaggle_radius=GAGGLE_RADIUS):
         """
-        for timestamp in self.task._timerange(start, stop):
-            if self[timestamp] != {}:
-                yield timestamp, self[timestamp]
+        Returns the :class:`~pygclib.core.pilot_features.Gaggles` of the frames of :meth:`query`, with the nearest pilots of each pilot and its gaggle at each frame.
+        Distances between pilots follow the geodesy mode of the task.
 
-    def serialize(self):
-        """Serializes the race object to be written to a JSON file"""
-        snaps = {str(_[0]): _[1] for _ in self.snapshots()}
-        props = {'n_snaps': len(snaps)}
+        Arguments:
+            k (int) : The maximum number of nearest pilots of each pilot.
+            radius (float) : The distance in meters beyond which pilots are not neighbours.
+            gaggle_radius (float) : The distance in meters under which two pilots are in the same gaggle.
+        """
+        frames = self.query(start, stop, step, pilots)
+        with self.task._geodesy():
+            return Gaggles(frames, k, radius, gaggle_radius)
+
+    def ranking_at(self, timestamp, top=None):
+        """Returns the ranking of the race at timestamp, see :meth:`Ranking.at <pygclib.core.ranking.Ranking.at>`."""
+        return self._progress_ranking().at(timestamp, top)
+
+    def ranking_timeline(self, start=None, stop=None, step=60, top=None):
+        """
+        Returns the :class:`~pygclib.core.ranking.RankingTimeline` of the race every step seconds between start and stop,
+        which default to the task opening and deadline.
+        """
+        return RankingTimeline(self._progress_ranking(), start or self.task.open, stop or self.task.stop, step, top)
+
+    def _progress_ranking(self):
+        # rankings saved by previous versions have no progress, which is computed again from the flights
+        if getattr(self.ranking, '_steps', None) is None:
+            self.ranking = Ranking(self)
+        return self.ranking
+
+    def save(self, output, compact=False, **query):
+        """
+        Saves the race to each file specified by output, like :meth:`BaseObject.save <pygclib.core.BaseObject.save>`.
+        The snapshots of JSON outputs are restricted to the start, stop, step and pilots keyword arguments of :meth:`query`.
+
+        * If output is a NumPy archive (.npz), a binary replay is written, which :func:`~pygclib.serialization.replay.read_replay` reads back.
+        * If output is a race store (.race), the race is written in a versioned format which loads each flight on demand.
+        """
+        if isinstance(output, list):
+            for out in output:
+                self.save(out, compact=compact, **query)
+        elif output.endswith('.npz'):
+            write_replay(self, output)
+        elif output.endswith(STORE_EXTENSION):
+            # rankings of races pickled by previous versions are computed again once, instead of each time the store is loaded
+            self._progress_ranking()
+            write_store(self, output)
+        else:
+            super().save(output, compact=compact, **query)
+
+    def load(self, input_file):
+        """Loads a race from a race store (.race), or from a pickle (.pkl) created with the save method."""
+        if input_file.endswith(STORE_EXTENSION):
+            self.__dict__.update(read_store(input_file))
+        else:
+            super().load(input_file)
+
+    def serialize(self, start=None, stop=None, step=1, pilots=None):
+        """Serializes the race object to be written to a JSON file, snapshots of the :meth:`query` window being generated while they are written"""
+        frames = self.query(start, stop, step, pilots)
+        snaps = Stream((str(frames.timestamp(column)), frames.records(column)) for column in frames.active_columns())
+        props = {'n_snaps': len(frames)}
         return dict(properties=props, task=self.task, ranking=self.ranking, race=snaps)
+
+
+def _pilot_id(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+def _read_flight(source):
+    """Builds the Flight of a (path, member, cache directory) tuple in a worker process, and returns it with whether it was read from the cache."""
+    path, member, cache_directory = source
+    if member is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+        name = path
+    else:
+        content = _attach_archive(path).read(member)
+        name = os.path.basename(member.filename)
+
+    if cache_directory is None:
+        return Flight(name, content), False
+
+    # flights found in the cache are not parsed again
+    cache = FlightCache(cache_directory)
+    key = cache.key(content)
+    flight = cache.get(key, _pilot_id(name))
+    if flight is not None:
+        return flight, True
+    flight = Flight(name, content)
+    cache.put(key, flight)
+    return flight, False
+
+
+def _read_shared_flight(source):
+    """Builds the Flight of a (path, member, cache directory, handle, slot) tuple in a worker process, and writes it in its rows of the shared block of handle."""
+    *source, handle, slot = source
+    flight, cached = _read_flight(source)
+    return (flight.pilot_id, _attach_shared_flights(handle).put(flight.pilot_id, flight, slot)), cached
+
+
+# task of a worker, set once when it starts, and the last shared block it attached, shared by the threads of the thread backend
+_worker_task = None
+_worker_flights = None
+_worker_lock = threading.Lock()
+# last zip archive opened by each worker thread, closed with the thread
+_worker_archive = threading.local()
+
+
+def _init_worker(task):
+    global _worker_task
+    _worker_task = task
+
+
+def _validate_flight(flight):
+    return _worker_task.validate(flight)
+
+
+def _validate_shared_flight(args):
+    """Validates the flight of pilot_id in place in the shared block of handle, returning its tag times."""
+    handle, pilot_id, row = args
+    shared = _attach_shared_flights(handle)
+    shared.rows[pilot_id] = row
+
+    _, goal_distances, tag_times = _worker_task.validate(shared.flight(pilot_id))
+    shared.goal_distance(pilot_id)[:] = goal_distances
+    return pilot_id, None, tag_times
+
+
+def _attach_shared_flights(handle):
+    """Returns the shared block of handle, attached once by each worker for parsing and validation."""
+    global _worker_flights
+    with _worker_lock:
+        if _worker_flights is None or _worker_flights.handle != handle:
+            if _worker_flights is not None:
+                _worker_flights.close()
+            _worker_flights = SharedFlights.attach(handle)
+        return _worker_flights
+
+
+def _release_worker_flights(handle):
+    """Closes the shared block of handle if this process attached it as a worker, as the serial and thread backends do."""
+    global _worker_flights
+    with _worker_lock:
+        if _worker_flights is not None and _worker_flights.handle == handle:
+            _worker_flights.close()
+            _worker_flights = None
+
+
+def _attach_archive(path):
+    """Returns the zip archive of path, opened once by each worker thread while the file does not change, so that its directory is read once."""
+    stat = os.stat(path)
+    stamp = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if getattr(_worker_archive, 'stamp', None) != stamp:
+        _close_worker_archive()
+        _worker_archive.stamp, _worker_archive.archive = stamp, zipfile.ZipFile(path)
+    return _worker_archive.archive
+
+
+def _close_worker_archive():
+    """Closes the zip archive opened by the calling thread, as the serial backend does in the parent."""
+    archive = getattr(_worker_archive, 'archive', None)
+    if archive is not None:
+        archive.close()
+    _worker_archive.stamp, _worker_archive.archive = None, None
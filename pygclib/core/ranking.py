@@ -1,27 +1,230 @@
+import numpy as np
+from pygclib.core import BaseObject
+from pygclib.serialization.json_writer import Stream
+from pygclib.time.timeop import SECONDS_PER_DAY, to_seconds, to_time, unwrap_seconds
+
+# scores of the pilots having reached ESS are shifted below the scores of the other pilots, which are their negative race distances
+ESS_SCORE = -1e12
+
+# number of seconds of the ranking timeline computed at once
+TIMELINE_BLOCK = 256
+
+
+def _entry(pilot_id, flight):
+    return {'name': str(flight), 'id': pilot_id, 'distance': flight.race_distance, 'time': flight.race_time}
+
+
+def _ranking_key(entry):
+    return (-entry['distance'], entry['time']) if hasattr(entry, 'distance') else entry['name']
+
+
+def _bisect(items, key, item_key):
+    """Returns the first index of the sorted items at which key could be inserted, item_key being the sort key of the items."""
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if item_key(items[mid]) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
 class Ranking():
+    """
+    Ranking of the pilots of a race, at the end of the race or at any second with :meth:`at`.
+
+    The progress of each pilot is kept as the seconds at which its race distance improved, and the race distance from then on.
+    The ranking at a second is found with a binary search in the progress of every pilot, then a sort of the pilots.
+    The progress of a pilot whose flight gets new fixes is updated with :meth:`update`.
+
+    Attributes:
+        pilots (list [dict]) : The final ranking, as dicts with the name, id, distance and time of each pilot.
+        pilots_in_goal (list [str]) : The IDs of the pilots who reached goal.
+    """
 
     def __init__(self, race):
         self.pilots = self.get_ranking(race)
+        self._set_progress(race)
         self.pilots_in_goal = self.get_pilots_in_goal(race)
 
     def get_ranking(self, race):
         ranking = {}
         for pilot_id, flight in race.flights.items():
-            ranking[pilot_id] = {'name': str(flight), 'id': pilot_id, 'distance': flight.race_distance, 'time': flight.race_time}
-        ranking = sorted(ranking.values(), key=lambda x: (-x['distance'], x['time']) if hasattr(x, 'distance') else x['name'])
+            ranking[pilot_id] = _entry(pilot_id, flight)
+        ranking = sorted(ranking.values(), key=_ranking_key)
         return ranking
 
     def get_pilots_in_goal(self, race):
-        in_goal = []
+        # the best goal distance of a pilot is the last step of its progress
+        return [pilot_id for pilot_id, goal_distances in zip(self._ids, self._goal_distances) if len(goal_distances) and goal_distances[-1] == 0]
+
+    def _update_entry(self, pilot_id, flight):
+        """Moves the entry of pilot_id in the final ranking and in the pilots in goal, without ranking the other pilots again."""
+        entries = getattr(self, '_pilot_entries', None)
+        if entries is None:
+            entries = self._pilot_entries = {entry['id']: entry for entry in self.pilots}
+
+        previous = entries.get(pilot_id)
+        if previous is not None:
+            index = _bisect(self.pilots, _ranking_key(previous), _ranking_key)
+            while self.pilots[index] is not previous:
+                index += 1
+            del self.pilots[index]
+        entry = entries[pilot_id] = _entry(pilot_id, flight)
+        self.pilots.insert(_bisect(self.pilots, _ranking_key(entry), _ranking_key), entry)
+
+        # pilots in goal are kept in the order of their progress rows
+        row = self._rows[pilot_id]
+        in_goal = len(self._goal_distances[row]) > 0 and self._goal_distances[row][-1] == 0
+        if in_goal != (pilot_id in self.pilots_in_goal):
+            if in_goal:
+                self.pilots_in_goal.insert(_bisect(self.pilots_in_goal, row, self._rows.get), pilot_id)
+            else:
+                self.pilots_in_goal.remove(pilot_id)
+
+    def _set_progress(self, race):
+        """Computes the progress of each pilot, as the steps of its best goal distance so far and the second at which it reached ESS."""
+        self._opening, self._start, _ = race.task.seconds
+        self._task_length = len(race.task)
+        self._ids, self._names, self._steps, self._goal_distances, self._race_times = [], [], [], [], []
+        self._rows = {}
+        self._ess = np.zeros(0)
         for pilot_id, flight in race.flights.items():
-            for point in list(flight.points.values())[::-1]:
-                if point.goal_distance == 0:
-                    in_goal.append(pilot_id)
-                    break
-        return in_goal
+            self._set_pilot_progress(pilot_id, flight)
+
+    def update(self, race, pilot_id, first=0):
+        """
+        Updates the ranking with the fixes of the flight of pilot_id from index first, whose goal distances changed, and its race time.
+
+        The progress of the pilot before the first fix is kept, and only the entries of the pilot are moved in the final ranking and in the pilots in goal,
+        so that the update takes a time proportional to the number of changed fixes.
+        Fixes from index first must be in chronological order, like the fixes appended to live flights.
+        """
+        self._set_pilot_progress(pilot_id, race.flights[pilot_id], first)
+        self._update_entry(pilot_id, race.flights[pilot_id])
+
+    def _set_pilot_progress(self, pilot_id, flight, first=0):
+        if pilot_id not in self._rows:
+            self._rows[pilot_id] = len(self._ids)
+            self._ids.append(pilot_id)
+            self._names.append(str(flight))
+            self._steps.append(np.zeros(0, dtype=np.int64))
+            self._goal_distances.append(np.zeros(0))
+            self._race_times.append(None)
+            self._ess = np.append(self._ess, np.inf)
+        row = self._rows[pilot_id]
+
+        if first == 0:
+            timeline = flight.timeline(self._opening)
+            order = np.argsort(timeline, kind='stable')
+            timeline, goal_distances = timeline[order], flight.goal_distance[order]
+            kept = 0
+        else:
+            timeline = unwrap_seconds(flight.seconds[first:], self._opening)
+            goal_distances = flight.goal_distance[first:]
+            kept = np.searchsorted(self._steps[row], timeline[0]) if len(timeline) else len(self._steps[row])
+        previous = self._goal_distances[row][kept - 1] if kept > 0 else np.inf
+
+        best = np.fmin.accumulate(np.concatenate(([previous], goal_distances)))[1:]
+        # only the fixes improving the best goal distance are kept, unvalidated flights having no step
+        steps = np.flatnonzero(best < np.concatenate(([previous], best[:-1])))
+        self._steps[row] = np.concatenate((self._steps[row][:kept], timeline[steps]))
+        self._goal_distances[row] = np.concatenate((self._goal_distances[row][:kept], best[steps]))
+
+        self._race_times[row] = flight.race_time
+        if flight.race_time is not None:
+            self._ess[row] = self._start + to_seconds(flight.race_time) + flight.race_time.microsecond / 1000000
+
+    def _seconds(self, timestamp):
+        """Returns timestamp in seconds since the midnight preceding the task opening, within 12 hours of the opening."""
+        return int(unwrap_seconds([to_seconds(timestamp)], self._opening)[0])
+
+    def _scores(self, seconds):
+        """
+        Returns the race distances and the scores of the pilots at each second, as (pilots x seconds) matrices.
+
+        Pilots are ranked by increasing score : pilots having reached ESS by their ESS time, then the others by decreasing race distance.
+        Pilots without a validated fix yet have a NaN race distance and are ranked last.
+        """
+        seconds = np.asarray(seconds)
+        distances = np.full((len(self._ids), len(seconds)), np.nan)
+        for row, (steps, goal_distances) in enumerate(zip(self._steps, self._goal_distances)):
+            indices = np.searchsorted(steps, seconds, side='right') - 1
+            started = indices >= 0
+            distances[row, started] = self._task_length - goal_distances[indices[started]]
+        ess = self._ess[:, None] <= seconds
+        scores = np.where(ess, ESS_SCORE + self._ess[:, None], np.where(np.isnan(distances), np.inf, -distances))
+        return distances, ess, scores
+
+    def _entries(self, distances, ess, scores, top):
+        """Returns the ranking entries of the pilots at one second, only sorting the top pilots if top is set."""
+        if top is not None and top < len(scores):
+            order = np.argpartition(scores, top - 1)[:top] if top > 0 else np.zeros(0, dtype=np.int64)
+            order = order[np.argsort(scores[order], kind='stable')]
+        else:
+            order = np.argsort(scores, kind='stable')
+        return [{'name': self._names[row], 'id': self._ids[row], 'distance': None if np.isnan(distances[row]) else float(distances[row]), 'time': self._race_times[row] if ess[row] else None} for row in order]
+
+    def at(self, timestamp, top=None):
+        """
+        Returns the ranking at timestamp, as dicts with the name, id, race distance so far and race time of each pilot.
+
+        Pilots who reached ESS come first, by race time, then the other pilots by decreasing race distance.
+        The race time of a pilot is only set once it reached ESS.
+
+        Arguments:
+            timestamp (~datetime.time) : The second of the ranking.
+            top (int) : Number of leading pilots returned, every pilot if not set.
+        """
+        distances, ess, scores = self._scores([self._seconds(timestamp)])
+        return self._entries(distances[:, 0], ess[:, 0], scores[:, 0], top)
+
+    def timeline(self, start, stop, step=60, top=None):
+        """
+        Generates the ranking every step seconds between start and stop, as (timestamp, ranking) pairs.
+
+        Rankings are computed by blocks of seconds, the progress of each pilot being searched for every second of a block at once.
+        """
+        first = self._seconds(start)
+        last = first + (self._seconds(stop) - first) % SECONDS_PER_DAY
+        seconds = np.arange(first, last, step)
+        for block in range(0, len(seconds), TIMELINE_BLOCK):
+            block_seconds = seconds[block:block + TIMELINE_BLOCK]
+            distances, ess, scores = self._scores(block_seconds)
+            for column, second in enumerate(block_seconds):
+                yield to_time(int(second)), self._entries(distances[:, column], ess[:, column], scores[:, column], top)
 
     def __getitem__(self, pilot_id):
         for result in self.pilots:
             if result['id'] == pilot_id:
                 return result
-        raise KeyError(f'{pilot_id} not in ranking')
\ No newline at end of file
+        raise KeyError(f'{pilot_id} not in ranking')
+
+
+class RankingTimeline(BaseObject):
+    """
+    Ranking of a race every step seconds, written to JSON files while it is computed.
+
+    Arguments:
+        ranking (Ranking) : The ranking of the race.
+        start (~datetime.time) : The first ranking.
+        stop (~datetime.time) : The second following the last ranking.
+        step (int) : The number of seconds between two rankings.
+        top (int) : Number of leading pilots of each ranking, every pilot if not set.
+    """
+
+    def __init__(self, ranking, start, stop, step=60, top=None):
+        if step < 1:
+            raise ValueError(f'Ranking step must be a positive number of seconds but is {step}')
+        self.step = step
+        self.top = top
+        self._ranking = ranking
+        self._window = (start, stop)
+
+    def __iter__(self):
+        return self._ranking.timeline(*self._window, step=self.step, top=self.top)
+
+    def serialize(self):
+        props = {'step': self.step, 'top': self.top}
+        return dict(properties=props, ranking=Stream((str(timestamp), ranking) for timestamp, ranking in self))
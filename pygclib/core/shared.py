@@ -0,0 +1,142 @@
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from pygclib.core.flight import Flight
+
+SHARED_COLUMNS = {
+    'seconds': np.int32,
+    'lat': np.float64,
+    'lon': np.float64,
+    'altitude': np.int32,
+    'pressure_altitude': np.int32,
+    'goal_distance': np.float64,
+}
+
+
+class SharedFlights():
+    """
+    Fix columns of several flights, stored in a single shared memory block that other processes attach to by name.
+
+    Each column of every flight is concatenated in a segment of the block, flights being identified by their row range.
+    Only the handle of the block and the rows of the flights go through pickling, so that processes exchange flights without copying their fixes.
+    Rows may be reserved for flights which are not parsed yet, each process parsing a flight writing it in its rows with :meth:`put`.
+    The process creating the block must :meth:`unlink` it once every process is done with it.
+
+    Arguments:
+        flights (dict [str, Flight]) : A collection of Flights indexed by pilot ID, copied to a new block.
+        capacities (dict [str, int]) : Number of rows reserved after the flights for each pilot ID, at least its number of fixes.
+
+    Attributes:
+        rows (dict [str, tuple [int, int, str]]) : First row, end row and pilot name of each pilot ID.
+        slots (dict [str, tuple [int, int]]) : First row and number of rows reserved for each pilot ID.
+    """
+
+    def __init__(self, flights=None, capacities=None):
+        flights = flights or {}
+        self.rows = {}
+        self.slots = {}
+        total = 0
+        for pilot_id, capacity in [*((pilot_id, len(flight)) for pilot_id, flight in flights.items()), *(capacities or {}).items()]:
+            self.slots[pilot_id] = (total, capacity)
+            total += capacity
+
+        self._total = total
+        self._block = shared_memory.SharedMemory(create=True, size=max(column_layout(total)[1], 1))
+        self._columns = self._views()
+        for pilot_id, flight in flights.items():
+            self.put(pilot_id, flight)
+
+    @property
+    def handle(self):
+        """Picklable reference to the block, from which :meth:`attach` builds an instance in another process."""
+        return self._block.name, self._total
+
+    @classmethod
+    def attach(cls, handle, rows=None):
+        """Returns an instance reading the block of handle, created by another process, in which flights are found at rows."""
+        name, total = handle
+        shared = cls.__new__(cls)
+        shared.rows = dict(rows or {})
+        shared._total = total
+        shared._block = shared_memory.SharedMemory(name=name)
+        shared._columns = shared._views()
+        return shared
+
+    def _views(self):
+        offsets, _ = column_layout(self._total)
+        return {column: np.ndarray(self._total, dtype=dtype, buffer=self._block.buf, offset=offsets[column]) for column, dtype in SHARED_COLUMNS.items()}
+
+    def flight(self, pilot_id, copy=False):
+        """
+        Returns the Flight of pilot_id.
+
+        Arguments:
+            pilot_id (str) : The pilot ID of the flight.
+            copy (bool) : Whether the columns are copied out of the block, otherwise they are views which are only valid until the block is closed.
+        """
+        start, stop, pilot_name = self.rows[pilot_id]
+        columns = (self._columns[column][start:stop] for column in SHARED_COLUMNS)
+        if copy:
+            columns = (column.copy() for column in columns)
+        return Flight.from_arrays(pilot_id, pilot_name, *columns)
+
+    def put(self, pilot_id, flight, slot=None):
+        """
+        Writes the columns of flight in the rows reserved for pilot_id, and returns its row range and pilot name.
+
+        Arguments:
+            pilot_id (str) : The pilot ID of the flight.
+            flight (Flight) : The flight to write.
+            slot (tuple [int, int]) : First row and number of rows reserved for the flight, read from :attr:`slots` if not given.
+
+        Raises:
+            ValueError: If the flight does not fit in its rows.
+        """
+        start, capacity = self.slots[pilot_id] if slot is None else slot
+        if len(flight) > capacity:
+            raise ValueError(f'{pilot_id} has {len(flight)} fixes but only {capacity} rows were reserved for it')
+
+        stop = start + len(flight)
+        for column, view in self._columns.items():
+            view[start:stop] = getattr(flight, column)
+        self.rows[pilot_id] = (start, stop, flight.pilot_name)
+        return self.rows[pilot_id]
+
+    def detach(self, flights):
+        """Replaces the columns of the flights read from the block by copies, so that they outlive it."""
+        for pilot_id in self.rows:
+            flight = flights[pilot_id]
+            if np.may_share_memory(flight.seconds, self._columns['seconds']):
+                flight._set_columns(*(getattr(flight, column).copy() for column in SHARED_COLUMNS))
+
+    def goal_distance(self, pilot_id):
+        """Returns the goal distance column of pilot_id, writable by every process attached to the block."""
+        start, stop, _ = self.rows[pilot_id]
+        return self._columns['goal_distance'][start:stop]
+
+    @staticmethod
+    def share_tracker():
+        """
+        Starts the resource tracker of the current process, to be called before starting the processes which create or attach blocks.
+
+        Processes started afterwards report their blocks to this tracker, instead of starting their own which would destroy the blocks they
+        created or attached when they exit.
+        """
+        resource_tracker.ensure_running()
+
+    def close(self):
+        # views must be released before the buffer they point to
+        self._columns = None
+        self._block.close()
+
+    def unlink(self):
+        self.close()
+        self._block.unlink()
+
+
+def column_layout(total):
+    """Returns the byte offset of each column in a block of total rows, aligned on 8 bytes, and the size of the block."""
+    offsets, size = {}, 0
+    for column, dtype in SHARED_COLUMNS.items():
+        offsets[column] = size
+        size += -(-total * np.dtype(dtype).itemsize // 8) * 8
+    return offsets, size
@@ -0,0 +1,149 @@
+import json
+import mmap
+import os
+import pickle
+import struct
+from collections.abc import Mapping
+
+import numpy as np
+from pygclib.core.flight import Flight
+from pygclib.core.shared import SHARED_COLUMNS, column_layout
+from pygclib.time.timeop import to_seconds, to_time
+
+STORE_EXTENSION = '.race'
+STORE_MAGIC = b'PYGCLIB-RACE'
+STORE_VERSION = 1
+
+# magic bytes, format version and length of the JSON header
+PREAMBLE = struct.Struct(f'<{len(STORE_MAGIC)}sIQ')
+
+# segments start on page boundaries, so that reading a flight only maps its own pages
+SEGMENT_ALIGNMENT = mmap.ALLOCATIONGRANULARITY
+
+
+def write_store(race, path):
+    """
+    Writes race to a race store, which :func:`read_store` opens without reading the flights.
+
+    The file starts with a preamble and a JSON header describing the segments of the file. The first segment is a pickle of
+    the attributes of the race other than its flights, such as its task and ranking. The second segment holds the totals of the frames
+    of the race, from which pilots are compared to the others without reading every flight. Each of the following segments holds
+    the fix columns of a flight, laid out like in :class:`~pygclib.core.shared.SharedFlights`.
+
+    Arguments:
+        race (Race) : The race to write.
+        path (str) : The file to which the race is written.
+    """
+    state = pickle.dumps({key: value for key, value in race.dump().items() if key != 'flights'})
+    offset = 0
+    segments = {'state': [offset, len(state)]}
+    offset = _align(offset + len(state))
+    totals = race.frames.totals()
+    segments['totals'] = [offset, totals.nbytes]
+    offset = _align(offset + totals.nbytes)
+
+    pilots = {}
+    for pilot_id, flight in race.flights.items():
+        size = column_layout(len(flight))[1]
+        pilots[pilot_id] = {
+            'name': flight.pilot_name,
+            'fixes': len(flight),
+            'race_distance': flight.race_distance,
+            'race_time': None if flight.race_time is None else to_seconds(flight.race_time) + flight.race_time.microsecond / 1000000,
+            'segment': [offset, size],
+        }
+        offset = _align(offset + size)
+
+    header = json.dumps({'segments': segments, 'pilots': pilots}).encode('utf8')
+    data_start = _align(PREAMBLE.size + len(header))
+
+    # write then rename so that readers never map a partial store
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(STORE_MAGIC, STORE_VERSION, len(header)))
+        f.write(header)
+        f.seek(data_start + segments['state'][0])
+        f.write(state)
+        f.seek(data_start + segments['totals'][0])
+        f.write(totals.tobytes())
+        for pilot_id, flight in race.flights.items():
+            offsets, _ = column_layout(len(flight))
+            for column, dtype in SHARED_COLUMNS.items():
+                f.seek(data_start + pilots[pilot_id]['segment'][0] + offsets[column])
+                f.write(np.ascontiguousarray(getattr(flight, column), dtype=dtype).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_store(path):
+    """
+    Returns the attributes of the race stored in path, its flights being read on first access.
+
+    Raises:
+        ValueError: If path is not a race store, or was written by a newer version.
+    """
+    with open(path, 'rb') as f:
+        magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if magic != STORE_MAGIC:
+            raise ValueError(f'{path} is not a race store')
+        if version > STORE_VERSION:
+            raise ValueError(f'{path} was written by a newer version of the race store ({version} > {STORE_VERSION})')
+        header = json.loads(f.read(header_length))
+        # copy on write, so that validating a stored race never modifies the file
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = _align(PREAMBLE.size + header_length)
+    start, length = header['segments']['state']
+    state = pickle.loads(buffer[data_start + start:data_start + start + length])
+    state['flights'] = StoredFlights(buffer, data_start, header['pilots'])
+    # stores written before the totals segment was added compute them from the frames
+    if 'totals' in header['segments']:
+        start, length = header['segments']['totals']
+        state['_frame_totals'] = np.frombuffer(buffer, dtype=np.float64, count=length // 8, offset=data_start + start).reshape(3, -1)
+    return state
+
+
+class StoredFlights(Mapping):
+    """
+    Flights of a race store indexed by pilot ID, each flight being built on first access around views of the mapped file.
+
+    Pickling a StoredFlights pickles a dict of every flight, whose columns are copied out of the file.
+    """
+
+    def __init__(self, buffer, data_start, pilots):
+        self._buffer = buffer
+        self._data_start = data_start
+        self._pilots = pilots
+        self._flights = {}
+
+    def __getitem__(self, pilot_id):
+        if pilot_id not in self._flights:
+            self._flights[pilot_id] = self._read(pilot_id, self._pilots[pilot_id])
+        return self._flights[pilot_id]
+
+    def __setitem__(self, pilot_id, flight):
+        self._pilots.setdefault(pilot_id, None)
+        self._flights[pilot_id] = flight
+
+    def _read(self, pilot_id, pilot):
+        fixes = pilot['fixes']
+        offsets, _ = column_layout(fixes)
+        start = self._data_start + pilot['segment'][0]
+        columns = (np.frombuffer(self._buffer, dtype=dtype, count=fixes, offset=start + offsets[column]) for column, dtype in SHARED_COLUMNS.items())
+        flight = Flight.from_arrays(pilot_id, pilot['name'], *columns)
+        flight.race_distance = pilot['race_distance']
+        flight.race_time = None if pilot['race_time'] is None else to_time(pilot['race_time'])
+        return flight
+
+    def __iter__(self):
+        return iter(self._pilots)
+
+    def __len__(self):
+        return len(self._pilots)
+
+    def __reduce__(self):
+        return dict, (dict(self.items()),)
+
+
+def _align(offset):
+    return -(-offset // SEGMENT_ALIGNMENT) * SEGMENT_ALIGNMENT
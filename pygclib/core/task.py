@@ -3,11 +3,14 @@ import json
 import logging
 import os
 
+import numpy as np
+from pygclib.constants import GEODESY, OPTIMIZER_ENGINE, TOLERANCE, VALIDATION_TOLERANCE
 from pygclib.core import BaseObject
-from pygclib.geography import distance, heading
-from pygclib.geography.optimizer import optimize
+from pygclib.geography import distance, distance_pairwise, geodesy, heading
+from pygclib.geography.field import GoalDistanceField
+from pygclib.geography.optimizer import _waypoint_arrays, optimize
 from pygclib.parsers import taskparse
-from pygclib.time.timeop import next_second
+from pygclib.time.timeop import seconds_after, to_seconds, to_time, unwrap_seconds
 
 
 class Task(BaseObject):
@@ -18,11 +21,14 @@ class Task(BaseObject):
 
     Args:
         task (str): Path to or base64 representation of a task file.
+        geodesy (str): Geodesy mode of the distance computations, projections being scaled at the latitude of the task centroid.
+        engine (str): Optimizer engine of the task distance and of the goal distances during validation.
+        tolerance (float): Maximum error of the goal distances computed during validation, in meters. If 0, every goal distance is optimized.
     Raises:
         NotImplementedError: If the task could not be parsed.
     """
 
-    def __init__(self, task):
+    def __init__(self, task, geodesy=GEODESY, engine=OPTIMIZER_ENGINE, tolerance=VALIDATION_TOLERANCE):
 
         # try to base64 decode the task
         if not os.path.isfile(task):
@@ -48,7 +54,15 @@ class Task(BaseObject):
             raise NotImplementedError('Task format not recognized')
 
         self.__dict__.update(task.__dict__)
+        self.geodesy = geodesy
+        self.engine = engine
+        self.tolerance = tolerance
 
+        with self._geodesy():
+            self._set_route()
+
+    def _set_route(self):
+        """Computes the heading of the last leg of a goal line and the optimized route of the task."""
         # if the goal is a line, we need a to compute its validation with the following technique
         # we compute the heading between the goal and the first previous turnpoint which has a different center
         # during validation, we compute the heading between the pilot and the goal center
@@ -60,59 +74,277 @@ class Task(BaseObject):
                 index_last_turnpoint -= 1
             self.last_leg_heading = heading(self.turnpoints[index_last_turnpoint], self.turnpoints[-1])
 
-        self.opti = optimize(self.takeoff, self.turnpoints)
+        self.opti = optimize(self.takeoff, self.turnpoints, engine=self.engine)
+
+    @property
+    def centroid(self):
+        """Mean latitude and longitude of the takeoff and turnpoints."""
+        points = [self.takeoff] + self.turnpoints
+        return float(np.mean([p.lat for p in points])), float(np.mean([p.lon for p in points]))
+
+    def _geodesy(self):
+        """Context computing distances in the geodesy mode of the task, around its centroid."""
+        # tasks saved before geodesy modes were introduced were computed with exact distances
+        return geodesy(getattr(self, 'geodesy', 'exact'), self.centroid)
 
-    def _timerange(self, start=None, stop=None):
-        current = start or self.open
-        stop = stop or self.stop
-        while current < stop:
-            yield current
-            current = next_second(current)
+    @property
+    def seconds(self):
+        """Opening, start and deadline of the task in seconds since the midnight preceding the opening, increasing across midnight."""
+        opening = to_seconds(self.open)
+        return opening, seconds_after(self.start, opening), seconds_after(self.stop, opening)
 
     def update_tag_times(self, times):
+        """Keeps the earliest tag time of each turnpoint, times being in seconds since the midnight preceding the task opening."""
+        opening = self.seconds[0]
         for turnpoint, contender in zip(self.turnpoints, times):
-            if turnpoint.first_tag is None or contender < turnpoint.first_tag:
-                turnpoint.first_tag = contender
+            first_tag = turnpoint.first_tag
+            if first_tag is None or contender < seconds_after(first_tag, opening) + first_tag.microsecond / 1000000:
+                turnpoint.first_tag = to_time(contender)
 
-    def validate(self, flight):
-        remaining_turnpoints = self.turnpoints.copy()
-        goal_distances = {}
-        tag_times = []
-        optimizer_init_vector = None
+    @property
+    def field(self):
+        """Goal distance field of the turnpoints, built on first access."""
+        if getattr(self, '_field', None) is None:
+            with self._geodesy():
+                self._field = GoalDistanceField(self.turnpoints)
+        return self._field
 
-        for timestamp, point in flight.points.items():
+    def prepare_validation(self):
+        """Builds the goal distance field if the task engine uses it, so that it is built once and sent to the validation processes along with the task."""
+        if getattr(self, 'engine', OPTIMIZER_ENGINE) == 'field':
+            return self.field
 
-            # race has not started yet
-            if timestamp < self.start:
-                opti = optimize(point, remaining_turnpoints, prev_opti=optimizer_init_vector)
-                goal_distances[timestamp] = opti.distance
-                optimizer_init_vector = opti._angles
+    def validate(self, flight, engine=None, tolerance=None):
+        """
+        Computes the goal distance of each point of flight and the times at which it tagged each turnpoint.
 
-            # race has started, check next turnpoint's closeness and validate it
-            elif remaining_turnpoints:
-                opti = optimize(point, remaining_turnpoints, prev_opti=optimizer_init_vector)
-                goal_distances[timestamp] = opti.distance
-                optimizer_init_vector = opti._angles
+        Results are arrays, which are cheap to send back from validation processes : the goal distances are float32 in the order of the fixes
+        of flight, and the tag times are in seconds since the midnight preceding the task opening, with the fraction of second of interpolated crossings.
 
-                # if only one turnpoint left, validate it as goal line by heading difference (95° to be sure the goal line is behind)
-                if len(remaining_turnpoints) == 1:
-                    goal_heading = heading(point, remaining_turnpoints[-1])
-                    delta_heading = abs(self.last_leg_heading - goal_heading)
-                    if delta_heading > 95:
-                        tag_times.append(timestamp)
-                        del remaining_turnpoints[0]
-                        logging.debug(f'{flight.pilot_id} passed TP at {timestamp}, {len(remaining_turnpoints)} wp remaining')
+        Arguments:
+            flight (Flight) : The flight to validate.
+            engine (str) : Optimizer engine of the goal distances, defaults to the engine of the task.
+            tolerance (float) : Maximum error of the goal distances in meters, defaults to the tolerance of the task. If 0, every goal distance is optimized.
+        """
+        engine = engine or getattr(self, 'engine', OPTIMIZER_ENGINE)
+        tolerance = getattr(self, 'tolerance', VALIDATION_TOLERANCE) if tolerance is None else tolerance
 
-                elif point.close_enough(remaining_turnpoints[0]):
-                    tag_times.append(timestamp)
-                    del remaining_turnpoints[0]
-                    logging.debug(f'{flight.pilot_id} passed TP at {timestamp}, {len(remaining_turnpoints)} wp remaining')
+        # the mode is scoped to the validation, which may run in another thread or process than the task
+        with self._geodesy():
+            next_turnpoints, tag_times = self._tag(flight)
 
+            if tolerance > 0:
+                distances = self._adaptive_goal_distances(flight, next_turnpoints, engine, tolerance)
+            else:
+                distances = self._goal_distances(flight, next_turnpoints, engine, np.arange(len(flight)))
+
+        return flight.pilot_id, distances.astype(np.float32), tag_times
+
+    def _goal_distances(self, flight, next_turnpoints, engine, indices, state=None):
+        """Returns the optimized goal distances of the points at indices, in increasing order. The optimizer is warm started from the angles kept by state."""
+        if engine == 'field':
+            # points are in fix order, like the coordinate columns
+            return self.field.goal_distances(flight.lat[indices], flight.lon[indices], next_turnpoints[indices])
+
+        distances = np.zeros(len(indices))
+        optimizer_init_vector = None if state is None else state.angles
+        for i, index in enumerate(indices):
             # in goal, fill with zeros until landing
+            if next_turnpoints[index] < len(self.turnpoints):
+                opti = optimize(flight[int(index)], self.turnpoints[next_turnpoints[index]:], prev_opti=optimizer_init_vector, engine=engine)
+                distances[i] = opti.distance
+                optimizer_init_vector = opti._angles
+        if state is not None:
+            state.angles = optimizer_init_vector
+        return distances
+
+    def validate_increment(self, flight, state=None):
+        """
+        Validates the fixes appended to flight since the previous call, such as the fixes of a live flight.
+
+        The state of the validation of the flight is kept between calls, so that only the new fixes are tagged and optimized,
+        along with the fixes whose next turnpoint changed : a pilot getting close enough to a cylinder is tagged when it leaves,
+        unless it crosses the cylinder before, which is only known once fixes after the approach are appended.
+        Every goal distance is optimized, whatever the tolerance of the task.
+
+        Arguments:
+            flight (Flight) : The flight to validate, whose fixes were appended since the previous call.
+            state (ValidationState) : The state returned by the previous call, or None to validate flight from its first fix.
+
+        Returns:
+            ValidationState, ~numpy.ndarray [int], ~numpy.ndarray [float], ~numpy.ndarray [float] : The state of the validation, the indices of the fixes
+            whose goal distance changed, their goal distances, and the tag times of the flight like :meth:`validate`.
+        """
+        engine = getattr(self, 'engine', OPTIMIZER_ENGINE)
+        state = ValidationState() if state is None else state
+        with self._geodesy():
+            return self._validate_increment(flight, state, engine)
+
+    def _validate_increment(self, flight, state, engine):
+        # tagging resumes at the first turnpoint whose tag was not final, tags before it being kept by the state
+        next_turnpoints, tag_times, (first, tagged) = self._tag_from(flight, state.first, len(state.tag_times))
+        tag_times = np.concatenate((state.tag_times, tag_times))
+        changed = state.first + np.flatnonzero(state.next_turnpoints[state.first:state.validated] != next_turnpoints[:state.validated - state.first])
+        state.set_next_turnpoints(next_turnpoints, len(flight))
+        indices = np.concatenate((changed, np.arange(state.validated, len(flight))))
+        state.validated = len(flight)
+
+        distances = self._goal_distances(flight, state.next_turnpoints, engine, indices, state)
+        state.tag_times = tag_times[:tagged]
+        state.first = first
+        return state, indices, distances.astype(np.float32), tag_times
+
+    def _adaptive_goal_distances(self, flight, next_turnpoints, engine, tolerance):
+        """
+        Optimizes the goal distances of anchor points only, and bounds the goal distances of the points between them.
+
+        While the next turnpoint does not change, moving by some distance changes the goal distance by at most this distance,
+        and the distance between two points is at most the length of the track between them. An anchor is placed each time
+        the track gets longer than half the tolerance, and at the first and last points before each turnpoint, so that the goal
+        distance of a point between two anchors is known within an interval narrower than the tolerance.
+        The goal distances of the points which could be lower than every anchor are optimized, so that the minimum goal distance is exact.
+        """
+        steps = distance(flight.lat[:-1], flight.lon[:-1], flight.lat[1:], flight.lon[1:])
+        track = np.concatenate(([0], np.cumsum(steps)))
+
+        new_turnpoint = np.concatenate(([True], next_turnpoints[1:] != next_turnpoints[:-1]))
+        last_before_turnpoint = np.concatenate((new_turnpoint[1:], [True]))
+        bucket = np.floor(track / (tolerance / 2))
+        new_bucket = np.concatenate(([True], bucket[1:] != bucket[:-1]))
+        anchors = np.flatnonzero(new_turnpoint | last_before_turnpoint | new_bucket)
+
+        distances = np.full(len(flight), np.nan)
+        distances[anchors] = self._goal_distances(flight, next_turnpoints, engine, anchors)
+
+        others = np.flatnonzero(np.isnan(distances))
+        previous = anchors[np.searchsorted(anchors, others) - 1]
+        following = anchors[np.searchsorted(anchors, others)]
+        to_previous = track[others] - track[previous]
+        to_following = track[following] - track[others]
+        lower = np.maximum(distances[previous] - to_previous, distances[following] - to_following)
+        upper = np.minimum(distances[previous] + to_previous, distances[following] + to_following)
+        ratio = np.divide(to_previous, to_previous + to_following, out=np.zeros(len(others)), where=to_previous + to_following > 0)
+        interpolated = distances[previous] + (distances[following] - distances[previous]) * ratio
+        distances[others] = np.clip(interpolated, lower, upper)
+
+        candidates = others[lower < distances[anchors].min()]
+        distances[candidates] = self._goal_distances(flight, next_turnpoints, engine, candidates)
+        return distances
+
+    def _tag(self, flight):
+        """
+        Returns the index of the next turnpoint to tag at each fix of flight, and the times at which turnpoints were tagged in seconds since the midnight preceding the task opening.
+
+        Distances from every fix to every turnpoint are computed at once. Turnpoints are then tagged in order, after the task start and the previous tag.
+        A pilot crossing the cylinder is tagged at the crossing time, interpolated between the fixes on both sides of the cylinder.
+        A pilot getting close enough to the cylinder and leaving it without crossing is tagged at the first fix close enough.
+        A goal line is crossed when the heading from the pilot to the goal differs from the heading of the last leg by more than 95°.
+        """
+        next_turnpoints, tag_times, _ = self._tag_from(flight, 0, 0)
+        return next_turnpoints, tag_times
+
+    def _tag_from(self, flight, first, tagged):
+        """
+        Tags the turnpoints following the first tagged ones with the fixes of flight from index first, like :meth:`_tag`.
+
+        Returns:
+            ~numpy.ndarray [int], ~numpy.ndarray [float], tuple [int, int] : The next turnpoint of each fix from index first, the tag times of the
+            turnpoints following the first tagged ones, and the fix and the number of tagged turnpoints from which tagging resumes once fixes are appended.
+            Tags are final up to the latter, the following ones depending on an approach of a cylinder which goes on at the last fix.
+        """
+        # the segment ending at the first fix may cross the next turnpoint
+        base = max(first - 1, 0)
+        first -= base
+        first_fix = first
+        lat, lon = flight.lat[base:], flight.lon[base:]
+        lats, lons, radii = _waypoint_arrays(self.turnpoints)
+        # fixes and tag times are counted from the midnight preceding the task opening, flights crossing midnight being unwrapped
+        start = self.seconds[1]
+        seconds = unwrap_seconds(flight.seconds[base:], start).astype(np.float64)
+        started = seconds >= start
+
+        # signed distance to each cylinder boundary, a goal line is crossed when heading differences go above 95°
+        borders = distance_pairwise(lat, lon, lats, lons) - radii
+        touching = np.abs(borders) < 10 + radii * TOLERANCE
+        if self.goal_style == 'LINE':
+            borders[:, -1] = np.abs(self.last_leg_heading - heading(lat, lon, lats[-1], lons[-1])) - 95
+            touching[:, -1] = borders[:, -1] > 0
+
+        # crossing time of each turnpoint between each fix and the next one
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = borders[:-1] / (borders[:-1] - borders[1:])
+            crossing_times = seconds[:-1, None] + (seconds[1:] - seconds[:-1])[:, None] * ratio
+        crossed = (np.sign(borders[:-1]) != np.sign(borders[1:])) & (crossing_times >= start)
+
+        next_turnpoints = np.full(len(seconds), len(self.turnpoints))
+        tag_times = []
+        resume = None
+        for turnpoint in range(tagged, len(self.turnpoints)):
+            # fix reached by the first crossing, the fix of the previous tag being the start of the first segment which may cross
+            crosses = np.concatenate(([False], crossed[:, turnpoint]))[first:]
+            crossing = first + int(np.argmax(crosses)) if crosses.any() else None
+
+            # first fix close enough to the cylinder, and last fix of the approach in which it stays close enough
+            touches = started[first:] & touching[first:, turnpoint]
+            touch = first + int(np.argmax(touches)) if touches.any() else None
+            if touch is not None:
+                leaving = ~touching[touch:, turnpoint]
+                approach_end = touch + int(np.argmax(leaving)) - 1 if leaving.any() else len(seconds) - 1
+
+            # pilots crossing the cylinder are tagged when crossing it, pilots only touching it when they get close enough
+            if crossing is not None and (touch is None or crossing <= approach_end + 1):
+                index = crossing
+                tag = crossing_times[index - 1, turnpoint]
+            elif touch is not None:
+                index = touch
+                tag = seconds[index]
+                # until the pilot leaves the cylinder, a crossing may still come first
+                if resume is None and not leaving.any():
+                    resume = (base + first, tagged + len(tag_times))
             else:
-                goal_distances[timestamp] = 0
+                next_turnpoints[first:] = turnpoint
+                break
+
+            next_turnpoints[first:index + 1] = turnpoint
+            tag_times.append(tag)
+            logging.debug(f'{flight.pilot_id} passed TP at {to_time(tag)}, {len(self.turnpoints) - len(tag_times)} wp remaining')
+            first = index + 1
 
-        return flight.pilot_id, goal_distances, tag_times
+        if resume is None:
+            resume = (base + first, tagged + len(tag_times))
+        return next_turnpoints[first_fix:], np.array(tag_times, dtype=np.float64), resume
 
     def __len__(self):
         return int(self.opti.distance)
+
+
+class ValidationState():
+    """
+    State of the validation of a flight whose fixes are appended over time, kept between calls of :meth:`Task.validate_increment`.
+
+    Attributes:
+        validated (int) : Number of validated fixes.
+        first (int) : Fix from which turnpoints are tagged again when fixes are appended.
+        tag_times (~numpy.ndarray [float]) : Final tag times of the first turnpoints, in seconds since the midnight preceding the task opening.
+        next_turnpoints (~numpy.ndarray [int]) : Next turnpoint of each validated fix.
+        angles (~numpy.ndarray [float]) : Angles of the last optimized route, from which the optimizer starts.
+    """
+
+    def __init__(self):
+        self.validated = 0
+        self.first = 0
+        self.tag_times = np.zeros(0)
+        self.angles = None
+        self._next_turnpoints = np.zeros(0, dtype=np.int64)
+
+    @property
+    def next_turnpoints(self):
+        return self._next_turnpoints[:self.validated]
+
+    def set_next_turnpoints(self, next_turnpoints, total):
+        """Sets the next turnpoints of the fixes from first to total, in a buffer of doubling capacity."""
+        if len(self._next_turnpoints) < total:
+            buffer = np.empty(max(2 * total, 16), dtype=np.int64)
+            buffer[:self.first] = self._next_turnpoints[:self.first]
+            self._next_turnpoints = buffer
+        self._next_turnpoints[self.first:total] = next_turnpoints
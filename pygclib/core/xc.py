@@ -2,9 +2,11 @@ import logging
 import os
 
 from aerofiles import openair
+from pygclib.constants import GEODESY
 from pygclib.core import BaseObject
 from pygclib.core.airspace import Airspace
 from pygclib.core.flight import Flight
+from pygclib.geography import geodesy as geodesy_mode
 from pygclib.geography.elevation import elevation
 from pygclib.geography.geo import Point
 from pygclib.optimization.branchbound import compute_score
@@ -16,16 +18,20 @@ from tqdm import tqdm
 class XC(BaseObject):
     """
     XC flight
+
+    Keyword Arguments:
+        geodesy (str): Geodesy mode of the airspace checks, projections being scaled at the mid-latitude of the flight bounding box.
     """
 
-    def __init__(self, tracks=None, airspace=None, progress='gui'):
+    def __init__(self, tracks=None, airspace=None, progress='gui', geodesy=GEODESY):
         self.flight = Flight(tracks)
-        self.points = [Point(p.lat, p.lon, p.altitude) for p in self.flight.to_list()]
+        fixes = self.flight.to_list()
+        self.points = [Point(p.lat, p.lon, p.altitude) for p in fixes]
         self._bounds = self.get_bounding_box()
-        self.score = compute_score(self.flight.to_list())
+        self.score = compute_score(fixes)
         self._progress = progress
 
-        ground_altitude = elevation(self.flight.to_list())
+        ground_altitude = elevation(fixes)
         if not ground_altitude:
             self.agl_validable = False
         else:
@@ -35,8 +41,10 @@ class XC(BaseObject):
 
         self.violations = {}
         if airspace is not None:
-            airspace = self.read_airspace(airspace)
-            self.validate(airspace)
+            min_lat, min_lon, max_lat, max_lon = self._bounds
+            with geodesy_mode(geodesy, ((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)):
+                airspace = self.read_airspace(airspace)
+                self.validate(airspace)
 
     def read_airspace(self, airspace):
         index = Index()
@@ -1,6 +1,6 @@
 import requests
-import zipfile
 import os
+import tempfile
 from tqdm import tqdm
 from bs4 import BeautifulSoup
 from datetime import datetime
@@ -14,7 +14,7 @@ class FlightCrawler():
 
     def __init__(self, task, progress=None):
         self._progress = progress
-        self.directory = self.crawl_pwca(task)
+        self.archive = self.crawl_pwca(task)
 
     def crawl_pwca(self, task):
         date = datetime.strptime(task.date, '%Y-%m-%d')
@@ -30,21 +30,21 @@ class FlightCrawler():
         tracks = requests.get(URL + tracks_link, stream=True)
         file_size = int(tracks.headers.get('content-length', 0))
 
-        with open(f'/tmp/{task.date}.zip', 'wb') as f:
-            downloaded = 0
-            with tqdm(total=file_size, desc='downloading_tracks', disable=self._progress != 'gui') as pbar:
-                for data in tracks.iter_content(32 * 1024):
-                    f.write(data)
-                    if self._progress == 'ratio':
-                        downloaded += len(data)
-                        print(f'{downloaded/file_size:.0%}', file=sys.stderr, flush=True)
-                    else:
-                        pbar.update(len(data))
-
-        tracks_dir = f'/tmp/{task.date}'
-        if not os.path.isdir(tracks_dir):
-            z = zipfile.ZipFile(f'/tmp/{task.date}.zip')
-            z.extractall(tracks_dir)
-            os.chmod(tracks_dir, 0o777)
-        os.remove(f'/tmp/{task.date}.zip')
-        return tracks_dir
+        # a unique file name lets concurrent runs crawl the same task
+        fd, archive = tempfile.mkstemp(prefix=f'{task.date}_', suffix='.zip')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                downloaded = 0
+                with tqdm(total=file_size, desc='downloading_tracks', disable=self._progress != 'gui') as pbar:
+                    for data in tracks.iter_content(32 * 1024):
+                        f.write(data)
+                        if self._progress == 'ratio':
+                            downloaded += len(data)
+                            print(f'{downloaded/file_size:.0%}', file=sys.stderr, flush=True)
+                        else:
+                            pbar.update(len(data))
+        except BaseException:
+            os.remove(archive)
+            raise
+
+        return archive
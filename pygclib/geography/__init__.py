@@ -3,31 +3,175 @@ This module contains the base classes representing a GeoPoint, a Turnpoint and a
 It also provides convenience wrappers around C extension function calls.
 These wrappers allow for more concise function calls to improve readability.
 
+Each wrapper dispatches to the batch version of the C function when it is given NumPy arrays,
+in which case it returns arrays broadcast against each other.
+
+All computations follow the geodesy mode of the current context, set with :func:`geodesy` or :func:`set_geodesy` :
+
+* exact computes geodesics on the WGS84 ellipsoid.
+* haversine computes great circles on a sphere of mean earth radius, within 0.6% of the exact distance.
+* projected computes straight lines on an equirectangular plane. Latitude differences are scaled by the meridional radius
+  of curvature of the ellipsoid at the latitude of the projection origin, and longitude differences by its normal radius of curvature
+  times the cosine of the mid-latitude of each segment. Only the latitude of the origin is used. This is not a tangent plane,
+  whose scale would drift away from the origin : distances stay within 0.02% of the exact distance between points less than 1°
+  of latitude away from the origin.
+
+The mode is not a global state of the C extension : it is passed to every call, and kept in a context variable so that
+threads, and tasks computing in different modes, never see each other's mode. New threads start in the exact mode.
+
 .. automodule:: pygclib.geography.geo
     :members:
 """
 
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
 from geolib import destination as c_destination
+from geolib import destination_many as c_destination_many
 from geolib import distance as c_distance
+from geolib import distance_many as c_distance_many
+from geolib import distance_pairwise as c_distance_pairwise
 from geolib import heading as c_heading
+from geolib import heading_many as c_heading_many
+from geolib import route as c_route
+from geolib import tasklen as c_tasklen
+from pygclib.constants import GEODESY_MODES
+
+# geodesy mode index and latitude of the projection origin passed to the C extension
+_GEODESY = ContextVar('geodesy', default=(0, 0.))
+
+
+def set_geodesy(mode, origin=None):
+    """
+    Sets the geodesy mode of the subsequent distance, heading and destination computations of the current context.
+    Prefer :func:`geodesy`, which restores the previous mode.
+
+    Arguments:
+        mode (str) : One of GEODESY_MODES.
+        origin (tuple [float, float]) : Latitude and longitude of the projection origin, only the latitude being used by the projected mode.
+
+    Raises:
+        ValueError: If mode is unknown.
+    """
+    _GEODESY.set(_geodesy_args(mode, origin))
+
+
+def get_geodesy():
+    """Returns the geodesy mode of the current context."""
+    return GEODESY_MODES[_GEODESY.get()[0]]
+
+
+@contextmanager
+def geodesy(mode, origin=None):
+    """Context manager computing distances in another geodesy mode, the previous mode being restored on exit."""
+    token = _GEODESY.set(_geodesy_args(mode, origin))
+    try:
+        yield
+    finally:
+        _GEODESY.reset(token)
+
+
+def _geodesy_args(mode, origin):
+    if mode not in GEODESY_MODES:
+        raise ValueError(f'Geodesy mode must be in {GEODESY_MODES} but is {mode}')
+    return GEODESY_MODES.index(mode), float(origin[0]) if origin is not None else 0.
 
 
 def distance(*args):
     if len(args) == 4:
-        return c_distance(*args)
+        if _any_array(args):
+            return distance_many(*args)
+        return c_distance(*args, *_GEODESY.get())
     elif len(args) == 2:
-        return c_distance(*args[0], *args[1])
+        return c_distance(*args[0], *args[1], *_GEODESY.get())
 
 
 def heading(*args):
     if len(args) == 4:
-        return c_heading(*args)
+        if _any_array(args):
+            return heading_many(*args)
+        return c_heading(*args, *_GEODESY.get())
     elif len(args) == 2:
-        return c_heading(*args[0], *args[1])
+        return c_heading(*args[0], *args[1], *_GEODESY.get())
 
 
 def destination(*args):
     if len(args) == 4:
-        return c_heading(*args)
+        if _any_array(args):
+            return destination_many(*args)
+        return c_destination(*args, *_GEODESY.get())
     elif len(args) == 3:
-        return c_destination(*args[0], *args[1:])
+        return c_destination(*args[0], *args[1:], *_GEODESY.get())
+
+
+def distance_many(lat1, lon1, lat2, lon2):
+    """Returns the distances between two arrays of points. A single point is compared to each point of the other array."""
+    arrays, shape = _prepare(lat1, lon1, lat2, lon2)
+    out = np.empty(shape)
+    c_distance_many(*arrays, out.reshape(-1), *_GEODESY.get())
+    return out
+
+
+def heading_many(lat1, lon1, lat2, lon2):
+    """Returns the headings between two arrays of points. A single point is compared to each point of the other array."""
+    arrays, shape = _prepare(lat1, lon1, lat2, lon2)
+    out = np.empty(shape)
+    c_heading_many(*arrays, out.reshape(-1), *_GEODESY.get())
+    return out
+
+
+def destination_many(lat, lon, dist, bearing):
+    """Returns the latitudes and longitudes of the arrival points given arrays of origin points, distances and headings."""
+    arrays, shape = _prepare(lat, lon, dist, bearing)
+    out_lat, out_lon = np.empty(shape), np.empty(shape)
+    c_destination_many(*arrays, out_lat.reshape(-1), out_lon.reshape(-1), *_GEODESY.get())
+    return out_lat, out_lon
+
+
+def distance_pairwise(lat1, lon1, lat2, lon2):
+    """Returns the (len(lat1), len(lat2)) matrix of distances between each point of the first array and each point of the second array."""
+    arrays = [np.ascontiguousarray(a, dtype=np.float64).reshape(-1) for a in (lat1, lon1, lat2, lon2)]
+    out = np.empty((len(arrays[0]), len(arrays[2])))
+    c_distance_pairwise(*arrays, out.reshape(-1), *_GEODESY.get())
+    return out
+
+
+def project(origin, lats, lons):
+    """
+    Returns the (..., 2) coordinates in meters of points on the azimuthal equidistant plane centered on origin, east then north.
+
+    Distances and headings from the origin are kept exactly. In the exact and haversine modes, the distance between two points at D meters
+    from the origin is stretched by at most about D² / 6R², R being the earth radius : less than 0.01% up to 100 km from the origin.
+    The projected mode scales each segment at its own mid-latitude, which makes the plane less consistent : distances between points
+    are then within 0.4% of the distances of the mode up to 100 km from the origin.
+    """
+    dist = distance_many(origin[0], origin[1], lats, lons)
+    angle = np.radians(heading_many(origin[0], origin[1], lats, lons))
+    return np.stack((dist * np.sin(angle), dist * np.cos(angle)), axis=-1)
+
+
+def route_headings(lat, lon, lats, lons, radii, headings, warm):
+    """Writes into headings the headings of the points of the shortest route from (lat, lon) through the cylinders, starting from them if warm."""
+    return c_route(lat, lon, lats, lons, radii, headings, warm, *_GEODESY.get())
+
+
+def route_length(lat, lon, lats, lons, radii, headings, gradient=None):
+    """Returns the length of the route from (lat, lon) through the points of the cylinders at headings, writing its derivatives into gradient if given."""
+    return c_tasklen(lat, lon, lats, lons, radii, headings, gradient, *_GEODESY.get())
+
+
+def _any_array(args):
+    return any(isinstance(a, np.ndarray) for a in args)
+
+
+def _prepare(*args):
+    """Returns contiguous flat float64 arrays of length 1 or of the broadcast size, and the broadcast shape."""
+    arrays = [np.asarray(a, dtype=np.float64) for a in args]
+    shape = np.broadcast_shapes(*(a.shape for a in arrays))
+    prepared = []
+    for a in arrays:
+        if a.size != 1 and a.shape != shape:
+            a = np.broadcast_to(a, shape)
+        prepared.append(np.ascontiguousarray(a).reshape(-1))
+    return prepared, shape
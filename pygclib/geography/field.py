@@ -0,0 +1,110 @@
+"""
+This module provides the goal distance field of a task, which answers the goal distance of many positions at once.
+
+The goal distance of a position is the length of the shortest route from this position through the remaining cylinders.
+Once the next cylinder is touched, the rest of the route only depends on the point where it was touched.
+For each cylinder, the field tabulates this cost-to-go for headings sampled around the cylinder, so that the goal distance
+of a position reduces to a minimization over the heading of the point touching the next cylinder.
+"""
+
+import numpy as np
+from pygclib.constants import FIELD_SAMPLES, FIELD_SEARCH_SAMPLES
+from pygclib.geography import destination_many, distance_many, project
+from pygclib.geography.geo import Turnpoint
+from pygclib.geography.optimizer import _waypoint_arrays, optimize
+from scipy.interpolate import CubicSpline
+
+# golden section ratio and number of iterations shrinking the search interval below a thousandth of a degree
+GOLDEN = (np.sqrt(5) - 1) / 2
+GOLDEN_ITERATIONS = 30
+
+
+class GoalDistanceField():
+    """
+    Cost-to-go of each cylinder of a sequence of turnpoints.
+
+    The minimization over the heading is first done on a coarse grid, then refined by a golden section search around the best heading of the grid.
+    Both steps are vectorized over positions and use a local plane centered on the turnpoints, the goal distance of the final heading being measured on the earth.
+
+    Arguments:
+        turnpoints (list [Turnpoint]) : The cylinders of the route, in order.
+        samples (int) : Number of headings at which the cost-to-go of each cylinder is computed.
+
+    Attributes:
+        headings (~numpy.ndarray [float]) : Sampled headings from the center of the cylinders, in degrees.
+        costs (list [~numpy.ndarray [float]]) : Length of the shortest route from each sampled point of each cylinder through the following cylinders.
+    """
+
+    def __init__(self, turnpoints, samples=FIELD_SAMPLES):
+        self.lats, self.lons, self.radii = _waypoint_arrays(turnpoints)
+        self.origin = (float(self.lats.mean()), float(self.lons.mean()))
+        self.centers = self._project(self.lats, self.lons)
+        self.headings = np.linspace(0, 360, samples, endpoint=False)
+        self.costs = []
+        self._splines = []
+        self._rotations = []
+
+        for i, turnpoint in enumerate(turnpoints):
+            if self.radii[i] == 0:
+                cost = np.array([optimize(turnpoint, turnpoints[i + 1:], engine='route').distance if i + 1 < len(turnpoints) else 0.])
+            else:
+                cost = np.zeros(samples)
+                if i + 1 < len(turnpoints):
+                    lats, lons = destination_many(self.lats[i], self.lons[i], self.radii[i], self.headings)
+                    angles = None
+                    for j, (lat, lon) in enumerate(zip(lats, lons)):
+                        opti = optimize(Turnpoint(lat, lon), turnpoints[i + 1:], prev_opti=angles, engine='route')
+                        cost[j], angles = opti.distance, opti._angles
+            self.costs.append(cost)
+            self._splines.append(CubicSpline(np.append(self.headings, 360), np.append(cost, cost[0]), bc_type='periodic') if len(cost) > 1 else None)
+
+            # headings on the earth are rotated in the plane by the convergence of the meridians
+            north = self._project(*destination_many(self.lats[i], self.lons[i], max(self.radii[i], 1.), 0.))
+            self._rotations.append(np.arctan2(*(north - self.centers[i])))
+
+    def _project(self, lats, lons):
+        """Returns the (..., 2) coordinates of points on the azimuthal equidistant plane centered on the origin."""
+        return project(self.origin, lats, lons)
+
+    def goal_distances(self, lats, lons, next_turnpoints):
+        """
+        Returns the goal distance of each position.
+
+        Arguments:
+            lats (~numpy.ndarray [float]) : Latitudes of the positions.
+            lons (~numpy.ndarray [float]) : Longitudes of the positions.
+            next_turnpoints (~numpy.ndarray [int]) : Index of the next cylinder to touch from each position, positions past the last cylinder are in goal.
+        """
+        goal_distances = np.zeros(len(lats))
+        positions = self._project(lats, lons)
+        for i in np.unique(next_turnpoints):
+            if i < len(self.costs):
+                mask = next_turnpoints == i
+                goal_distances[mask] = self._goal_distances(i, lats[mask], lons[mask], positions[mask])
+        return goal_distances
+
+    def _goal_distances(self, i, lats, lons, positions):
+        if self._splines[i] is None:
+            return distance_many(self.lats[i], self.lons[i], lats, lons) + self.costs[i][0]
+
+        def cost(headings):
+            # headings are (positions, candidates) in degrees
+            angles = np.radians(headings) + self._rotations[i]
+            x = self.centers[i, 0] + self.radii[i] * np.sin(angles) - positions[:, 0, None]
+            y = self.centers[i, 1] + self.radii[i] * np.cos(angles) - positions[:, 1, None]
+            return np.hypot(x, y) + self._splines[i](headings % 360)
+
+        # coarse grid, then golden section search between the neighbours of the best heading
+        step = 360 / FIELD_SEARCH_SAMPLES
+        grid = np.arange(FIELD_SEARCH_SAMPLES) * step
+        best = grid[np.argmin(cost(np.broadcast_to(grid, (len(lats), len(grid)))), axis=1)]
+        lo, hi = best - step, best + step
+        for _ in range(GOLDEN_ITERATIONS):
+            mid_lo, mid_hi = hi - GOLDEN * (hi - lo), lo + GOLDEN * (hi - lo)
+            lower = (cost(mid_lo[:, None]) < cost(mid_hi[:, None]))[:, 0]
+            hi = np.where(lower, mid_hi, hi)
+            lo = np.where(lower, lo, mid_lo)
+        headings = (lo + hi) / 2 % 360
+
+        touch_lats, touch_lons = destination_many(self.lats[i], self.lons[i], self.radii[i], headings)
+        return distance_many(touch_lats, touch_lons, lats, lons) + self._splines[i](headings)
@@ -22,6 +22,13 @@ class GeoPoint(BaseObject):
 
         self.goal_distance = None
 
+    @classmethod
+    def from_fix(cls, lat, lon, altitude, goal_distance=None):
+        """Builds the GeoPoint of a flight fix."""
+        point = cls(record={'lat': lat, 'lon': lon, 'gps_alt': altitude}, status='flying')
+        point.goal_distance = goal_distance
+        return point
+
     def close_enough(self, wpt):
         # TODO delete when proper task validation
         return abs(distance(self, wpt) - wpt.radius) < 10 + wpt.radius * TOLERANCE
@@ -1,5 +1,7 @@
 #include "geodesic.h"
+#include <math.h>
 #include <stdlib.h>
+#include <string.h>
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
@@ -15,62 +17,599 @@ typedef struct geopoint{
     double lon;
 } geopoint;
 
+/* a point of a local plane, in meters east and north of its origin */
+typedef struct vec{
+    double x;
+    double y;
+} vec;
+
+/* geodesy mode of a computation, with the latitude and the meridional and normal radii of curvature of the projection origin */
+typedef struct geodesy{
+    int mode;
+    double origin_lat;
+    double origin_m;
+    double origin_n;
+} geodesy;
+
+/* a read-only or writable array of doubles, of length 1 (broadcast) or n */
+typedef struct darray{
+    Py_buffer view;
+    double* data;
+    Py_ssize_t length;
+} darray;
+
+
+#define MEAN_RADIUS 6371008.8 /* IUGG mean earth radius */
+#define DEG (M_PI / 180)
+
+/* geodesy modes */
+enum { EXACT, HAVERSINE, PROJECTED };
+
+
+/* the ellipsoid never changes, it is initialized once when the module is imported */
+static struct geod_geodesic g;
+
+/*
+ * There is no global geodesy mode : each function is given the mode of its computation, so that threads computing
+ * in different modes without the GIL never interfere.
+ */
+
 
 /* PURE C FUNCTIONS */
 
+/* exact WGS84 geodesics */
 
-double c_distance(double lat1, double lon1, double lat2, double lon2){
+double exact_distance(double lat1, double lon1, double lat2, double lon2){
     double distance;
-    struct geod_geodesic g;
-    geod_init(&g, A, F);
     geod_inverse(&g, lat1, lon1, lat2, lon2, &distance, 0, 0);
     return distance;
 }
 
-geopoint c_destination(double lat, double lon, double distance, double heading){
+geopoint exact_destination(double lat, double lon, double distance, double heading){
     geopoint end_point;
-    struct geod_geodesic g;
-    geod_init(&g, A, F);
     geod_direct(&g, lat, lon, heading, distance, &end_point.lat, &end_point.lon, 0);
     return end_point;
 }
 
-double c_heading(double lat1, double lon1, double lat2, double lon2){
+double exact_heading(double lat1, double lon1, double lat2, double lon2){
     double heading;
-    struct geod_geodesic g;
-    geod_init(&g, A, F);
     geod_inverse(&g, lat1, lon1, lat2, lon2, 0, &heading, 0);
     return heading;
 }
 
+/* great circles on a sphere of mean earth radius */
+
+double haversine_distance(double lat1, double lon1, double lat2, double lon2){
+    double s_lat = sin((lat2 - lat1) * DEG / 2);
+    double s_lon = sin((lon2 - lon1) * DEG / 2);
+    double h = s_lat * s_lat + cos(lat1 * DEG) * cos(lat2 * DEG) * s_lon * s_lon;
+    return 2 * MEAN_RADIUS * asin(sqrt(h < 1 ? h : 1));
+}
+
+geopoint haversine_destination(double lat, double lon, double distance, double heading){
+    geopoint end_point;
+    double delta = distance / MEAN_RADIUS;
+    double lat1 = lat * DEG, theta = heading * DEG;
+    double lat2 = asin(sin(lat1) * cos(delta) + cos(lat1) * sin(delta) * cos(theta));
+    end_point.lat = lat2 / DEG;
+    end_point.lon = lon + atan2(sin(theta) * sin(delta) * cos(lat1), cos(delta) - sin(lat1) * sin(lat2)) / DEG;
+    return end_point;
+}
+
+double haversine_heading(double lat1, double lon1, double lat2, double lon2){
+    double d_lon = (lon2 - lon1) * DEG;
+    lat1 *= DEG;
+    lat2 *= DEG;
+    return atan2(sin(d_lon) * cos(lat2), cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(d_lon)) / DEG;
+}
+
+/*
+ * Equirectangular plane : latitude differences are scaled by the meridional radius of curvature at the origin latitude,
+ * longitude differences by the normal radius of curvature at the origin latitude times the cosine of the mid-latitude of each segment.
+ * This is not a single tangent plane : the scale of parallels follows each segment, which keeps the error low away from the origin.
+ */
+
+double wrap_longitude(double d_lon){
+    return d_lon > 180 ? d_lon - 360 : (d_lon < -180 ? d_lon + 360 : d_lon);
+}
+
+double projected_distance(const geodesy* geo, double lat1, double lon1, double lat2, double lon2){
+    double dy = (lat2 - lat1) * DEG * geo->origin_m;
+    double dx = wrap_longitude(lon2 - lon1) * DEG * geo->origin_n * cos((lat1 + lat2) / 2 * DEG);
+    return hypot(dx, dy);
+}
+
+geopoint projected_destination(const geodesy* geo, double lat, double lon, double distance, double heading){
+    geopoint end_point;
+    end_point.lat = lat + distance * cos(heading * DEG) / geo->origin_m / DEG;
+    end_point.lon = lon + distance * sin(heading * DEG) / (geo->origin_n * cos((lat + end_point.lat) / 2 * DEG)) / DEG;
+    return end_point;
+}
+
+double projected_heading(const geodesy* geo, double lat1, double lon1, double lat2, double lon2){
+    double dy = (lat2 - lat1) * geo->origin_m;
+    double dx = wrap_longitude(lon2 - lon1) * geo->origin_n * cos((lat1 + lat2) / 2 * DEG);
+    return atan2(dx, dy) / DEG;
+}
+
+/* dispatch on the geodesy mode of the computation */
+
+double c_distance(const geodesy* geo, double lat1, double lon1, double lat2, double lon2){
+    switch(geo->mode){
+        case HAVERSINE: return haversine_distance(lat1, lon1, lat2, lon2);
+        case PROJECTED: return projected_distance(geo, lat1, lon1, lat2, lon2);
+        default: return exact_distance(lat1, lon1, lat2, lon2);
+    }
+}
+
+geopoint c_destination(const geodesy* geo, double lat, double lon, double distance, double heading){
+    switch(geo->mode){
+        case HAVERSINE: return haversine_destination(lat, lon, distance, heading);
+        case PROJECTED: return projected_destination(geo, lat, lon, distance, heading);
+        default: return exact_destination(lat, lon, distance, heading);
+    }
+}
+
+double c_heading(const geodesy* geo, double lat1, double lon1, double lat2, double lon2){
+    switch(geo->mode){
+        case HAVERSINE: return haversine_heading(lat1, lon1, lat2, lon2);
+        case PROJECTED: return projected_heading(geo, lat1, lon1, lat2, lon2);
+        default: return exact_heading(lat1, lon1, lat2, lon2);
+    }
+}
+
+/* length swept per radian of heading by a point at distance radius of a center */
+double c_reduced_length(const geodesy* geo, double lat, double lon, double radius, double heading){
+    double m12;
+    switch(geo->mode){
+        case HAVERSINE: return MEAN_RADIUS * sin(radius / MEAN_RADIUS);
+        case PROJECTED: return radius;
+        default:
+            geod_gendirect(&g, lat, lon, heading, 0, radius, 0, 0, 0, 0, &m12, 0, 0, 0);
+            return m12;
+    }
+}
+
+
+/* SHORTEST ROUTE THROUGH CYLINDERS */
+
+#define ROUTE_PRECISION 1e-3 /* meters */
+#define ROUTE_MAX_SWEEPS 1000
+
+static vec sub(vec a, vec b){ return (vec){ a.x - b.x, a.y - b.y }; }
+static double dot(vec a, vec b){ return a.x * b.x + a.y * b.y; }
+static double norm(vec a){ return hypot(a.x, a.y); }
+
+static vec unit(vec a){
+    double n = norm(a);
+    return n > 0 ? (vec){ a.x / n, a.y / n } : a;
+}
+
+/* point of the circle (c, r) at heading theta, in radians */
+static vec on_circle(vec c, double r, double theta){
+    return (vec){ c.x + r * sin(theta), c.y + r * cos(theta) };
+}
+
+/* derivative of |a - p| + |b - p| with respect to the heading of p on the circle (c, r) */
+static double slope(vec a, vec b, vec c, double r, double theta){
+    vec p = on_circle(c, r, theta);
+    vec tangent = { cos(theta), -sin(theta) };
+    vec u = unit(sub(a, p)), v = unit(sub(b, p));
+    return -(u.x + v.x) * tangent.x - (u.y + v.y) * tangent.y;
+}
+
+/* point of the circle (c, r) minimizing |a - p| + |b - p| */
+static vec touch(vec a, vec b, vec c, double r){
+    /* if the segment crosses the circle, the crossing point is on the straight line */
+    vec d = sub(b, a), f = sub(a, c);
+    double dd = dot(d, d), fd = dot(f, d), ff = dot(f, f);
+    double disc = fd * fd - dd * (ff - r * r);
+    if(dd > 0 && disc >= 0){
+        double t_in = (-fd - sqrt(disc)) / dd, t_out = (-fd + sqrt(disc)) / dd;
+        double t = ff > r * r ? t_in : t_out;
+        if(t >= 0 && t <= 1)
+            return (vec){ a.x + t * d.x, a.y + t * d.y };
+    }
+
+    /* otherwise, the minimum is on the arc between a and b, where the slope changes sign */
+    double lo = atan2(f.x, f.y);
+    double delta = remainder(atan2(b.x - c.x, b.y - c.y) - lo, 2 * M_PI);
+    double hi = lo + delta;
+    double slope_lo = slope(a, b, c, r, lo), slope_hi = slope(a, b, c, r, hi);
+    if(slope_lo * delta >= 0 || slope_hi * delta <= 0){
+        vec p_lo = on_circle(c, r, lo), p_hi = on_circle(c, r, hi);
+        return norm(sub(a, p_lo)) + norm(sub(b, p_lo)) <= norm(sub(a, p_hi)) + norm(sub(b, p_hi)) ? p_lo : p_hi;
+    }
+
+    /* regula falsi with the Illinois modification, the bracket shrinks on both sides */
+    double theta = lo;
+    int side = 0;
+    for(int i = 0; i < 100; i++){
+        double previous = theta;
+        theta = (lo * slope_hi - hi * slope_lo) / (slope_hi - slope_lo);
+        if(fabs(theta - previous) * r < ROUTE_PRECISION / 10)
+            break;
+
+        double slope_theta = slope(a, b, c, r, theta);
+        if((slope_theta < 0) == (slope_lo < 0)){
+            lo = theta;
+            slope_lo = slope_theta;
+            if(side == -1)
+                slope_hi /= 2;
+            side = -1;
+        }
+        else{
+            hi = theta;
+            slope_hi = slope_theta;
+            if(side == 1)
+                slope_lo /= 2;
+            side = 1;
+        }
+    }
+    return on_circle(c, r, theta);
+}
+
+/*
+ * Writes into headings the headings from the center of each cylinder to the point where the shortest route from (lat, lon) touches it.
+ * The route is solved in an azimuthal equidistant plane centered on (lat, lon), by moving each point in turn to the point of
+ * its cylinder minimizing the length of its two legs, until a sweep over all points shortens the route by less than ROUTE_PRECISION.
+ * Points may still slide along directions in which the length is flat, so the length converges much faster than the points.
+ * If warm is set, headings holds the headings of a previous solution, which are used as a starting point.
+ * Returns -1 if memory could not be allocated.
+ */
+int c_route(const geodesy* geo, double lat, double lon, const double* lats, const double* lons, const double* radii, double* headings, Py_ssize_t n, int warm){
+    vec* centers = malloc((n + 1) * sizeof(vec));
+    vec* points = malloc((n + 1) * sizeof(vec));
+    vec start = { 0, 0 };
+    if(centers == NULL || points == NULL){
+        free(centers);
+        free(points);
+        return -1;
+    }
+
+    for(Py_ssize_t i = 0; i < n; i++){
+        double d = c_distance(geo, lat, lon, lats[i], lons[i]);
+        double h = c_heading(geo, lat, lon, lats[i], lons[i]) * DEG;
+        centers[i] = (vec){ d * sin(h), d * cos(h) };
+        points[i] = warm ? on_circle(centers[i], radii[i], headings[i] * DEG) : centers[i];
+    }
+
+    double length = INFINITY;
+    for(int sweep = 0; sweep < ROUTE_MAX_SWEEPS; sweep++){
+        double previous_length = length;
+        length = 0;
+        for(Py_ssize_t i = 0; i < n; i++){
+            vec previous = i == 0 ? start : points[i - 1];
+            vec point;
+            if(radii[i] == 0)
+                point = centers[i];
+            else if(i == n - 1)
+                point = norm(sub(previous, centers[i])) > 0 ? on_circle(centers[i], radii[i], atan2(previous.x - centers[i].x, previous.y - centers[i].y)) : points[i];
+            else
+                point = touch(previous, points[i + 1], centers[i], radii[i]);
+            length += norm(sub(point, previous));
+            points[i] = point;
+        }
+        if(previous_length - length < ROUTE_PRECISION)
+            break;
+    }
+
+    /* headings are measured on the earth from the center of each cylinder to its point */
+    for(Py_ssize_t i = 0; i < n; i++){
+        geopoint p = c_destination(geo, lat, lon, norm(points[i]), atan2(points[i].x, points[i].y) / DEG);
+        headings[i] = radii[i] == 0 ? 0 : c_heading(geo, lats[i], lons[i], p.lat, p.lon);
+    }
+
+    free(centers);
+    free(points);
+    return 0;
+}
+
+
+/* ARGUMENT HELPERS */
+
+/* sets geo from the optional mode and origin latitude arguments of a function, which default to exact geodesics */
+static int get_geodesy(int mode, double origin_lat, geodesy* geo){
+    if(mode < EXACT || mode > PROJECTED){
+        PyErr_SetString(PyExc_ValueError, "unknown geodesy mode");
+        return -1;
+    }
+
+    double e2 = F * (2 - F);
+    double w = 1 - e2 * sin(origin_lat * DEG) * sin(origin_lat * DEG);
+    geo->mode = mode;
+    geo->origin_lat = origin_lat;
+    geo->origin_m = A * (1 - e2) / (w * sqrt(w));
+    geo->origin_n = A / sqrt(w);
+    return 0;
+}
+
+static int get_darray(PyObject* obj, darray* array, int writable){
+    int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+    if(PyObject_GetBuffer(obj, &array->view, flags) < 0)
+        return -1;
+
+    if(array->view.itemsize != sizeof(double) || array->view.format == NULL || strcmp(array->view.format, "d") != 0){
+        PyErr_SetString(PyExc_TypeError, "arrays must be contiguous float64 buffers");
+        PyBuffer_Release(&array->view);
+        return -1;
+    }
+
+    array->data = (double*) array->view.buf;
+    array->length = array->view.len / sizeof(double);
+    return 0;
+}
+
+static void release_darrays(darray* arrays, int n){
+    for(int i = 0; i < n; i++)
+        PyBuffer_Release(&arrays[i].view);
+}
+
+/* acquires n_in input buffers of length 1 or n and n_out output buffers of length n */
+static int get_darrays(PyObject** objects, darray* arrays, int n_in, int n_out, Py_ssize_t* n){
+    for(int i = 0; i < n_in + n_out; i++){
+        if(get_darray(objects[i], &arrays[i], i >= n_in) < 0){
+            release_darrays(arrays, i);
+            return -1;
+        }
+    }
+
+    *n = arrays[n_in].length;
+    for(int i = 0; i < n_in + n_out; i++){
+        if(arrays[i].length != *n && !(i < n_in && arrays[i].length == 1)){
+            PyErr_SetString(PyExc_ValueError, "input arrays must be of length 1 or of the output length");
+            release_darrays(arrays, n_in + n_out);
+            return -1;
+        }
+    }
+    return 0;
+}
+
+#define AT(array, i) ((array).data[(array).length == 1 ? 0 : (i)])
+
+
 /* PYTHON FUNCTION CALL INTERFACE */
 
 static PyObject* distance(PyObject* self, PyObject* args){
-	double lat1, lon1, lat2, lon2;
+	double lat1, lon1, lat2, lon2, origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
 
-    if(!PyArg_ParseTuple(args, "dddd", &lat1, &lon1, &lat2, &lon2))
+    if(!PyArg_ParseTuple(args, "dddd|id", &lat1, &lon1, &lat2, &lon2, &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
         return NULL;
 
-    return Py_BuildValue("d", c_distance(lat1, lon1, lat2, lon2));
+    return Py_BuildValue("d", c_distance(&geo, lat1, lon1, lat2, lon2));
 }
 
 static PyObject* destination(PyObject* self, PyObject* args){
-	double lat1, lon1, distance, heading;
+	double lat1, lon1, distance, heading, origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
 
-    if(!PyArg_ParseTuple(args, "dddd", &lat1, &lon1, &distance, &heading))
+    if(!PyArg_ParseTuple(args, "dddd|id", &lat1, &lon1, &distance, &heading, &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
         return NULL;
 
-    geopoint offset = c_destination(lat1, lon1, distance, heading);
+    geopoint offset = c_destination(&geo, lat1, lon1, distance, heading);
     return Py_BuildValue("(dd)", offset.lat, offset.lon);
 }
 
 static PyObject* heading(PyObject* self, PyObject* args){
-	double lat1, lon1, lat2, lon2;
+	double lat1, lon1, lat2, lon2, origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
+
+    if(!PyArg_ParseTuple(args, "dddd|id", &lat1, &lon1, &lat2, &lon2, &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+
+    return Py_BuildValue("d", c_heading(&geo, lat1, lon1, lat2, lon2));
+}
+
+static PyObject* distance_many(PyObject* self, PyObject* args){
+    PyObject* objects[5];
+    double origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
+    darray a[5];
+    Py_ssize_t n;
+
+    if(!PyArg_ParseTuple(args, "OOOOO|id", &objects[0], &objects[1], &objects[2], &objects[3], &objects[4], &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+    if(get_darrays(objects, a, 4, 1, &n) < 0)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    for(Py_ssize_t i = 0; i < n; i++)
+        a[4].data[i] = c_distance(&geo, AT(a[0], i), AT(a[1], i), AT(a[2], i), AT(a[3], i));
+    Py_END_ALLOW_THREADS
+
+    release_darrays(a, 5);
+    Py_RETURN_NONE;
+}
+
+static PyObject* heading_many(PyObject* self, PyObject* args){
+    PyObject* objects[5];
+    double origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
+    darray a[5];
+    Py_ssize_t n;
+
+    if(!PyArg_ParseTuple(args, "OOOOO|id", &objects[0], &objects[1], &objects[2], &objects[3], &objects[4], &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+    if(get_darrays(objects, a, 4, 1, &n) < 0)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    for(Py_ssize_t i = 0; i < n; i++)
+        a[4].data[i] = c_heading(&geo, AT(a[0], i), AT(a[1], i), AT(a[2], i), AT(a[3], i));
+    Py_END_ALLOW_THREADS
+
+    release_darrays(a, 5);
+    Py_RETURN_NONE;
+}
 
-    if(!PyArg_ParseTuple(args, "dddd", &lat1, &lon1, &lat2, &lon2))
+static PyObject* destination_many(PyObject* self, PyObject* args){
+    PyObject* objects[6];
+    double origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
+    darray a[6];
+    Py_ssize_t n;
+
+    if(!PyArg_ParseTuple(args, "OOOOOO|id", &objects[0], &objects[1], &objects[2], &objects[3], &objects[4], &objects[5], &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+    if(get_darrays(objects, a, 4, 2, &n) < 0)
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    for(Py_ssize_t i = 0; i < n; i++){
+        geopoint end_point = c_destination(&geo, AT(a[0], i), AT(a[1], i), AT(a[2], i), AT(a[3], i));
+        a[4].data[i] = end_point.lat;
+        a[5].data[i] = end_point.lon;
+    }
+    Py_END_ALLOW_THREADS
+
+    release_darrays(a, 6);
+    Py_RETURN_NONE;
+}
+
+static PyObject* distance_pairwise(PyObject* self, PyObject* args){
+    PyObject* objects[5];
+    double origin_lat = 0;
+    int mode = EXACT;
+    geodesy geo;
+    darray a[5];
+
+    if(!PyArg_ParseTuple(args, "OOOOO|id", &objects[0], &objects[1], &objects[2], &objects[3], &objects[4], &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+    for(int i = 0; i < 5; i++){
+        if(get_darray(objects[i], &a[i], i == 4) < 0){
+            release_darrays(a, i);
+            return NULL;
+        }
+    }
+
+    Py_ssize_t n = a[0].length, m = a[2].length;
+    if(a[1].length != n || a[3].length != m || a[4].length != n * m){
+        PyErr_SetString(PyExc_ValueError, "output array must be of length len(lat1) * len(lat2)");
+        release_darrays(a, 5);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for(Py_ssize_t i = 0; i < n; i++)
+        for(Py_ssize_t j = 0; j < m; j++)
+            a[4].data[i * m + j] = c_distance(&geo, a[0].data[i], a[1].data[i], a[2].data[j], a[3].data[j]);
+    Py_END_ALLOW_THREADS
+
+    release_darrays(a, 5);
+    Py_RETURN_NONE;
+}
+
+/*
+ * Length of the route starting at (lat, lon) through the points at the given headings and radii of each turnpoint.
+ * If grad is given, the derivatives of the length with respect to each heading are written into it.
+ * Moving a point along its cylinder changes the length of an adjacent leg by the cosine of the angle between
+ * the direction of the move and the leg, the move itself being the reduced length of the radius per radian.
+ */
+static PyObject* tasklen(PyObject* self, PyObject* args){
+    double lat, lon, origin_lat = 0;
+    PyObject* objects[5] = { NULL, NULL, NULL, NULL, Py_None };
+    darray a[5];
+    int n_arrays, mode = EXACT;
+    geodesy geo;
+
+    if(!PyArg_ParseTuple(args, "ddOOOO|Oid", &lat, &lon, &objects[0], &objects[1], &objects[2], &objects[3], &objects[4], &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
         return NULL;
 
-    return Py_BuildValue("d", c_heading(lat1, lon1, lat2, lon2));
+    n_arrays = objects[4] == Py_None ? 4 : 5;
+    for(int i = 0; i < n_arrays; i++){
+        if(get_darray(objects[i], &a[i], i == 4) < 0){
+            release_darrays(a, i);
+            return NULL;
+        }
+    }
+
+    Py_ssize_t n = a[0].length;
+    for(int i = 1; i < n_arrays; i++){
+        if(a[i].length != n){
+            PyErr_SetString(PyExc_ValueError, "arrays must have the same length");
+            release_darrays(a, n_arrays);
+            return NULL;
+        }
+    }
+
+    geopoint* points = malloc((n + 1) * sizeof(geopoint));
+    if(points == NULL){
+        release_darrays(a, n_arrays);
+        return PyErr_NoMemory();
+    }
+
+    double length = 0;
+    Py_BEGIN_ALLOW_THREADS
+    points[0].lat = lat;
+    points[0].lon = lon;
+    for(Py_ssize_t i = 0; i < n; i++){
+        points[i + 1] = c_destination(&geo, a[0].data[i], a[1].data[i], a[2].data[i], a[3].data[i]);
+        length += c_distance(&geo, points[i + 1].lat, points[i + 1].lon, points[i].lat, points[i].lon);
+    }
+
+    if(n_arrays == 5){
+        for(Py_ssize_t i = 0; i < n; i++){
+            geopoint p = points[i + 1];
+            a[4].data[i] = 0;
+            if(a[2].data[i] == 0)
+                continue;
+
+            /* direction in which the point moves when its heading increases */
+            double tangent = c_heading(&geo, p.lat, p.lon, a[0].data[i], a[1].data[i]) - 90;
+            double derivative = 0;
+            for(Py_ssize_t j = i; j <= i + 2 && j <= n; j += 2){
+                if(points[j].lat != p.lat || points[j].lon != p.lon)
+                    derivative -= cos((tangent - c_heading(&geo, p.lat, p.lon, points[j].lat, points[j].lon)) * DEG);
+            }
+            a[4].data[i] = derivative * c_reduced_length(&geo, a[0].data[i], a[1].data[i], a[2].data[i], a[3].data[i]) * DEG;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    free(points);
+    release_darrays(a, n_arrays);
+    return Py_BuildValue("d", length);
+}
+
+static PyObject* route(PyObject* self, PyObject* args){
+    double lat, lon, origin_lat = 0;
+    int warm, mode = EXACT;
+    PyObject* objects[4];
+    darray a[4];
+    geodesy geo;
+
+    if(!PyArg_ParseTuple(args, "ddOOOOp|id", &lat, &lon, &objects[0], &objects[1], &objects[2], &objects[3], &warm, &mode, &origin_lat) || get_geodesy(mode, origin_lat, &geo) < 0)
+        return NULL;
+    for(int i = 0; i < 4; i++){
+        if(get_darray(objects[i], &a[i], i == 3) < 0){
+            release_darrays(a, i);
+            return NULL;
+        }
+    }
+
+    Py_ssize_t n = a[0].length;
+    if(a[1].length != n || a[2].length != n || a[3].length != n){
+        PyErr_SetString(PyExc_ValueError, "arrays must have the same length");
+        release_darrays(a, 4);
+        return NULL;
+    }
+
+    int status;
+    Py_BEGIN_ALLOW_THREADS
+    status = c_route(&geo, lat, lon, a[0].data, a[1].data, a[2].data, a[3].data, n, warm);
+    Py_END_ALLOW_THREADS
+
+    release_darrays(a, 4);
+    if(status < 0)
+        return PyErr_NoMemory();
+    Py_RETURN_NONE;
 }
 
 
@@ -80,6 +619,12 @@ static PyMethodDef methods[] = {
     { "distance", distance, METH_VARARGS, "Returns the distance between two points" },
     { "destination", destination, METH_VARARGS, "Returns the arrival point given an origin point, a distance and a heading" },
     { "heading", heading, METH_VARARGS, "Returns the heading between two points" },
+    { "distance_many", distance_many, METH_VARARGS, "Writes the distances between two arrays of points (lat1, lon1, lat2, lon2) into out" },
+    { "heading_many", heading_many, METH_VARARGS, "Writes the headings between two arrays of points (lat1, lon1, lat2, lon2) into out" },
+    { "destination_many", destination_many, METH_VARARGS, "Writes the arrival points of arrays of (lat, lon, distance, heading) into out_lat and out_lon" },
+    { "distance_pairwise", distance_pairwise, METH_VARARGS, "Writes the distances between every point of (lat1, lon1) and every point of (lat2, lon2) into out, row-major" },
+    { "tasklen", tasklen, METH_VARARGS, "Returns the length of the route from (lat, lon) through arrays of (lats, lons, radii, headings), and writes its gradient into grad if given" },
+    { "route", route, METH_VARARGS, "Writes into headings the headings of the shortest route from (lat, lon) through arrays of (lats, lons, radii), starting from the given headings if warm is true" },
     { NULL, NULL, 0, NULL }
 };
 
@@ -92,5 +637,6 @@ static struct PyModuleDef module = {
 };
 
 PyMODINIT_FUNC PyInit_geolib(void){
+    geod_init(&g, A, F);
     return PyModule_Create(&module);
-}
\ No newline at end of file
+}
@@ -1,40 +1,82 @@
 """
 This module provides optimizations for various objective methods.
-    * Task distance optimization
+    * Task distance optimization, with one of the following engines
+        * route solves the shortest route through the turnpoint cylinders directly, in a local plane
+        * bfgs minimizes the task length with respect to the headings of the route points with SciPy
+        * field validates flights with a :class:`~pygclib.geography.field.GoalDistanceField`, single optimizations use the route engine
     * XC flight distance maximization (hopefully soon)
 """
 
 import numpy as np
-from pygclib.constants import OPTIMIZER_PRECISION
-from pygclib.geography import destination, distance
+from pygclib.constants import OPTIMIZER_ENGINE, OPTIMIZER_ENGINES, OPTIMIZER_PRECISION
+from pygclib.geography import destination_many, distance, distance_many, route_headings, route_length
 from pygclib.geography.geo import Opti, Turnpoint
 from scipy.optimize import minimize
 
 
-def optimize(position, waypoints, prev_opti=None):
-    x0 = np.zeros(len(waypoints)) if prev_opti is None else prev_opti
-    result = minimize(tasklen, x0, args=(position, waypoints), tol=OPTIMIZER_PRECISION)
+def optimize(position, waypoints, prev_opti=None, engine=OPTIMIZER_ENGINE):
+    """
+    Returns the shortest route from position through the cylinders of waypoints.
 
-    distances = []
-    fast_waypoints = [Turnpoint(position.lat, position.lon)]
+    Arguments:
+        position (GeoPoint) : Start of the route.
+        waypoints (list [Turnpoint]) : Cylinders the route must touch, in order.
+        prev_opti (~numpy.ndarray [float]) : Headings of a previous solution, used as a starting point.
+        engine (str) : One of OPTIMIZER_ENGINES.
 
-    for theta, wp in zip(result.x, waypoints):
-        proj = destination(wp, wp.radius, theta)
-        distances.append(distance(proj, fast_waypoints[-1]))
-        fast_waypoints.append(Turnpoint(proj[0], proj[1]))
+    Raises:
+        ValueError: If engine is unknown.
+    """
+    lats, lons, radii = _waypoint_arrays(waypoints)
 
-    return Opti(sum(distances), distances, fast_waypoints, result.x)
+    if engine in ('route', 'field'):
+        headings = np.zeros(len(waypoints))
+        # turnpoints are validated from the first one, so the last headings of a previous solution are still relevant
+        warm = prev_opti is not None and len(prev_opti) >= len(waypoints)
+        if warm:
+            headings[:] = prev_opti[len(prev_opti) - len(waypoints):]
+        route_headings(position.lat, position.lon, lats, lons, radii, headings, warm)
+    elif engine == 'bfgs':
+        x0 = np.zeros(len(waypoints)) if prev_opti is None else prev_opti
+        headings = minimize(_tasklen_gradient, x0, args=(position.lat, position.lon, lats, lons, radii), jac=True, tol=OPTIMIZER_PRECISION).x
+    else:
+        raise ValueError(f'Optimizer engine must be in {OPTIMIZER_ENGINES} but is {engine}')
+
+    proj_lats, proj_lons = destination_many(lats, lons, radii, headings[:len(waypoints)])
+    distances = list(_legs(position.lat, position.lon, proj_lats, proj_lons))
+    fast_waypoints = [Turnpoint(position.lat, position.lon)] + [Turnpoint(lat, lon) for lat, lon in zip(proj_lats, proj_lons)]
+
+    return Opti(sum(distances), distances, fast_waypoints, headings)
 
 
 def tasklen(angles, position, waypoints):
-    dist = 0
+    return _tasklen(angles, position.lat, position.lon, *_waypoint_arrays(waypoints))
+
+
+def _tasklen(angles, lat, lon, lats, lons, radii):
+    # warm start vectors may be longer than the remaining waypoints, extra angles are ignored
+    return route_length(lat, lon, lats, lons, radii, np.ascontiguousarray(angles[:len(lats)], dtype=np.float64))
+
+
+def _tasklen_gradient(angles, lat, lon, lats, lons, radii):
+    """Returns the task length and its gradient with respect to the angles, computed analytically by the C extension."""
+    gradient = np.zeros(len(angles))
+    length = route_length(lat, lon, lats, lons, radii, np.ascontiguousarray(angles[:len(lats)], dtype=np.float64), gradient[:len(lats)])
+    return length, gradient
+
+
+def _legs(lat, lon, proj_lats, proj_lons):
+    """Returns the lengths of the legs from (lat, lon) through each projected point."""
+    start_lats = np.concatenate(([lat], proj_lats[:-1]))
+    start_lons = np.concatenate(([lon], proj_lons[:-1]))
+    return distance_many(proj_lats, proj_lons, start_lats, start_lons)
 
-    for theta, wp in zip(angles, waypoints):
-        proj = destination(wp, wp.radius, theta)
-        dist += distance(proj, position)
-        position = proj
 
-    return dist
+def _waypoint_arrays(waypoints):
+    lats = np.array([wp.lat for wp in waypoints], dtype=np.float64)
+    lons = np.array([wp.lon for wp in waypoints], dtype=np.float64)
+    radii = np.array([wp.radius for wp in waypoints], dtype=np.float64)
+    return lats, lons, radii
 
 
 def maximize_distance(flight):
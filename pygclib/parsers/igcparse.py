@@ -0,0 +1,171 @@
+"""
+This module reads IGC files into column arrays.
+
+The fast path decodes the fixed-width part of every B record at once from the raw bytes of the file.
+Files which do not fit the fast path (missing or malformed B records, unusual line endings) are read with aerofiles instead.
+Both readers return the same header dictionary and fix columns.
+"""
+
+import io
+import logging
+
+import numpy as np
+from aerofiles import igc
+from pygclib.constants import (IGC_ALTITUDE, IGC_HEADER, IGC_LAT, IGC_LON, IGC_PILOT_NAME, IGC_PRESSURE_ALTITUDE, IGC_RECORDS, IGC_TIME, IGC_TZ_OFFSET)
+from pygclib.time.timeop import to_seconds
+
+# bump when the parsed output changes, to invalidate cached flights
+PARSER_VERSION = 1
+
+IGC_ENCODINGS = ['utf-8', 'iso-8859-1']
+
+# fixed-width part of a B record : B HHMMSS DDMMmmmN DDDMMmmmE V PPPPP GGGGG
+B_RECORD_LENGTH = 35
+B_TIME = slice(1, 7)
+B_LAT_DEGREES = slice(7, 9)
+B_LAT_MINUTES = slice(9, 14)
+B_LAT_HEMISPHERE = 14
+B_LON_DEGREES = slice(15, 18)
+B_LON_MINUTES = slice(18, 23)
+B_LON_HEMISPHERE = 23
+B_PRESSURE_ALTITUDE = slice(25, 30)
+B_GPS_ALTITUDE = slice(30, 35)
+
+
+def max_fixes(size):
+    """Returns an upper bound of the number of fixes of an IGC file of size bytes, each B record taking at least B_RECORD_LENGTH bytes and a line break."""
+    return (size + 1) // (B_RECORD_LENGTH + 1)
+
+
+def read(content):
+    """Reads an IGC file.
+
+    Arguments:
+        content (bytes) : Raw content of the IGC file.
+
+    Returns:
+        dict, tuple : The header and the (seconds, lat, lon, altitude, pressure_altitude) fix columns.
+
+    Raises:
+        ValueError: If the file does not contain any fix.
+    """
+    parsed = read_fast(content)
+    if parsed is None:
+        logging.debug('igc file does not fit the fast parser, falling back to aerofiles')
+        parsed = read_aerofiles(content)
+    return parsed
+
+
+def read_fast(content):
+    """Reads an IGC file by decoding all its B records at once, or returns None if the file is not standard enough."""
+    buffer = np.frombuffer(content, dtype=np.uint8)
+    newlines = np.flatnonzero(buffer == ord('\n'))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(buffer)]))
+    non_empty = starts < ends
+    starts, ends = starts[non_empty], ends[non_empty]
+    ends = ends - (buffer[ends - 1] == ord('\r'))
+
+    is_fix = buffer[starts] == ord('B')
+    fix_starts, fix_ends = starts[is_fix], ends[is_fix]
+    if len(fix_starts) == 0 or np.any(fix_ends - fix_starts < B_RECORD_LENGTH):
+        return None
+
+    records = buffer[fix_starts[:, None] + np.arange(B_RECORD_LENGTH)]
+    columns = _decode_fixes(records)
+    if columns is None:
+        return None
+
+    encoding = _encoding(content)
+    header = {}
+    for start, end in zip(starts[buffer[starts] == ord('H')], ends[buffer[starts] == ord('H')]):
+        header.update(_decode_header(content[start:end].decode(encoding)))
+
+    return header, columns
+
+
+def read_aerofiles(content):
+    """Reads an IGC file with the aerofiles reader."""
+    text = content.decode(_encoding(content))
+    records = igc.Reader().read(io.StringIO(text, newline=None))
+
+    fixes = [point for subrecord in records[IGC_RECORDS] for point in subrecord]
+    if not fixes:
+        raise ValueError('File is empty or is invalid igc')
+
+    columns = (
+        np.fromiter((to_seconds(fix[IGC_TIME]) for fix in fixes), dtype=np.int32, count=len(fixes)),
+        np.fromiter((fix[IGC_LAT] for fix in fixes), dtype=np.float64, count=len(fixes)),
+        np.fromiter((fix[IGC_LON] for fix in fixes), dtype=np.float64, count=len(fixes)),
+        np.fromiter((fix[IGC_ALTITUDE] for fix in fixes), dtype=np.int32, count=len(fixes)),
+        np.fromiter((fix[IGC_PRESSURE_ALTITUDE] for fix in fixes), dtype=np.int32, count=len(fixes)),
+    )
+    return records[IGC_HEADER][1], columns
+
+
+def _encoding(content):
+    for encoding in IGC_ENCODINGS[:-1]:
+        try:
+            content.decode(encoding)
+            return encoding
+        except UnicodeDecodeError:
+            logging.debug(f'igc file is not {encoding} encoded, trying something else')
+    return IGC_ENCODINGS[-1]
+
+
+def _decode_fixes(records):
+    digits = records.astype(np.int32) - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+
+    if not (np.all(is_digit[:, 1:B_LAT_HEMISPHERE]) and np.all(is_digit[:, B_LON_DEGREES.start:B_LON_HEMISPHERE])):
+        return None
+    if not (np.all(np.isin(records[:, B_LAT_HEMISPHERE], [ord('N'), ord('S')])) and np.all(np.isin(records[:, B_LON_HEMISPHERE], [ord('E'), ord('W')]))):
+        return None
+
+    time = _number(digits[:, B_TIME])
+    hours, minutes, seconds = time // 10000, time // 100 % 100, time % 100
+    if np.any(hours > 23) or np.any(minutes > 59) or np.any(seconds > 59):
+        return None
+
+    lat = _number(digits[:, B_LAT_DEGREES]) + _number(digits[:, B_LAT_MINUTES]) / 1000 / 60.
+    lon = _number(digits[:, B_LON_DEGREES]) + _number(digits[:, B_LON_MINUTES]) / 1000 / 60.
+    if np.any(lat > 90) or np.any(lon > 180):
+        return None
+    lat[records[:, B_LAT_HEMISPHERE] == ord('S')] *= -1
+    lon[records[:, B_LON_HEMISPHERE] == ord('W')] *= -1
+
+    pressure_altitude = _altitude(records[:, B_PRESSURE_ALTITUDE], digits[:, B_PRESSURE_ALTITUDE], is_digit[:, B_PRESSURE_ALTITUDE])
+    gps_altitude = _altitude(records[:, B_GPS_ALTITUDE], digits[:, B_GPS_ALTITUDE], is_digit[:, B_GPS_ALTITUDE])
+    if pressure_altitude is None or gps_altitude is None:
+        return None
+
+    return (3600 * hours + 60 * minutes + seconds).astype(np.int32), lat, lon, gps_altitude, pressure_altitude
+
+
+def _number(digits):
+    return digits @ 10**np.arange(digits.shape[1] - 1, -1, -1, dtype=np.int32)
+
+
+def _altitude(chars, digits, is_digit):
+    negative = chars[:, 0] == ord('-')
+    if not np.all(is_digit[:, 1:]) or not np.all(is_digit[:, 0] | negative):
+        return None
+    digits = digits.copy()
+    digits[negative, 0] = 0
+    return np.where(negative, -1, 1).astype(np.int32) * _number(digits)
+
+
+def _decode_header(line):
+    # same value extraction as aerofiles, restricted to the fields used by Flight
+    code = line[2:5]
+    colon = line.find(':', 5)
+    value = line[colon + 1:].strip() if colon >= 0 else line[5:].strip()
+
+    if code == 'PLT':
+        return {IGC_PILOT_NAME: value or None}
+    if code in ('TZN', 'TZO'):
+        try:
+            return {IGC_TZ_OFFSET: float(value)}
+        except ValueError:
+            return {}
+    return {}
@@ -0,0 +1,68 @@
+import json
+
+from pygclib.serialization.json_encoder import ComplexEncoder
+
+
+class Stream():
+    """
+    JSON object whose members are generated while it is written, so that it never has to fit in memory.
+
+    Arguments:
+        items (iterable [tuple [str, object]]) : The members of the object, as (key, value) pairs. Values may be Streams themselves.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+
+class JSONWriter():
+    """
+    Writes JSON documents to a text file, one member of each :class:`Stream` at a time.
+
+    Values which are not Streams are encoded in one call to a :class:`ComplexEncoder`, which uses the C encoder in compact mode.
+    The output is the same as json.dump with the same indentation, Streams being written as objects.
+
+    Arguments:
+        f (file) : The text file to which documents are written.
+        indent (int) : Number of spaces of each indentation level, or None to write compact JSON without whitespace.
+    """
+
+    def __init__(self, f, indent=None):
+        self.f = f
+        self.indent = indent
+        separators = (',', ':') if indent is None else (',', ': ')
+        self._key_separator = separators[1]
+        self._encoder = ComplexEncoder(ensure_ascii=False, indent=indent, separators=separators)
+
+    def write(self, obj):
+        self._write(obj, 0)
+
+    def _write(self, obj, level):
+        if isinstance(obj, dict) and any(isinstance(value, Stream) for value in obj.values()):
+            self._write_object(obj.items(), level)
+        elif isinstance(obj, Stream):
+            self._write_object(obj.items, level)
+        else:
+            self.f.write(self._encode(obj, level))
+
+    def _write_object(self, items, level):
+        if self.indent is None:
+            opening, separator, closing = '{', ',', '}'
+        else:
+            margin = '\n' + ' ' * (self.indent * (level + 1))
+            opening, separator, closing = '{' + margin, ',' + margin, '\n' + ' ' * (self.indent * level) + '}'
+
+        empty = True
+        for key, value in items:
+            self.f.write(opening if empty else separator)
+            empty = False
+            self.f.write(json.dumps(str(key), ensure_ascii=False) + self._key_separator)
+            self._write(value, level + 1)
+        self.f.write('{}' if empty else closing)
+
+    def _encode(self, obj, level):
+        encoded = self._encoder.encode(obj)
+        if self.indent is not None and level > 0:
+            # the encoder indents from the first level, nested values are shifted to their own level
+            encoded = encoded.replace('\n', '\n' + ' ' * (self.indent * level))
+        return encoded
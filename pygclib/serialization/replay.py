@@ -0,0 +1,142 @@
+"""
+Binary replay format, storing the fixes of each pilot as delta encoded integer columns in a NumPy .npz archive.
+
+The archive holds a JSON header with the task, the ranking and the layout of the columns, and one array per column in which
+the flights of the pilots are concatenated. Each column is quantized to integers with the scale of the header, then stored as
+the difference with the previous fix of the same pilot, in the smallest integer type holding every difference.
+The first value of each pilot is stored in a separate array of 64 bits integers, its difference being 0.
+"""
+
+import json
+from datetime import time
+
+import numpy as np
+from pygclib.core.flight import Flight
+from pygclib.core.frames import RaceFrames
+from pygclib.serialization.json_encoder import ComplexEncoder
+
+REPLAY_FORMAT = 'pygclib-replay'
+REPLAY_VERSION = 1
+
+# number of stored units per unit of each column : seconds, micro degrees (11 cm), meters and decimeters
+REPLAY_SCALES = {'seconds': 1, 'lat': 1000000, 'lon': 1000000, 'altitude': 1, 'pressure_altitude': 1, 'goal_distance': 10}
+INTEGER_COLUMNS = ['seconds', 'altitude', 'pressure_altitude']
+
+# goal distances of unvalidated fixes are stored as a negative distance
+MISSING_GOAL_DISTANCE = -1
+
+
+def write_replay(race, path):
+    """
+    Writes the flights of race to a binary replay.
+
+    Arguments:
+        race (Race) : The race to write.
+        path (str) : The .npz file to which the replay is written.
+    """
+    flights = list(race.flights.values())
+    lengths = np.array([len(flight) for flight in flights], dtype=np.int64)
+    firsts = (np.cumsum(lengths) - lengths)[lengths > 0]
+    header = {
+        'format': REPLAY_FORMAT,
+        'version': REPLAY_VERSION,
+        'properties': {
+            'n_snaps': len(race.frames),
+            'open': race.task.open,
+            'stop': race.task.stop
+        },
+        'task': race.task,
+        'ranking': race.ranking,
+        'pilots': [{
+            'id': flight.pilot_id,
+            'name': flight.pilot_name,
+            'fixes': len(flight)
+        } for flight in flights],
+        'scales': REPLAY_SCALES,
+    }
+
+    arrays = {'header': np.frombuffer(json.dumps(header, cls=ComplexEncoder, ensure_ascii=False).encode('utf8'), dtype=np.uint8)}
+    for column, scale in REPLAY_SCALES.items():
+        values = np.concatenate([_quantize(getattr(flight, column), scale) for flight in flights] + [np.zeros(0, dtype=np.int64)])
+        deltas = np.diff(values, prepend=0)
+        arrays[f'{column}_first'] = values[firsts]
+        deltas[firsts] = 0
+        arrays[column] = deltas.astype(_smallest_dtype(deltas))
+
+    np.savez_compressed(path, **arrays)
+
+
+def read_replay(path):
+    """Returns the :class:`Replay` of a binary replay file written by :func:`write_replay`."""
+    return Replay(path)
+
+
+class Replay():
+    """
+    Race read from a binary replay.
+
+    Arguments:
+        path (str) : The .npz file of the replay.
+
+    Attributes:
+        header (dict) : The JSON header of the replay, with the task, the ranking and the pilots.
+        flights (dict [str, Flight]) : The flights of the replay indexed by pilot ID, with their goal distances.
+    """
+
+    def __init__(self, path):
+        with np.load(path) as archive:
+            self.header = json.loads(archive['header'].tobytes().decode('utf8'))
+            if self.header.get('format') != REPLAY_FORMAT or self.header.get('version', 0) > REPLAY_VERSION:
+                raise ValueError(f'{path} is not a binary replay of version {REPLAY_VERSION} or lower')
+
+            lengths = np.array([pilot['fixes'] for pilot in self.header['pilots']], dtype=np.int64)
+            starts = np.cumsum(lengths) - lengths
+            columns = {}
+            for column, scale in self.header['scales'].items():
+                deltas = archive[column].astype(np.int64)
+                deltas[starts[lengths > 0]] = archive[f'{column}_first']
+                values = _restart_cumsum(deltas, starts[lengths > 0], lengths[lengths > 0])
+                columns[column] = values if column in INTEGER_COLUMNS else values / scale
+
+        goal_distance = columns['goal_distance']
+        goal_distance[goal_distance < 0] = np.nan
+        # replays written before pressure altitudes were stored read them as 0
+        pressure_altitude = columns.get('pressure_altitude', np.zeros(len(goal_distance), dtype=np.int64))
+        self.flights = {}
+        for pilot, start, length in zip(self.header['pilots'], starts, lengths):
+            rows = slice(start, start + length)
+            self.flights[pilot['id']] = Flight.from_arrays(pilot['id'], pilot['name'], columns['seconds'][rows].astype(np.int32), columns['lat'][rows], columns['lon'][rows], columns['altitude'][rows].astype(np.int32), pressure_altitude[rows].astype(np.int32), goal_distance[rows])
+        self._frames = None
+
+    @property
+    def frames(self):
+        """Dense per-second view of the replay between task opening and deadline, built on first access."""
+        if self._frames is None:
+            properties = self.header['properties']
+            self._frames = RaceFrames(self.flights, time.fromisoformat(properties['open']), time.fromisoformat(properties['stop']))
+        return self._frames
+
+    def __getitem__(self, time_point):
+        """Returns the snapshot of the replay at time_point, like the race it was written from."""
+        column = self.frames.column(time_point)
+        return {} if column is None else self.frames.snapshot(column)
+
+
+def _quantize(values, scale):
+    """Returns values multiplied by scale and rounded, NaN being replaced by MISSING_GOAL_DISTANCE."""
+    quantized = np.round(np.asarray(values, dtype=np.float64) * scale)
+    return np.where(np.isnan(quantized), MISSING_GOAL_DISTANCE, quantized).astype(np.int64)
+
+
+def _smallest_dtype(values):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return np.int64
+
+
+def _restart_cumsum(deltas, starts, lengths):
+    """Returns the cumulative sums of deltas, restarted at each start of the consecutive runs of lengths."""
+    sums = np.cumsum(deltas)
+    return sums - np.repeat(sums[starts] - deltas[starts], lengths)
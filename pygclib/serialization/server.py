@@ -0,0 +1,259 @@
+"""
+Replay server, serving the task, the ranking and the snapshots of a race over HTTP and WebSocket.
+
+The race is loaded once, its snapshots being computed on demand by chunks of CHUNK_FRAMES frames aligned on the task opening.
+Each chunk is encoded to JSON once and kept in a least recently used cache, so that replaying the same part of the race
+again only writes already encoded bytes. Responses are streamed one chunk at a time, and chunks are computed in worker threads
+so that the server keeps answering other requests meanwhile. Requests of a chunk being computed wait for it to be cached.
+"""
+
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import time
+
+import numpy as np
+from aiohttp import WSMsgType, web
+from pygclib.constants import SERVER_CACHE_SIZE, SERVER_HOST, SERVER_PORT
+from pygclib.serialization.json_encoder import ComplexEncoder
+from pygclib.time.timeop import seconds_after, to_seconds, to_time, unwrap_seconds
+
+# number of frames of each chunk of snapshots, whatever the step between two frames
+CHUNK_FRAMES = 300
+
+
+class ChunkCache():
+    """
+    In-memory cache of encoded chunks of snapshots, the least recently used chunks being evicted when it grows above its size budget.
+
+    Keyword Arguments:
+        max_size (int): Size budget of the cache, in megabytes.
+
+    Attributes:
+        size (int) : Number of bytes of the cached chunks.
+        hits (int) : Number of chunks read from the cache.
+        misses (int) : Number of chunks which were not in the cache.
+    """
+
+    def __init__(self, max_size=SERVER_CACHE_SIZE):
+        self.max_size = max_size * 1024 * 1024
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = OrderedDict()
+
+    def get(self, key):
+        """Returns the chunk cached at key, or None if key is not in the cache."""
+        if key not in self._chunks:
+            self.misses += 1
+            return None
+
+        self._chunks.move_to_end(key)
+        self.hits += 1
+        return self._chunks[key][0]
+
+    def put(self, key, chunk):
+        """Caches chunk, a tuple of frame indices and encoded snapshots, then evicts the least recently used chunks above the size budget."""
+        if key in self._chunks:
+            self.size -= self._chunks.pop(key)[1]
+        size = sum(len(member) for member in chunk[1])
+        self._chunks[key] = (chunk, size)
+        self.size += size
+
+        # the latest chunk is kept even if it is larger than the budget, since it is being served
+        while self.size > self.max_size and len(self._chunks) > 1:
+            _, (_, evicted) = self._chunks.popitem(last=False)
+            self.size -= evicted
+
+    def __len__(self):
+        return len(self._chunks)
+
+
+class ReplayServer():
+    """
+    Asyncio HTTP and WebSocket server of a race.
+
+    Routes:
+        * GET /race : The task opening, the task deadline and the IDs of the pilots.
+        * GET /task : The task, like the task of a JSON replay.
+        * GET /ranking : The final ranking, or the ranking at the time parameter [HH:MM:SS] with its top leading pilots if set.
+        * GET /frames : The snapshots between the start and stop parameters [HH:MM:SS], every step seconds and restricted to the
+          comma separated IDs of the pilots parameter, like the race of a JSON replay. Frames are aligned on the task opening.
+        * GET /frames/ws : WebSocket whose messages are JSON objects with the parameters of /frames, each answered by a message
+          per chunk of snapshots and an empty object once every snapshot was sent, or by an object with an error.
+
+    Arguments:
+        race (Race) : The race to serve.
+        cache_size (int) : Size budget of the encoded chunks of snapshots, in megabytes.
+
+    Attributes:
+        app (~aiohttp.web.Application) : The application serving the routes, which :meth:`run` listens with.
+        cache (ChunkCache) : The encoded chunks of snapshots.
+    """
+
+    def __init__(self, race, cache_size=SERVER_CACHE_SIZE):
+        self.race = race
+        self.cache = ChunkCache(cache_size)
+        self._pending = {}
+        self._encoder = ComplexEncoder(ensure_ascii=False, separators=(',', ':'))
+        self._opening = to_seconds(race.task.open)
+        self._deadline = seconds_after(race.task.stop, self._opening)
+
+        # documents which never change are encoded once
+        self._properties = self._encode({'open': race.task.open, 'stop': race.task.stop, 'pilots': list(race.flights)})
+        self._task = self._encode(race.task)
+        self._ranking = self._encode(race.ranking)
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/race', self.properties),
+            web.get('/task', self.task),
+            web.get('/ranking', self.ranking),
+            web.get('/frames', self.frames),
+            web.get('/frames/ws', self.frames_websocket),
+        ])
+
+    def run(self, host=SERVER_HOST, port=SERVER_PORT):
+        """Serves the race on host and port until interrupted."""
+        web.run_app(self.app, host=host, port=port)
+
+    async def properties(self, request):
+        return _json_response(self._properties)
+
+    async def task(self, request):
+        return _json_response(self._task)
+
+    async def ranking(self, request):
+        if 'time' not in request.query:
+            return _json_response(self._ranking)
+
+        try:
+            timestamp = time.fromisoformat(request.query['time'])
+            top = int(request.query['top']) if 'top' in request.query else None
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return _json_response(self._encode(self.race.ranking_at(timestamp, top)))
+
+    async def frames(self, request):
+        try:
+            window = self._window(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        opening = b'{'
+        async for members in self._chunks(*window):
+            await response.write(opening + b','.join(members))
+            opening = b','
+        await response.write(b'{}' if opening == b'{' else b'}')
+        await response.write_eof()
+        return response
+
+    async def frames_websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            try:
+                params = json.loads(message.data)
+                if not isinstance(params, dict):
+                    raise ValueError(f'Frames query must be a JSON object but is {message.data}')
+                window = self._window(params)
+            except ValueError as e:
+                await ws.send_str(json.dumps({'error': str(e)}))
+                continue
+
+            async for members in self._chunks(*window):
+                await ws.send_str('{' + b','.join(members).decode('utf8') + '}')
+            await ws.send_str('{}')
+        return ws
+
+    def _window(self, params):
+        """
+        Returns the first and last frames of a query, counted every step seconds from the task opening, with its step and pilots.
+
+        Raises:
+            ValueError: If a parameter is malformed or of the wrong type, or if a pilot is not part of the race.
+        """
+        step = params.get('step', 1)
+        if not isinstance(step, (int, str)) or isinstance(step, bool):
+            raise ValueError(f'Frames step must be a number of seconds but is {step!r}')
+        step = int(step)
+        if step < 1:
+            raise ValueError(f'Frames step must be a positive number of seconds but is {step}')
+
+        pilots = params.get('pilots')
+        if pilots is not None:
+            if isinstance(pilots, str):
+                pilots = pilots.split(',')
+            if not isinstance(pilots, list) or not all(isinstance(pilot_id, str) for pilot_id in pilots):
+                raise ValueError(f'Frames pilots must be a list of pilot IDs but is {pilots!r}')
+            pilots = tuple(pilots)
+            unknown = [pilot_id for pilot_id in pilots if pilot_id not in self.race.flights]
+            if unknown:
+                raise ValueError(f'Pilots {unknown} are not part of the race')
+
+        first = self._seconds(params.get('start'), self._opening)
+        last = max(self._seconds(params.get('stop'), self._deadline), first)
+        return -(-(first - self._opening) // step), -(-(last - self._opening) // step), step, pilots
+
+    def _seconds(self, timestamp, default):
+        """Returns an ISO timestamp in seconds since the midnight preceding the task opening, clipped to the task time range."""
+        if timestamp is None:
+            return default
+        if not isinstance(timestamp, str):
+            raise ValueError(f'Frames start and stop must be ISO timestamps but are {timestamp!r}')
+        seconds = int(unwrap_seconds([to_seconds(time.fromisoformat(timestamp))], self._opening)[0])
+        return min(max(seconds, self._opening), self._deadline)
+
+    async def _chunks(self, first, last, step, pilots):
+        """Generates the encoded snapshots of the frames from first to last, as the lists of JSON members of each chunk."""
+        if last <= first:
+            return
+
+        loop = asyncio.get_running_loop()
+        for index in range(first // CHUNK_FRAMES, -(-last // CHUNK_FRAMES)):
+            key = (step, pilots, index)
+            chunk = self.cache.get(key)
+            if chunk is None:
+                # concurrent requests of a chunk being computed wait for it instead of computing it again
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = loop.create_task(self._compute_chunk(key, step, pilots, index))
+                # a request closed by its client does not cancel the computation awaited by the others
+                chunk = await asyncio.shield(pending)
+
+            indices, members = chunk
+            lo, hi = np.searchsorted(indices, [first, last])
+            if hi > lo:
+                yield members[lo:hi]
+
+    async def _compute_chunk(self, key, step, pilots, index):
+        """Encodes a chunk in a worker thread and caches it, key being pending until then."""
+        try:
+            chunk = await asyncio.get_running_loop().run_in_executor(None, self._encode_chunk, step, pilots, index)
+            self.cache.put(key, chunk)
+            return chunk
+        finally:
+            del self._pending[key]
+
+    def _encode_chunk(self, step, pilots, index):
+        """Returns the frame indices of the snapshots of a chunk in which a pilot is present, and their encoded JSON members."""
+        first = index * CHUNK_FRAMES
+        start = self._opening + first * step
+        stop = min(start + CHUNK_FRAMES * step, self._deadline)
+        frames = self.race.query(to_time(start), to_time(stop), step, None if pilots is None else list(pilots))
+        columns = frames.active_columns()
+        members = [f'{json.dumps(str(frames.timestamp(column)))}:{self._encoder.encode(frames.records(column))}'.encode('utf8') for column in columns]
+        return first + columns, members
+
+    def _encode(self, obj):
+        return self._encoder.encode(obj).encode('utf8')
+
+
+def _json_response(body):
+    return web.Response(body=body, content_type='application/json')
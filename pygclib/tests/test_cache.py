@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+from pygclib.core.cache import TMP_MAX_AGE, FlightCache
+from pygclib.core.flight import Flight
+from pygclib.core.race import Race
+from pygclib.tests import TEST_DATA
+
+TRACKS = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+
+
+@pytest.fixture
+def contents():
+    contents = {}
+    for pilot_id in ['0046', '0093', '1611']:
+        with open(os.path.join(TRACKS, f'{pilot_id}.igc'), 'rb') as f:
+            contents[pilot_id] = f.read()
+    return contents
+
+
+def test_cache_roundtrip(tmpdir, contents):
+    cache = FlightCache(directory=str(tmpdir))
+    key = cache.key(contents['0093'])
+    assert cache.get(key, '0093') is None
+
+    flight = Flight('0093.igc', contents['0093'])
+    cache.put(key, flight)
+    cached = cache.get(key, '0093')
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cached.pilot_name == flight.pilot_name
+    for column in ['seconds', 'lat', 'lon', 'altitude', 'pressure_altitude']:
+        np.testing.assert_array_equal(getattr(cached, column), getattr(flight, column))
+
+
+def test_cache_eviction(tmpdir, contents):
+    cache = FlightCache(directory=str(tmpdir))
+    keys = {pilot_id: cache.key(content) for pilot_id, content in contents.items()}
+    for pilot_id, content in contents.items():
+        cache.put(keys[pilot_id], Flight(f'{pilot_id}.igc', content))
+
+    # reading the oldest entry makes 0093 the least recently used one
+    assert cache.get(keys['0046'], '0046') is not None
+    cache.max_size = sum(entry.stat().st_size for entry in os.scandir(str(tmpdir))) - 1
+    cache.evict()
+
+    assert cache.get(keys['0093'], '0093') is None
+    assert cache.get(keys['0046'], '0046') is not None
+    assert cache.get(keys['1611'], '1611') is not None
+
+
+@pytest.mark.parametrize('size', [0, 10, -10])
+def test_cache_corrupted_entry(tmpdir, contents, size):
+    cache = FlightCache(directory=str(tmpdir))
+    key = cache.key(contents['0093'])
+    cache.put(key, Flight('0093.igc', contents['0093']))
+
+    # truncated entries, as left by a full disk, are misses and removed
+    path = cache._path(key)
+    with open(path, 'r+b') as f:
+        f.truncate(size if size >= 0 else os.path.getsize(path) + size)
+    assert cache.get(key, '0093') is None
+    assert cache.misses == 1 and not os.path.exists(path)
+
+
+def test_cache_eviction_tmp(tmpdir, contents):
+    cache = FlightCache(directory=str(tmpdir))
+    stale, recent = tmpdir.join('stale.tmp'), tmpdir.join('recent.tmp')
+    stale.write(b'0')
+    recent.write(b'0')
+    os.utime(str(stale), (0, os.path.getmtime(str(stale)) - TMP_MAX_AGE - 1))
+    cache.evict()
+
+    # temporary files of interrupted writes are removed, not those which may still be written
+    assert not stale.exists() and recent.exists()
+
+
+def test_race_cache(tmpdir):
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    # the cache is opt-in, races parse every track by default
+    parsed = Race(tracks=TRACKS, task=task, validate=False, progress='silent')
+    assert parsed._cache is None
+
+    Race(tracks=TRACKS, task=task, validate=False, progress='silent', cache=str(tmpdir))
+    cached = Race(tracks=TRACKS, task=task, validate=False, progress='silent', cache=str(tmpdir))
+    assert (cached._cache.hits, cached._cache.misses) == (3, 0)
+    for pilot_id, flight in parsed.flights.items():
+        np.testing.assert_array_equal(cached.flights[pilot_id].lat, flight.lat)
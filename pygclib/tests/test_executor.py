@@ -0,0 +1,31 @@
+import pytest
+from pygclib.constants import EXECUTOR_BACKENDS
+from pygclib.core.executor import Executor
+
+
+def _square(x):
+    return x * x
+
+
+def test_executor_chunks():
+    executor = Executor(jobs=2, backend='serial')
+    sizes = [1, 50, 1, 1, 30, 1]
+    chunks = executor._chunks(list(range(len(sizes))), sizes)
+
+    # longest items come first, alone in their chunk, small ones are grouped
+    assert chunks[0] == [1] and chunks[1] == [4]
+    assert sorted(i for chunk in chunks for i in chunk) == list(range(len(sizes)))
+    assert len(chunks) < len(sizes)
+
+
+@pytest.mark.parametrize('backend', EXECUTOR_BACKENDS)
+def test_executor_backends(backend):
+    with Executor(jobs=2, backend=backend) as executor:
+        assert sorted(executor.map(_square, list(range(10)), sizes=list(range(10)))) == [x * x for x in range(10)]
+        # workers are reused by the next stage
+        assert sorted(executor.map(_square, [3, 4])) == [9, 16]
+
+
+def test_executor_unknown_backend():
+    with pytest.raises(ValueError):
+        Executor(backend='gpu')
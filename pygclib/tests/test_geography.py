@@ -0,0 +1,159 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+import numpy as np
+import pytest
+from geolib import destination as c_destination
+from geolib import distance as c_distance
+from geolib import heading as c_heading
+from pygclib.constants import GEODESY_MAX_ERROR
+from pygclib.core.task import Task
+from pygclib.geography import destination, distance, distance_pairwise, geodesy, get_geodesy, heading, project, set_geodesy
+from pygclib.geography.optimizer import _tasklen, _tasklen_gradient, _waypoint_arrays, optimize
+from pygclib.tests import TEST_DATA
+
+TASKS = ['pwca_brazil_2019_7.xctsk', 'pwca_brazil_2019_7.json', 'raw_task.json']
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(0)
+    lat1 = rng.uniform(-60, 60, 100)
+    lon1 = rng.uniform(-170, 170, 100)
+    return lat1, lon1, lat1 + rng.uniform(-1, 1, 100), lon1 + rng.uniform(-1, 1, 100)
+
+
+def test_batch_matches_scalar(points):
+    lat1, lon1, lat2, lon2 = points
+    np.testing.assert_array_equal(distance(lat1, lon1, lat2, lon2), [c_distance(*p) for p in zip(lat1, lon1, lat2, lon2)])
+    np.testing.assert_array_equal(heading(lat1, lon1, lat2, lon2), [c_heading(*p) for p in zip(lat1, lon1, lat2, lon2)])
+
+    lats, lons = destination(lat1, lon1, 1000., heading(lat1, lon1, lat2, lon2))
+    expected = np.array([c_destination(*p, 1000., h) for p, h in zip(zip(lat1, lon1), heading(lat1, lon1, lat2, lon2))])
+    np.testing.assert_array_equal(lats, expected[:, 0])
+    np.testing.assert_array_equal(lons, expected[:, 1])
+
+
+def test_batch_one_to_many(points):
+    lat1, lon1, lat2, lon2 = points
+    np.testing.assert_array_equal(distance(lat1[0], lon1[0], lat2, lon2), [c_distance(lat1[0], lon1[0], *p) for p in zip(lat2, lon2)])
+
+    pairwise = distance_pairwise(lat1[:5], lon1[:5], lat2, lon2)
+    assert pairwise.shape == (5, 100)
+    np.testing.assert_array_equal(pairwise[3], distance(lat1[3], lon1[3], lat2, lon2))
+
+
+@pytest.mark.parametrize('task_file', TASKS)
+@pytest.mark.parametrize('mode', ['haversine', 'projected'])
+def test_geodesy_error_bound(task_file, mode):
+    task = Task(os.path.join(TEST_DATA, 'tasks', task_file), geodesy='exact')
+    lat, lon = task.centroid
+
+    # random pairs of points less than 1° of latitude away from the task centroid
+    rng = np.random.default_rng(0)
+    lat1, lat2 = rng.uniform(lat - 1, lat + 1, (2, 10000))
+    lon1, lon2 = rng.uniform(lon - 1, lon + 1, (2, 10000))
+    exact = distance(lat1, lon1, lat2, lon2)
+
+    with geodesy(mode, task.centroid):
+        approx = distance(lat1, lon1, lat2, lon2)
+        error = np.abs(approx - exact) / exact
+        assert error.max() <= GEODESY_MAX_ERROR[mode]
+
+        # destination is the inverse of distance and heading
+        lats, lons = destination(lat1, lon1, approx, heading(lat1, lon1, lat2, lon2))
+        np.testing.assert_allclose(lats, lat2, atol=1e-9)
+        np.testing.assert_allclose(lons, lon2, atol=1e-9)
+
+    assert get_geodesy() == 'exact'
+
+
+@pytest.mark.parametrize('mode', ['haversine', 'projected'])
+def test_geodesy_task_length(mode):
+    task_file = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    task = Task(task_file, geodesy=mode)
+    assert task.geodesy == mode
+    # tasks compute in their mode without changing the mode of the caller
+    assert get_geodesy() == 'exact'
+
+    # the optimized route of the task is measured within the error bound of the mode
+    lat, lon = np.array([(p.lat, p.lon) for p in task.opti.points]).T
+    exact = distance(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()
+    with geodesy(mode, task.centroid):
+        approx = distance(lat[:-1], lon[:-1], lat[1:], lon[1:]).sum()
+    assert abs(approx - exact) <= GEODESY_MAX_ERROR[mode] * exact
+
+    with pytest.raises(ValueError):
+        set_geodesy('flat')
+
+
+@pytest.mark.parametrize('mode, max_error', [('exact', 1e-4), ('haversine', 1e-4), ('projected', 4e-3)])
+def test_project_error_bound(mode, max_error):
+    # pairs of points less than a gaggle radius apart, up to 100 km from the origin of the projection
+    origin = (-22.5, -45.5)
+    rng = np.random.default_rng(0)
+    lat1, lon1 = destination(*origin, rng.uniform(0, 100000, 10000), rng.uniform(-180, 180, 10000))
+    lat2, lon2 = destination(lat1, lon1, rng.uniform(1, 500, 10000), rng.uniform(-180, 180, 10000))
+
+    with geodesy(mode, origin):
+        exact = distance(lat1, lon1, lat2, lon2)
+        planar = np.linalg.norm(project(origin, lat1, lon1) - project(origin, lat2, lon2), axis=-1)
+    assert np.max(np.abs(planar - exact) / exact) < max_error
+
+
+@pytest.mark.parametrize('mode', ['exact', 'haversine', 'projected'])
+def test_tasklen_gradient(mode):
+    task = Task(os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk'), geodesy=mode)
+    args = (task.takeoff.lat, task.takeoff.lon, *_waypoint_arrays(task.turnpoints))
+    angles = np.random.default_rng(0).uniform(-180, 180, len(task.turnpoints) + 1)
+
+    with task._geodesy():
+        length, gradient = _tasklen_gradient(angles, *args)
+        assert length == _tasklen(angles, *args)
+
+        # extra warm start angles do not change the length
+        steps = 1e-4 * np.eye(len(angles))
+        finite_differences = [(_tasklen(angles + h, *args) - _tasklen(angles - h, *args)) / 2e-4 for h in steps]
+    np.testing.assert_allclose(gradient, finite_differences, rtol=1e-3, atol=1e-3 * np.abs(gradient).max())
+    assert gradient[-1] == 0
+
+
+@pytest.mark.parametrize('task_file', TASKS)
+def test_route_engine(task_file):
+    task = Task(os.path.join(TEST_DATA, 'tasks', task_file), engine='bfgs')
+    route = optimize(task.takeoff, task.turnpoints, engine='route')
+    assert route.distance <= task.opti.distance + 1
+    assert len(route.legs) == len(task.turnpoints)
+
+    # warm started from its own solution, the solver stays on it
+    warm = optimize(task.takeoff, task.turnpoints, prev_opti=route._angles, engine='route')
+    assert warm.distance == pytest.approx(route.distance, abs=0.01)
+
+    with pytest.raises(ValueError):
+        optimize(task.takeoff, task.turnpoints, engine='simplex')
+
+
+def test_geodesy_threads(points):
+    lat1, lon1, lat2, lon2 = points
+    modes = ['exact', 'haversine', 'projected'] * 4
+    expected = {}
+    for mode in set(modes):
+        with geodesy(mode, (lat1[0], lon1[0])):
+            expected[mode] = distance(lat1, lon1, lat2, lon2)
+    barrier = Barrier(len(modes))
+
+    def compute(mode):
+        # every thread sets its mode before any of them computes, a process-wide mode would be overwritten
+        with geodesy(mode, (lat1[0], lon1[0])):
+            barrier.wait()
+            return [distance(lat1, lon1, lat2, lon2) for _ in range(20)]
+
+    with ThreadPoolExecutor(len(modes)) as executor:
+        for mode, results in zip(modes, executor.map(compute, modes)):
+            for result in results:
+                np.testing.assert_array_equal(result, expected[mode])
+
+    # the C functions default to exact geodesics when they are not given a mode
+    assert c_distance(lat1[0], lon1[0], lat2[0], lon2[0]) == expected['exact'][0]
+    assert get_geodesy() == 'exact'
@@ -0,0 +1,39 @@
+import os
+from glob import glob
+
+import numpy as np
+import pytest
+from pygclib.constants import IGC_PILOT_NAME, IGC_TZ_OFFSET
+from pygclib.parsers import igcparse
+from pygclib.tests import TEST_DATA
+
+TRACKS = sorted(glob(os.path.join(TEST_DATA, 'tracks', '**', '*.igc'), recursive=True))
+
+
+@pytest.mark.parametrize('track', TRACKS, ids=os.path.basename)
+def test_igc_parser_parity(track):
+    with open(track, 'rb') as f:
+        content = f.read()
+
+    fast = igcparse.read_fast(content)
+    assert fast is not None
+
+    fast_header, fast_fixes = fast
+    header, fixes = igcparse.read_aerofiles(content)
+
+    for key in [IGC_PILOT_NAME, IGC_TZ_OFFSET]:
+        assert fast_header.get(key) == header.get(key)
+    for fast_column, column in zip(fast_fixes, fixes):
+        assert fast_column.dtype == column.dtype
+        np.testing.assert_array_equal(fast_column, column)
+
+
+@pytest.mark.parametrize('track', TRACKS, ids=os.path.basename)
+def test_max_fixes(track):
+    with open(track, 'rb') as f:
+        content = f.read()
+
+    # shared memory rows are reserved for at most this many fixes
+    _, fixes = igcparse.read_fast(content)
+    assert len(fixes[0]) <= igcparse.max_fixes(len(content))
+    assert igcparse.max_fixes(len(b'B1200004500000N00600000EA0100001000')) == 1
@@ -1,9 +1,24 @@
+import json
 import os
+import pickle
+import zipfile
 from datetime import time
 
+import numpy as np
 import pytest
+from pygclib.core.flight import Flight
+from pygclib.core.frames import RaceFrames
+from pygclib.core import race as race_module
 from pygclib.core.race import Race
+from pygclib.core.ranking import Ranking
+from pygclib.geography import distance
+from pygclib.serialization.replay import read_replay
 from pygclib.tests import TEST_DATA
+from pygclib.time.timeop import SECONDS_PER_DAY, to_seconds, to_time
+
+# race pickled by the version storing fixes as dicts of GeoPoints, from tracks keeping one fix out of ten
+LEGACY_TRACKS = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_decimated')
+LEGACY_RACE = os.path.join(TEST_DATA, 'races', 'pwca_brazil_2019_7_baseline.pkl')
 
 
 @pytest.fixture(scope='session')
@@ -58,6 +73,348 @@ def test_race_ranking_distance(xctrack_race, b64_xctrack_race, race_from_replay)
 
 
 def test_race_ranking_time(xctrack_race, b64_xctrack_race, race_from_replay):
-    assert race_from_replay.ranking['0093']['time'] == time(2, 25, 6)
-    assert race_from_replay.ranking['0046']['time'] == time(2, 27, 47)
-    assert race_from_replay.ranking['1611']['time'] == time(2, 27, 32)
+    # goal crossings are interpolated between fixes, so race times are within a second of the time of the first fix in goal
+    assert to_seconds(race_from_replay.ranking['0093']['time']) == pytest.approx(to_seconds(time(2, 25, 6)), abs=1)
+    assert to_seconds(race_from_replay.ranking['0046']['time']) == pytest.approx(to_seconds(time(2, 27, 47)), abs=1)
+    assert to_seconds(race_from_replay.ranking['1611']['time']) == pytest.approx(to_seconds(time(2, 27, 32)), abs=1)
+
+
+@pytest.mark.parametrize('executor', ['process', 'thread', 'serial'])
+@pytest.mark.parametrize('shared_memory', [False, True])
+def test_race_from_zip(xctrack_race, executor, shared_memory):
+    # workers open the members of the archive themselves
+    tracks = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks.zip')
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    replay = Race(tracks=tracks, task=task, progress='silent', validate=False, executor=executor, shared_memory=shared_memory)
+    assert replay.n_pilots == xctrack_race.n_pilots
+    for pilot_id, flight in replay.flights.items():
+        assert (flight.seconds == xctrack_race.flights[pilot_id].seconds).all()
+
+    # the archive is not left open once the workers are stopped
+    replay.close()
+    if os.path.isdir('/proc/self/fd'):
+        assert all(os.path.realpath(os.path.join('/proc/self/fd', fd)) != os.path.realpath(tracks) for fd in os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.parametrize('shared_memory', [False, True])
+def test_race_from_zip_duplicate_pilots(tmpdir, shared_memory):
+    # members of nested folders are keyed by their file name, which must not be shared by two tracks
+    source = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+    track = sorted(name for name in os.listdir(source) if name.lower().endswith('.igc'))[0]
+    tracks = os.path.join(str(tmpdir), 'duplicates.zip')
+    with zipfile.ZipFile(tracks, 'w') as archive:
+        archive.write(os.path.join(source, track), track)
+        archive.write(os.path.join(source, track), os.path.join('nested', track))
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    with pytest.raises(ValueError, match='several tracks'):
+        Race(tracks=tracks, task=task, progress='silent', validate=False, executor='serial', shared_memory=shared_memory)
+
+
+@pytest.mark.parametrize('executor', ['process', 'thread', 'serial'])
+def test_race_shared_memory(xctrack_race, executor, tmpdir):
+    tracks = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    # flights are parsed into the block validated in place, cached flights being copied to it on the second run
+    for _ in range(2):
+        race = Race(tracks=tracks, task=task, progress='silent', cache=str(tmpdir), shared_memory=True, executor=executor)
+        assert race._shared_flights is None
+        # workers running in this process do not keep the released block mapped
+        assert race_module._worker_flights is None
+        for pilot_id, flight in race.flights.items():
+            expected = xctrack_race.flights[pilot_id]
+            assert (flight.seconds == expected.seconds).all()
+            assert flight.goal_distance == pytest.approx(expected.goal_distance)
+            assert flight.race_time == expected.race_time
+
+
+def test_flight_append_midnight():
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_decimated', '0046.igc'))
+    # the same fixes, logged across midnight and appended by chunks
+    seconds = (flight.seconds - flight.seconds[len(flight) // 3]) % SECONDS_PER_DAY
+    live = Flight.from_columns(flight.pilot_id, flight.pilot_name, seconds[:10], flight.lat[:10], flight.lon[:10], flight.altitude[:10], flight.pressure_altitude[:10])
+    for start in range(10, len(flight), 70):
+        chunk = slice(start, start + 70)
+        live.append(seconds[chunk], flight.lat[chunk], flight.lon[chunk], flight.altitude[chunk], flight.pressure_altitude[chunk])
+        order = np.arange(len(live)) if live._order is None else live._order
+        np.testing.assert_array_equal(order, np.argsort(live.seconds, kind='stable'))
+
+    np.testing.assert_array_equal(live.seconds, seconds)
+    assert live._order is not None
+    assert live[time(0, 0)] is not None and live[time(0, 0)].lat == flight.lat[len(flight) // 3]
+
+
+def test_flight_append_stale_fix():
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_decimated', '0046.igc'))
+    live = Flight.from_columns(flight.pilot_id, flight.pilot_name, np.array([86390, 86395], dtype=np.int32), flight.lat[:2], flight.lon[:2], flight.altitude[:2], flight.pressure_altitude[:2])
+    live.append(np.array([100], dtype=np.int32), flight.lat[2:3], flight.lon[2:3], flight.altitude[2:3], flight.pressure_altitude[2:3])
+    # fixes sent again from before midnight are not after the last fix, and are dropped
+    assert live.append(np.array([86395, 50, 100, 101], dtype=np.int32), flight.lat[3:7], flight.lon[3:7], flight.altitude[3:7], flight.pressure_altitude[3:7]) == 3
+    np.testing.assert_array_equal(live.seconds, [86390, 86395, 100, 101])
+    np.testing.assert_array_equal(live.timeline(86390), [86390, 86395, 86500, 86501])
+    assert live.lat[-1] == flight.lat[6]
+
+
+class _RawFlight():
+    pass
+
+
+class _RawFlightUnpickler(pickle.Unpickler):
+    """Unpickles flights as plain objects holding their pickled attributes."""
+
+    def find_class(self, module, name):
+        return _RawFlight if name == 'Flight' else super().find_class(module, name)
+
+
+def test_flight_legacy_pickle():
+    with open(LEGACY_RACE, 'rb') as f:
+        flights = pickle.load(f)['flights']
+    with open(LEGACY_RACE, 'rb') as f:
+        raw_flights = _RawFlightUnpickler(f).load()['flights']
+
+    for pilot_id, flight in flights.items():
+        parsed = Flight(os.path.join(LEGACY_TRACKS, f'{pilot_id}.igc'))
+        for column in ['seconds', 'lat', 'lon', 'altitude']:
+            assert (getattr(flight, column) == getattr(parsed, column)).all()
+        assert flight.goal_distance.tolist() == [point.goal_distance for point in raw_flights[pilot_id].points.values()]
+        assert flight.race_distance == raw_flights[pilot_id].race_distance
+        assert flight._first_point['timestamp'] == raw_flights[pilot_id]._first_point['timestamp']
+
+        # converted flights are pickled again in columns
+        copy = pickle.loads(pickle.dumps(flight))
+        assert 'points' not in copy.__dict__ and (copy.goal_distance == flight.goal_distance).all()
+
+
+def test_race_binary_replay(xctrack_race, tmpdir):
+    path = os.path.join(str(tmpdir), 'race.npz')
+    xctrack_race.save(path)
+    replay = read_replay(path)
+
+    assert replay.header['ranking']['pilots_in_goal'] == xctrack_race.ranking.pilots_in_goal
+    for pilot_id, flight in xctrack_race.flights.items():
+        read = replay.flights[pilot_id]
+        assert (read.seconds == flight.seconds).all() and (read.altitude == flight.altitude).all()
+        assert (read.pressure_altitude == flight.pressure_altitude).all()
+        assert read.lat == pytest.approx(flight.lat, abs=5e-7) and read.lon == pytest.approx(flight.lon, abs=5e-7)
+        assert read.goal_distance == pytest.approx(flight.goal_distance, abs=0.051)
+
+    snapshot, read_snapshot = xctrack_race[time(14, 0)], replay[time(14, 0)]
+    assert set(read_snapshot) == set(snapshot)
+    assert read_snapshot['0093'].goal_distance == pytest.approx(snapshot['0093'].goal_distance, abs=0.051)
+
+
+def test_race_store(xctrack_race, xctrack_replay, tmpdir):
+    path = os.path.join(str(tmpdir), 'race.race')
+    xctrack_race.save(path)
+    stored = Race(path=path)
+
+    # flights are only read when they are accessed
+    assert stored.flights._flights == {}
+    assert stored.ranking.pilots == xctrack_race.ranking.pilots
+    flight, expected = stored.flights['0093'], xctrack_race.flights['0093']
+    assert list(stored.flights._flights) == ['0093']
+    assert (flight.goal_distance == expected.goal_distance).all() and flight.race_time == expected.race_time
+
+    # a pickled replay migrated to a store is validated like the original race
+    migrated = os.path.join(str(tmpdir), 'replay.race')
+    Race(path=os.path.join(str(xctrack_replay), 'replay.pkl'), validate=False).save(migrated)
+    race = Race(path=migrated, progress='silent')
+    assert race.validated
+    for pilot_id, flight in race.flights.items():
+        assert flight.goal_distance == pytest.approx(xctrack_race.flights[pilot_id].goal_distance)
+
+
+def test_race_legacy_migrate(tmpdir):
+    legacy = Race(path=LEGACY_RACE, validate=False)
+    path = os.path.join(str(tmpdir), 'legacy.race')
+    legacy.save(path)
+    migrated = Race(path=path, progress='silent')
+
+    assert migrated.validated and migrated.ranking.pilots == legacy.ranking.pilots
+    assert migrated.ranking._steps is not None
+    for pilot_id, flight in legacy.flights.items():
+        stored = migrated.flights[pilot_id]
+        for column in ['seconds', 'lat', 'lon', 'altitude', 'goal_distance']:
+            assert (getattr(stored, column) == getattr(flight, column)).all()
+
+    # the legacy race is replayed like the races of this version, at the seconds of its fixes
+    start, stop = time(12, 0), time(13, 0)
+    assert _records(migrated.snapshots(start, stop)) == _records(legacy.snapshots(start, stop))
+    assert len(list(migrated.snapshots(start, stop))) > 0
+
+
+def _records(snapshots):
+    return [(timestamp, {pilot_id: point.serialize() for pilot_id, point in snapshot.items()}) for timestamp, snapshot in snapshots]
+
+
+def _lookup_snapshot(flights, timestamp):
+    """Snapshot looked up in each flight, like races did before frames were precomputed."""
+    snap = {}
+    for pilot_id, flight in flights.items():
+        if flight[timestamp] is not None:
+            snap[pilot_id] = flight[timestamp]
+        elif timestamp < flight._first_point['timestamp']:
+            snap[pilot_id] = flight._first_point['point']
+        elif timestamp > flight._last_point['timestamp']:
+            snap[pilot_id] = flight._last_point['point']
+    return snap
+
+
+def test_race_frames_lookup(xctrack_race):
+    # a flight logging a fix every 10 seconds, missing from the frames between its fixes
+    flights = dict(xctrack_race.flights, decimated=Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_decimated', '0046.igc')))
+    # frames wider than the flights, so that seconds before the first fix and after the last fix of each pilot are part of them
+    frames = RaceFrames(flights, time(8, 0), time(19, 0))
+    seconds = [to_seconds(time(8, 0)), to_seconds(time(14, 0)) + 7, to_seconds(time(19, 0)) - 1]
+    for flight in flights.values():
+        first, last = flight.seconds[flight._first], flight.seconds[flight._last]
+        seconds += [first - 1, first, first + 1, first + 5, last - 1, last, last + 1]
+
+    for second in seconds:
+        timestamp = to_time(second)
+        expected = _lookup_snapshot(flights, timestamp)
+        column = frames.column(timestamp)
+        assert {pilot_id: point.serialize() for pilot_id, point in frames.snapshot(column).items()} == {pilot_id: point.serialize() for pilot_id, point in expected.items()}
+        assert frames.records(column) == {pilot_id: {'lat': point.lat, 'lon': point.lon, 'altitude': point.altitude, 'status': 'flying', 'goal_distance': point.goal_distance} for pilot_id, point in expected.items()}
+
+
+def test_race_snapshots_window(xctrack_race):
+    start, stop = time(14, 0), time(14, 30)
+    expected = _records((timestamp, snapshot) for timestamp, snapshot in xctrack_race.snapshots() if start <= timestamp < stop and (to_seconds(timestamp) - to_seconds(start)) % 5 == 0)
+    assert len(expected) == 360
+    assert _records(xctrack_race.snapshots(start, stop, step=5)) == expected
+
+    pilots = ['0093', '1611']
+    window = _records(xctrack_race.snapshots(start, stop, step=5, pilots=pilots))
+    assert window == [(timestamp, {p: snapshot[p] for p in pilots}) for timestamp, snapshot in expected]
+
+    # windows are clipped to the task time range
+    assert _records(xctrack_race.snapshots(time(6, 0), time(23, 0), step=60)) == _records(xctrack_race.snapshots(step=60))
+    with pytest.raises(ValueError):
+        xctrack_race.query(pilots=['unknown'])
+
+
+def test_race_watch(xctrack_race, tmpdir):
+    output = os.path.join(str(tmpdir), 'watch.json')
+    xctrack_race.watch(['all'], output=[output])
+    with open(output) as f:
+        series = json.load(f)
+
+    # features are the differences with the mean of the present pilots
+    timestamp, snapshot = next((timestamp, snapshot) for timestamp, snapshot in xctrack_race.snapshots() if timestamp == time(14, 0))
+    column = series['timestamps'].index(str(timestamp))
+    mean_altitude = sum(point.altitude for point in snapshot.values()) / len(snapshot)
+    assert series['pilots']['0093']['altitude'][column] == pytest.approx(snapshot['0093'].altitude - mean_altitude)
+
+    sparse = os.path.join(str(tmpdir), 'sparse.json')
+    xctrack_race.watch(['0093', 'unknown'], output=[sparse], sparse=10)
+    with open(sparse) as f:
+        sparse_series = json.load(f)
+    assert list(sparse_series['pilots']) == ['0093']
+    assert sparse_series['timestamps'] == series['timestamps'][::10]
+    assert len(sparse_series['pilots']['0093']['distance']) == len(sparse_series['timestamps'])
+
+    # stored races compare the watched pilots to the totals of the frames, without reading the other flights
+    path = os.path.join(str(tmpdir), 'race.race')
+    xctrack_race.save(path)
+    stored = Race(path=path)
+    stored_output = os.path.join(str(tmpdir), 'stored.json')
+    stored.watch(['0093'], output=[stored_output])
+    assert list(stored.flights._flights) == ['0093']
+    with open(stored_output) as f:
+        stored_series = json.load(f)
+    assert stored_series['timestamps'] == series['timestamps']
+    for feature, values in series['pilots']['0093'].items():
+        assert stored_series['pilots']['0093'][feature] == pytest.approx(values)
+
+
+def test_race_gaggles(xctrack_race):
+    gaggles = xctrack_race.gaggles(k=1, gaggle_radius=400)
+    frames = gaggles.frames
+    column = frames.column(time(14, 0))
+    snapshot = frames.snapshot(column)
+
+    # at 14:00, 0093 and 1611 are 334 m apart and 0046 is more than 400 m from both
+    records = gaggles.records(column)
+    assert records['0093']['neighbours'] == ['1611'] and records['1611']['neighbours'] == ['0093']
+    assert records['0093']['distances'][0] == pytest.approx(distance(snapshot['0093'].lat, snapshot['0093'].lon, snapshot['1611'].lat, snapshot['1611'].lon), rel=0.01)
+    assert records['0093']['gaggle'] == records['1611']['gaggle'] == 0 and records['0046']['gaggle'] == -1
+
+    # distances between neighbours are measured on the projection within its stated error
+    found = gaggles.neighbours[..., 0] >= 0
+    rows, columns = np.nonzero(found)
+    others = gaggles.neighbours[rows, columns, 0]
+    exact = distance(frames.lat[rows, columns], frames.lon[rows, columns], frames.lat[others, columns], frames.lon[others, columns])
+    assert len(exact) > 1000
+    np.testing.assert_allclose(gaggles.distances[rows, columns, 0], exact, rtol=1e-4, atol=0.01)
+
+    features = gaggles.features('0093', time(14, 0))
+    assert features.group_relation.other_pilot_id == ['1611'] and features.gaggle == 0
+    assert gaggles.neighbours.shape == frames.present.shape + (1,)
+
+
+def test_race_ranking_at(xctrack_race, tmpdir):
+    # before the start nobody has a distance, at the deadline the ranking follows the race times
+    assert [pilot['distance'] for pilot in xctrack_race.ranking_at(time(11, 0))] == [None, None, None]
+    final = xctrack_race.ranking_at(xctrack_race.task.stop)
+    assert [pilot['id'] for pilot in final] == ['0093', '1611', '0046']
+    assert all(pilot['time'] == xctrack_race.ranking[pilot['id']]['time'] for pilot in final)
+
+    # race distances never decrease, and the leader is the pilot with the longest distance before anyone reaches ESS
+    timeline = list(xctrack_race.ranking_timeline(step=600))
+    assert len(timeline) == 32 and timeline[0][0] == xctrack_race.task.open
+    for (_, before), (_, after) in zip(timeline, timeline[1:]):
+        distances = {pilot['id']: pilot['distance'] or 0 for pilot in before}
+        assert all((pilot['distance'] or 0) >= distances[pilot['id']] for pilot in after)
+    at_14 = xctrack_race.ranking_at(time(14, 0))
+    assert at_14[0]['distance'] == max(pilot['distance'] for pilot in at_14)
+    assert xctrack_race.ranking_at(time(14, 0), top=1) == at_14[:1]
+
+    # stored races rank pilots without reading their flights
+    path = os.path.join(str(tmpdir), 'race.race')
+    xctrack_race.save(path)
+    stored = Race(path=path)
+    assert stored.ranking_at(time(14, 0)) == at_14
+    assert stored.flights._flights == {}
+
+
+def test_race_ranking_at_unvalidated():
+    # flights without goal distances have no progress, so pilots are ranked without a distance
+    tracks = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    race = Race(tracks=tracks, task=task, progress='silent', validate=False)
+    assert [pilot['distance'] for pilot in race.ranking_at(time(14, 0))] == [None, None, None]
+    assert race.ranking.pilots_in_goal == []
+
+
+def test_race_live(xctrack_race, tmpdir):
+    tracks = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    contents = {}
+    for name in os.listdir(tracks):
+        with open(os.path.join(tracks, name), 'rb') as f:
+            contents[name] = f.read()
+
+    # IGC files are written by chunks cutting lines, the race following them as they grow
+    race = Race(tracks=str(tmpdir), task=task, live=True)
+    race.frames
+    for start in range(0, max(len(content) for content in contents.values()), 100000):
+        for name, content in contents.items():
+            with open(os.path.join(str(tmpdir), name), 'ab') as f:
+                f.write(content[start:start + 100000])
+        race.follow(str(tmpdir))
+
+    for pilot_id, flight in xctrack_race.flights.items():
+        np.testing.assert_array_equal(race.flights[pilot_id].goal_distance, flight.goal_distance)
+        assert race.flights[pilot_id].race_time == flight.race_time
+    assert race.ranking_at(time(14, 0)) == xctrack_race.ranking_at(time(14, 0))
+    rows = [race.frames.pilots.index(pilot_id) for pilot_id in xctrack_race.frames.pilots]
+    np.testing.assert_array_equal(race.frames.goal_distance[rows], xctrack_race.frames.goal_distance)
+
+    # the entries of the pilots updated by each ingest end up where ranking every pilot again would put them
+    ranking = Ranking(race)
+    assert race.ranking.pilots == ranking.pilots
+    assert race.ranking.pilots_in_goal == ranking.pilots_in_goal
+
+    # fixes can be ingested directly, fixes before the last one being dropped
+    race.ingest('0093', [(time(12, 0), -22.0, -46.0, 1000, 1000)])
+    assert len(race.flights['0093']) == len(xctrack_race.flights['0093'])
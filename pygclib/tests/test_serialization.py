@@ -0,0 +1,24 @@
+import io
+import json
+from datetime import time
+
+import numpy as np
+import pytest
+from pygclib.serialization.json_encoder import ComplexEncoder
+from pygclib.serialization.json_writer import JSONWriter, Stream
+
+DOCUMENT = {'properties': {'n_snaps': 2}, 'times': [time(12, 0, 1), time(12, 0, 2)], 'values': np.arange(3), 'empty': {}}
+
+
+def _snapshots():
+    yield '12:00:01', {'0046': {'lat': -22.5, 'lon': -45.3, 'goal_distance': None}}
+    yield '12:00:02', {'0046': {'lat': -22.6, 'lon': -45.4, 'goal_distance': 1000.5}, '0093': {'lat': -22.7, 'lon': -45.5}}
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_json_writer_stream(indent):
+    expected = json.dumps(dict(DOCUMENT, race=dict(_snapshots()), nested={'race': {}}), cls=ComplexEncoder, ensure_ascii=False, indent=indent, separators=(',', ':' if indent is None else ': '))
+
+    f = io.StringIO()
+    JSONWriter(f, indent=indent).write(dict(DOCUMENT, race=Stream(_snapshots()), nested={'race': Stream(iter([]))}))
+    assert f.getvalue() == expected
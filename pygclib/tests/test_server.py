@@ -0,0 +1,138 @@
+import asyncio
+import io
+import json
+import os
+import threading
+from datetime import time
+from time import sleep
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from pygclib.core.race import Race
+from pygclib.serialization.json_encoder import ComplexEncoder
+from pygclib.serialization.json_writer import JSONWriter
+from pygclib.serialization.server import ReplayServer
+from pygclib.tests import TEST_DATA
+
+
+@pytest.fixture(scope='module')
+def xctrack_race():
+    tracks = os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks')
+    task = os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk')
+    return Race(tracks=tracks, task=task, progress='silent')
+
+
+def _race_json(race, *query):
+    f = io.StringIO()
+    JSONWriter(f).write(race.serialize(*query)['race'])
+    return f.getvalue()
+
+
+def _serve(server, requests):
+    """Runs requests, a coroutine function of a test client, against server listening on the loopback interface."""
+
+    async def run():
+        async with TestClient(TestServer(server.app)) as client:
+            return await requests(client)
+
+    return asyncio.run(run())
+
+
+def test_server_routes(xctrack_race):
+
+    async def requests(client):
+        properties = await (await client.get('/race')).json()
+        task = await (await client.get('/task')).json()
+        ranking = await (await client.get('/ranking')).json()
+        ranking_at = await (await client.get('/ranking', params={'time': '14:00:00', 'top': '2'})).json()
+        errors = [(await client.get('/ranking', params={'time': 'noon'})).status, (await client.get('/frames', params={'pilots': 'unknown'})).status]
+        return properties, task, ranking, ranking_at, errors
+
+    properties, task, ranking, ranking_at, errors = _serve(ReplayServer(xctrack_race), requests)
+    assert properties == {'open': '11:40:00', 'stop': '17:00:00', 'pilots': list(xctrack_race.flights)}
+    assert task == json.loads(json.dumps(xctrack_race.task, cls=ComplexEncoder))
+    assert [pilot['id'] for pilot in ranking['pilots']] == [pilot['id'] for pilot in xctrack_race.ranking.pilots]
+    assert [pilot['id'] for pilot in ranking_at] == [pilot['id'] for pilot in xctrack_race.ranking_at(time(14, 0), top=2)]
+    assert errors == [400, 400]
+
+
+def test_server_frames(xctrack_race):
+    server = ReplayServer(xctrack_race)
+
+    async def requests(client):
+        full = [await (await client.get('/frames')).text() for _ in range(2)]
+        stats = (server.cache.hits, server.cache.misses)
+        window = await (await client.get('/frames', params={'start': '13:00:00', 'stop': '13:20:00', 'step': '5', 'pilots': '0046,1611'})).text()
+        empty = await (await client.get('/frames', params={'start': '17:00:00'})).text()
+
+        ws = await client.ws_connect('/frames/ws')
+        await ws.send_str(json.dumps({'start': '13:00:00', 'stop': '14:00:00', 'step': 5, 'pilots': ['0046', '1611']}))
+        messages = []
+        while not messages or messages[-1] != {}:
+            messages.append(json.loads(await ws.receive_str()))
+        await ws.send_str(json.dumps({'step': 0}))
+        error = json.loads(await ws.receive_str())
+        await ws.close()
+        return full, stats, window, empty, messages, error
+
+    full, (hits, misses), window, empty, messages, error = _serve(server, requests)
+    assert full[0] == full[1] == _race_json(xctrack_race)
+    assert hits == misses > 0
+
+    # frames are aligned on the task opening, so that windows share their cached chunks
+    assert window == _race_json(xctrack_race, time(13, 0), time(13, 20), 5, ['0046', '1611'])
+    assert empty == '{}'
+
+    # an hour every 5 seconds, from frame 960 to frame 1680, spans three chunks of 300 frames
+    assert len(messages) == 4
+    assert {key: value for message in messages for key, value in message.items()} == json.loads(_race_json(xctrack_race, time(13, 0), time(14, 0), 5, ['0046', '1611']))
+    assert 'error' in error
+
+
+def test_server_concurrent_frames(xctrack_race):
+    server = ReplayServer(xctrack_race)
+    encode_chunk, calls, lock = server._encode_chunk, [], threading.Lock()
+
+    def slow_encode_chunk(*chunk):
+        # the chunk is still being computed when the second request reads the cache
+        with lock:
+            calls.append(chunk)
+        sleep(0.5)
+        return encode_chunk(*chunk)
+
+    server._encode_chunk = slow_encode_chunk
+    params = {'start': '13:00:00', 'stop': '13:01:00'}
+
+    async def requests(client):
+
+        async def get():
+            return await (await client.get('/frames', params=params)).text()
+
+        return await asyncio.gather(get(), get())
+
+    first, second = _serve(server, requests)
+    assert first == second == _race_json(xctrack_race, time(13, 0), time(13, 1))
+    assert len(calls) == 1
+    assert len(server.cache) == 1 and not server._pending
+
+
+def test_server_malformed_frames(xctrack_race):
+    queries = [{'start': 5}, {'stop': ['13:00:00']}, {'pilots': 5}, {'pilots': [46]}, {'step': '5s'}, {'step': None}, {'step': True}, {'start': 'noon'}]
+
+    async def requests(client):
+        ws = await client.ws_connect('/frames/ws')
+        errors = []
+        for query in queries:
+            await ws.send_str(json.dumps(query))
+            errors.append(json.loads(await ws.receive_str()))
+        # the connection survives malformed queries
+        await ws.send_str(json.dumps({'start': '16:59:00', 'pilots': ['0046']}))
+        messages = []
+        while not messages or messages[-1] != {}:
+            messages.append(json.loads(await ws.receive_str()))
+        await ws.close()
+        return errors, messages
+
+    errors, messages = _serve(ReplayServer(xctrack_race), requests)
+    assert all(list(error) == ['error'] for error in errors)
+    assert messages[-1] == {}
@@ -1,9 +1,16 @@
+import copy
 import os
+import pickle
 from datetime import time
 
+import numpy as np
 import pytest
+from pygclib.core.flight import Flight
 from pygclib.core.task import Task
+from pygclib.geography.optimizer import optimize
 from pygclib.tests import TEST_DATA
+from pygclib.core.frames import RaceFrames
+from pygclib.time.timeop import SECONDS_PER_DAY, add_offset, to_seconds
 
 APPROX = 0.005
 
@@ -45,3 +52,97 @@ def test_task_opti(xctask, xctask_b64, pwca_task):
     assert xctask_b64.opti.distance == pytest.approx(94300, APPROX)
     assert pwca_task.opti.distance == pytest.approx(94300, APPROX)
     assert len(xctask) == pytest.approx(len(xctask_b64), APPROX) == pytest.approx(len(pwca_task), APPROX)
+
+
+def test_task_field(xctask):
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks', '0046.igc'))
+    _, field_distances, field_tags = xctask.validate(flight, engine='field')
+    _, route_distances, route_tags = xctask.validate(flight, engine='route')
+    np.testing.assert_array_equal(field_tags, route_tags)
+    assert np.abs(field_distances - route_distances).max() < 0.1
+
+    # the field is sent to validation processes along with the task
+    field = pickle.loads(pickle.dumps(xctask)).field
+    assert field is not xctask.field
+    np.testing.assert_array_equal(field.costs[0], xctask.field.costs[0])
+
+
+@pytest.mark.parametrize('engine', ['route', 'field'])
+def test_task_engines(xctask, engine):
+    # route and field replaced bfgs as the default engines, they must find the same routes, bfgs only stopping further from the optimum
+    bfgs = Task(os.path.join(TEST_DATA, 'tasks', 'pwca_brazil_2019_7.xctsk'), engine='bfgs')
+    assert optimize(bfgs.takeoff, bfgs.turnpoints, engine=engine).distance == pytest.approx(bfgs.opti.distance, abs=1)
+
+    # bfgs stops once its gradient is below OPTIMIZER_PRECISION, up to 120 m above the shortest route on this flight
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_decimated', '0046.igc'))
+    _, expected, expected_tags = bfgs.validate(flight, tolerance=0)
+    _, distances, tags = xctask.validate(flight, engine=engine, tolerance=0)
+    np.testing.assert_array_equal(tags, expected_tags)
+    assert np.all(distances <= expected + 1)
+    assert np.all(distances >= expected - 150)
+
+
+@pytest.mark.parametrize('tolerance', [20, 200])
+def test_task_tolerance(xctask, tolerance):
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks', '0046.igc'))
+    _, exact, exact_tags = xctask.validate(flight, tolerance=0)
+    _, adaptive, adaptive_tags = xctask.validate(flight, tolerance=tolerance)
+    np.testing.assert_array_equal(adaptive_tags, exact_tags)
+    assert np.abs(adaptive - exact).max() < tolerance
+    assert adaptive.min() == exact.min()
+
+
+def test_task_tags(xctask):
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks', '0093.igc'))
+    _, distances, tags = xctask.validate(flight)
+    assert distances.dtype == np.float32 and len(distances) == len(flight)
+    assert len(tags) == len(xctask.turnpoints)
+    assert (np.diff(tags) >= 0).all() and tags[0] >= to_seconds(xctask.start)
+
+    # crossings are interpolated between the fixes on both sides of the cylinder
+    assert (tags % 1).any()
+    fixes = np.searchsorted(flight.seconds, tags)
+    assert (flight.seconds[fixes - 1] <= tags).all() and (tags <= flight.seconds[fixes]).all()
+
+
+def test_task_midnight(xctask):
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks', '0093.igc'))
+    _, distances, tags = xctask.validate(flight)
+
+    # the same flight and task, moved so that midnight falls during the race
+    offset = SECONDS_PER_DAY - to_seconds(time(14, 0))
+    night_flight = Flight.from_columns(flight.pilot_id, flight.pilot_name, (flight.seconds + offset) % SECONDS_PER_DAY, flight.lat, flight.lon, flight.altitude, flight.pressure_altitude)
+    night_task = copy.copy(xctask)
+    night_task.open, night_task.start, night_task.stop = (add_offset(t, seconds=offset) for t in (xctask.open, xctask.start, xctask.stop))
+    assert night_task.stop < night_task.start
+
+    _, night_distances, night_tags = night_task.validate(night_flight)
+    np.testing.assert_array_equal(night_distances, distances)
+    np.testing.assert_allclose(night_tags - night_task.seconds[0], tags - xctask.seconds[0])
+
+    frames = RaceFrames({flight.pilot_id: flight}, xctask.open, xctask.stop)
+    night_frames = RaceFrames({flight.pilot_id: night_flight}, night_task.open, night_task.stop)
+    np.testing.assert_array_equal(night_frames.lat, frames.lat)
+    assert night_frames.column(time(0, 0)) == frames.column(time(14, 0))
+
+
+def test_task_validate_increment(xctask):
+    flight = Flight(os.path.join(TEST_DATA, 'tracks', 'pwca_brazil_2019_7_few_tracks', '0093.igc'))
+    _, goal_distances, tag_times = xctask.validate(flight)
+
+    # fixes appended by chunks are validated as if the flight had been validated at once
+    live = Flight.from_columns(flight.pilot_id, flight.pilot_name, flight.seconds[:50], flight.lat[:50], flight.lon[:50], flight.altitude[:50], flight.pressure_altitude[:50])
+    state, indices, distances, live_tag_times = xctask.validate_increment(live)
+    live.goal_distance[indices] = distances
+    validated = len(indices)
+    for start in range(50, len(flight), 50):
+        chunk = slice(start, start + 50)
+        live.append(flight.seconds[chunk], flight.lat[chunk], flight.lon[chunk], flight.altitude[chunk], flight.pressure_altitude[chunk])
+        state, indices, distances, live_tag_times = xctask.validate_increment(live, state)
+        live.goal_distance[indices] = distances
+        validated += len(indices)
+
+    np.testing.assert_array_equal(live.goal_distance, goal_distances)
+    np.testing.assert_array_equal(live_tag_times, tag_times)
+    # only a few fixes approaching a turnpoint are validated again once the pilot crosses it
+    assert validated < len(flight) + 10
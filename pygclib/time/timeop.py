@@ -1,28 +1,61 @@
-# most of this mess is necessary because you can't add datetime.time objects, which are used by the aerofiles parser
-from datetime import datetime, timedelta, time
+# times are handled as integer seconds since midnight, datetime.time objects only being built at the API and serialization boundaries
+from datetime import time
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+HALF_DAY = SECONDS_PER_DAY // 2
 
 
 def add_times(t1, t2):
-    delta_hour = t1.hour + t2.hour
-    delta_minute = t1.minute + t2.minute
-    delta_second = t1.second + t2.second
-    return time(delta_hour, delta_minute, delta_second)
+    return to_time(to_seconds(t1) + to_seconds(t2))
 
 
 def sub_times(t1, t2):
-    d1 = datetime(1, 1, 1, t1.hour, t1.minute, t1.second)
-    d2 = datetime(1, 1, 1, t2.hour, t2.minute, t2.second)
-    delta = d1 - d2
-    return (datetime.min + delta).time()
+    return to_time(to_seconds(t1) - to_seconds(t2) + (t1.microsecond - t2.microsecond) / 1000000)
 
 
 def next_second(t):
-    d = datetime(1, 1, 1, t.hour, t.minute, t.second)
-    d += timedelta(seconds=1)
-    return d.time()
+    return to_time(to_seconds(t) + 1)
+
+
+def add_offset(t, hours=0, minutes=0, seconds=0):
+    return to_time(to_seconds(t) + 3600 * hours + 60 * minutes + seconds)
+
+
+def to_seconds(t):
+    return 3600 * t.hour + 60 * t.minute + t.second
+
+
+def to_time(seconds):
+    # fractions of seconds, such as interpolated tag times, are kept as microseconds
+    if seconds % 1:
+        seconds, microsecond = divmod(round(seconds * 1000000), 1000000)
+    else:
+        microsecond = 0
+    seconds = int(seconds) % SECONDS_PER_DAY
+    return time(seconds // 3600, seconds % 3600 // 60, seconds % 60, microsecond)
+
+
+def seconds_after(t, reference):
+    """Returns the seconds of t counted from the midnight preceding reference, t being at most one day after reference."""
+    return reference + (to_seconds(t) - reference) % SECONDS_PER_DAY
+
+
+def unwrap_seconds(seconds, reference=None):
+    """
+    Returns timestamps in seconds since midnight, made increasing across midnight.
 
+    A timestamp going back by more than 12 hours from the previous one is moved to the next day. If reference is given,
+    the first timestamp is moved by whole days to be within 12 hours of reference, so that timestamps are counted from the midnight preceding reference.
 
-def add_offset(t, **kwargs):
-    d1 = datetime(10, 10, 10, t.hour, t.minute, t.second)
-    offset = d1 + timedelta(**kwargs)
-    return offset.time()
+    Arguments:
+        seconds (~numpy.ndarray [int]) : Timestamps in seconds since midnight, in chronological order.
+        reference (int) : A time in seconds since midnight, such as the start of a task.
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    if len(seconds) > 1:
+        seconds = seconds + SECONDS_PER_DAY * np.concatenate(([0], np.cumsum(np.diff(seconds) < -HALF_DAY)))
+    if reference is not None and len(seconds) > 0:
+        seconds = seconds + (reference - seconds[0] + HALF_DAY) // SECONDS_PER_DAY * SECONDS_PER_DAY
+    return seconds
@@ -28,13 +28,13 @@ setup(name='pygclib',
       ext_modules=[geolib],
       install_requires=requirements(),
       scripts=['pygclib/bin/pygclib'],
-      python_requires='>=3.5',
+      python_requires='>=3.8',
       classifiers=[
           'Intended Audience :: Developers',
           'Operating System :: Unix',
-          'Programming Language :: Python :: 3.5',
-          'Programming Language :: Python :: 3.6',
-          'Programming Language :: Python :: 3.7',
           'Programming Language :: Python :: 3.8',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
       ],
       zip_safe=True)